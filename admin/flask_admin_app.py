@@ -2,21 +2,43 @@
 # coding: utf-8
 
 import os
-from datetime import datetime
-from flask import Flask, redirect, url_for
+import sys
+import io
+import csv
+import json
+import time
+import zlib
+import zipfile
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape as xml_escape
+from flask import (Flask, redirect, url_for, request, jsonify, abort, g,
+                   Response, stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
 from flask_admin import Admin, expose, AdminIndexView
 from flask_admin.contrib.sqla import ModelView
+from flask_admin.contrib.sqla.filters import FilterEqual
 from flask_basicauth import BasicAuth
+from sqlalchemy import Integer, event, func, or_, select
+from sqlalchemy.exc import IntegrityError
 from dotenv import load_dotenv
 
+# Корень проекта — для общей схемы заявок (schema.py)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from schema import Order as Zayavka, Service, metadata, upgrade_schema, seed_services, sync_url
+import metrics
+
 # 1. Загрузка .env из корня проекта
 load_dotenv('/root/kuzkabuh/.env')
 
 # 2. Конфигурация Flask
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('FLASK_DB_URI')
+# ORDERS_DATABASE_URL — общая с ботом база заявок (см. schema.py)
+ORDERS_DATABASE_URL = os.getenv('ORDERS_DATABASE_URL')
+app.config['SQLALCHEMY_DATABASE_URI'] = (
+    str(sync_url(ORDERS_DATABASE_URL)) if ORDERS_DATABASE_URL else os.getenv('FLASK_DB_URI')
+)
 # Настройка BasicAuth
 app.config['BASIC_AUTH_USERNAME'] = os.getenv('ADMIN_USER')
 app.config['BASIC_AUTH_PASSWORD'] = os.getenv('ADMIN_PASS')
@@ -26,18 +48,8 @@ app.config['BASIC_AUTH_FORCE']    = True
 db         = SQLAlchemy(app)
 basic_auth = BasicAuth(app)
 
-# 4. Модель заявки
-class Zayavka(db.Model):
-    __tablename__ = 'zayavki'
-    id           = db.Column(db.Integer,   primary_key=True)
-    date         = db.Column(db.DateTime,  default=datetime.now, nullable=False)
-    inn          = db.Column(db.String(12), nullable=False)
-    email        = db.Column(db.String(120), nullable=False)
-    name         = db.Column(db.String(50), nullable=False)
-    phone        = db.Column(db.String(25), nullable=False)
-    contact_time = db.Column(db.String(40), nullable=False)
-    service      = db.Column(db.String(80), nullable=False)
-    urgency      = db.Column(db.String(30), nullable=False)
+# 4. Модель заявки — общая с ботом, см. schema.Order
+# (Flask-Admin работает с ней через db.session)
 
 # 5. Кастомный IndexView с кнопкой «Выход»
 class MyAdminIndexView(AdminIndexView):
@@ -51,6 +63,33 @@ class MyAdminIndexView(AdminIndexView):
         return redirect(url_for('.index'))
 
 # 6. Кастомный ModelView для Zayavka
+# COUNT(*) и счётчики по услугам/системам налогообложения на большой таблице
+# дорогие — держим их в кэше несколько секунд и сбрасываем при изменениях.
+class TTLCache:
+    def __init__(self, ttl):
+        self.ttl   = ttl
+        self._data = {}
+
+    def get(self, key, compute):
+        hit = self._data.get(key)
+        now = time.monotonic()
+        if hit is not None and now - hit[0] < self.ttl:
+            return hit[1]
+        value = compute()
+        self._data[key] = (now, value)
+        return value
+
+    def clear(self):
+        self._data.clear()
+
+counts_cache = TTLCache(float(os.getenv('ADMIN_COUNT_TTL', 30)))
+# GROUP BY по всей таблице — самый дорогой запрос списка, а меняется медленно
+facets_cache = TTLCache(float(os.getenv('ADMIN_FACET_TTL', 300)))
+
+def like_prefix(column, term):
+    term = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return column.like(term + '%', escape='\\')
+
 class ZayavkaView(ModelView):
     # Разрешаем создавать, редактировать и удалять заявки
     can_create = True
@@ -68,14 +107,420 @@ class ZayavkaView(ModelView):
         'contact_time':  'Время связи',
         'service':       'Услуга',
         'urgency':       'Система налогообложения',
+        'status':        'Статус',
+        'company_name':   'Организация',
+        'company_status': 'Статус организации',
+        'tax_regime':     'Налоговый режим (по ИНН)',
     }
 
     # Какие столбцы показывать в списке
-    column_list = ['id', 'date', 'inn', 'email', 'name', 'phone', 'contact_time', 'service', 'urgency']
+    column_list = ['id', 'date', 'inn', 'company_name', 'email', 'name', 'phone', 'contact_time',
+                   'service', 'urgency', 'status']
     # Формы добавления/редактирования
-    form_columns = ['inn', 'email', 'name', 'phone', 'contact_time', 'service', 'urgency']
+    form_columns = ['inn', 'company_name', 'company_status', 'tax_regime', 'email', 'name', 'phone',
+                    'contact_time', 'service', 'urgency', 'status']
+
+    # Новые сверху — по первичному ключу, без сортировки
+    column_default_sort = ('id', True)
+    column_filters = ['date', 'service', 'urgency', 'status', 'inn']
+    # Поиск — по началу ИНН, email или телефона (см. _apply_search)
+    column_searchable_list = ['inn', 'email', 'phone']
+    list_template = 'zayavki_list.html'
+
+    # Сколько строк по услуге и системе налогообложения показывать над списком
+    facet_columns = ['service', 'urgency']
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        # Вместо ILIKE '%терм%' по всем полям (полный просмотр таблицы) —
+        # LIKE 'терм%', который идёт по индексам ix_zayavki_inn/email/phone
+        for term in search.split():
+            stmt = or_(*(like_prefix(field, term) for field, _ in self._search_fields))
+            query = query.filter(stmt)
+            if count_query is not None:
+                count_query = count_query.filter(stmt)
+        return query, count_query, joins, count_joins
+
+    def get_list(self, page, sort_column, sort_desc, search, filters,
+                 execute=True, page_size=None):
+        # То же, что ModelView.get_list, но счётчик берётся из кэша, а при
+        # ?after=<№> (кнопка «Загрузить ещё») вместо OFFSET — продолжение
+        # по первичному ключу: WHERE id < № ORDER BY id DESC
+        joins, count_joins = {}, {}
+        query = self.get_query()
+        count_query = self.get_count_query()
+
+        if self._search_supported and search:
+            query, count_query, joins, count_joins = self._apply_search(
+                query, count_query, joins, count_joins, search)
+        if filters and self._filters:
+            query, count_query, joins, count_joins = self._apply_filters(
+                query, count_query, joins, count_joins, filters)
+
+        key = ('count', search or '', tuple(tuple(f) for f in filters or ()))
+        count = counts_cache.get(key, count_query.scalar)
+
+        if sort_column is None:
+            after = request.args.get('after', type=int)
+            if after is not None:
+                query = query.filter(Zayavka.id < after)
+                page = 0
+            # При поиске совпадений мало: id + 0 не даёт планировщику идти
+            # по первичному ключу с проверкой каждой строки — он берёт
+            # префиксные индексы и сортирует найденное
+            order = (Zayavka.id + 0) if search else Zayavka.id
+            query = self._apply_pagination(query.order_by(order.desc()), page, page_size)
+        else:
+            query, joins = self._apply_sorting(query, joins, sort_column, sort_desc)
+            query = self._apply_pagination(query, page, page_size)
+
+        if execute:
+            query = query.all()
+        return count, query
+
+    def facets(self):
+        # {колонка: [(значение, число заявок, ссылка на фильтр), ...]}
+        result = {}
+        for name in self.facet_columns:
+            column = getattr(Zayavka, name)
+            rows = facets_cache.get(name, lambda: (
+                self.session.query(column, func.count())
+                .group_by(column).order_by(func.count().desc()).all()
+            ))
+            arg = next((self.get_filter_arg(i, f) for i, f in enumerate(self._filters)
+                        if type(f) is FilterEqual and f.column.name == name), None)
+            result[name] = [
+                (value, n, url_for('.index_view', **{f'flt0_{arg}': value}) if arg else None)
+                for value, n in rows
+            ]
+        return result
+
+    def render(self, template, **kwargs):
+        if template == self.list_template:
+            kwargs['facets'] = self.facets()
+            data = kwargs.get('data') or []
+            page_size = kwargs.get('page_size')
+            args = request.args.to_dict()
+            args.pop('page', None)
+            kwargs['first_url'] = None
+            if args.pop('after', None) is not None:
+                kwargs['first_url'] = url_for('.index_view', **args)
+            kwargs['more_url'] = None
+            if page_size and len(data) == page_size and 'sort' not in args:
+                kwargs['more_url'] = url_for('.index_view', after=data[-1].id, **args)
+        return super().render(template, **kwargs)
+
+    # Правка в админке видна сразу; заявки из API — по истечении TTL
+    def after_model_change(self, form, model, is_created):
+        counts_cache.clear()
+        facets_cache.clear()
+
+    def after_model_delete(self, model):
+        counts_cache.clear()
+        facets_cache.clear()
+
+# Справочник услуг для клавиатуры бота. Бот перечитывает его не реже раза
+# в SERVICES_CACHE_TTL секунд; выключенная услуга пропадает из клавиатуры,
+# а старые кнопки с ней бот отклонит и покажет свежий список.
+class ServiceView(ModelView):
+    can_delete = False   # id услуги живёт в callback_data уже отправленных кнопок
+    column_labels = {
+        'id':         '№',
+        'title':      'Название',
+        'title_en':   'Название (en)',
+        'position':   'Порядок',
+        'is_active':  'Активна',
+        'updated_at': 'Изменена',
+    }
+    column_list = ['id', 'title', 'title_en', 'position', 'is_active', 'updated_at']
+    form_columns = ['title', 'title_en', 'position', 'is_active']
+    column_editable_list = ['position', 'is_active']
+    column_default_sort = 'position'
+
+# 7. API приёма заявок (FLASK_ADMIN_API)
+# Принимает одну заявку (JSON-объект), массив заявок или NDJSON-поток.
+# Все новые строки вставляются одной пачкой в одной транзакции. В пачке
+# неверные заявки не мешают верным: верные вставляются, ответ 207 с
+# ids (null на месте отклонённой) и errors по индексам — отправитель
+# откладывает только отклонённые. Одиночная неверная заявка — 400.
+API_FIELDS = [c for c in Zayavka.__table__.columns
+              if not c.primary_key and c.name not in ('date', 'status')]
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonl', 'application/json-seq')
+
+def parse_orders():
+    if request.mimetype in NDJSON_MIMETYPES:
+        try:
+            items = [json.loads(line) for line in request.get_data(as_text=True).splitlines()
+                     if line.strip()]
+        except ValueError:
+            abort(400, 'Некорректный NDJSON')
+        return items, True
+    payload = request.get_json(force=True)
+    if isinstance(payload, list):
+        return payload, True
+    return [payload], False
+
+def validate_order(item):
+    if not isinstance(item, dict):
+        return None, {'_': 'ожидается объект'}
+    row, errors = {}, {}
+    for col in API_FIELDS:
+        value = item.get(col.name)
+        if value is None or str(value).strip() == '':
+            if not col.nullable:
+                errors[col.name] = 'обязательное поле'
+            continue
+        if isinstance(col.type, Integer):
+            try:
+                row[col.name] = int(value)
+            except (TypeError, ValueError):
+                errors[col.name] = 'ожидается число'
+            continue
+        value = str(value).strip()
+        if col.type.length and len(value) > col.type.length:
+            errors[col.name] = f'не длиннее {col.type.length} символов'
+            continue
+        row[col.name] = value
+    return row, errors
+
+def insert_orders(rows):
+    # Возвращает id для каждой строки; строки с уже известным
+    # idempotency_key не вставляются повторно.
+    keys = {r['idempotency_key'] for r in rows if r.get('idempotency_key')}
+    known = {}
+    if keys:
+        known = dict(db.session.query(Zayavka.idempotency_key, Zayavka.id)
+                     .filter(Zayavka.idempotency_key.in_(keys)))
+    objs, pending = [], {}
+    for r in rows:
+        key = r.get('idempotency_key')
+        if key in known:
+            objs.append(known[key])
+        elif key and key in pending:
+            objs.append(pending[key])
+        else:
+            obj = Zayavka(**r)
+            if key:
+                pending[key] = obj
+            objs.append(obj)
+    db.session.add_all(o for o in objs if isinstance(o, Zayavka))
+    db.session.commit()
+    return [o.id if isinstance(o, Zayavka) else o for o in objs]
+
+@app.route('/api/zayavki', methods=['POST'])
+def api_create_zayavki():
+    items, many = parse_orders()
+    rows, errors = [], []
+    for i, item in enumerate(items):
+        row, err = validate_order(item)
+        if err:
+            errors.append({'index': i, 'errors': err})
+        else:
+            rows.append((i, row))
+    if errors and not many:
+        return jsonify(ok=False, errors=errors), 400
+    if not rows:
+        return jsonify(ok=not errors, ids=[None] * len(items), errors=errors), 207 if errors else 200
+
+    valid = [row for _, row in rows]
+    try:
+        inserted = insert_orders(valid)
+    except IntegrityError:
+        # параллельный запрос с тем же ключом успел раньше — повторяем,
+        # теперь эти ключи найдутся среди существующих
+        db.session.rollback()
+        inserted = insert_orders(valid)
+
+    if not many:
+        return jsonify(ok=True, id=inserted[0]), 201
+    ids = [None] * len(items)
+    for (i, _), id_ in zip(rows, inserted):
+        ids[i] = id_
+    if errors:
+        return jsonify(ok=False, ids=ids, errors=errors), 207
+    return jsonify(ok=True, ids=ids), 201
+
+# 8. Выгрузка заявок в CSV/XLSX
+# /export/zayavki.csv?date_from=2025-01-01&date_to=2025-01-31&service=...&urgency=...
+# Строки читаются курсором пачками по EXPORT_BATCH и сразу уходят клиенту —
+# память не зависит от размера выгрузки. CSV сжимается gzip на лету, если
+# клиент его принимает; XLSX — zip-архив сам по себе.
+EXPORT_BATCH   = int(os.getenv('EXPORT_BATCH', 2000))
+EXPORT_COLUMNS = ZayavkaView.column_list
+EXPORT_HEADERS = [ZayavkaView.column_labels.get(c, c) for c in EXPORT_COLUMNS]
+
+def parse_day(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        abort(400, f'{name}: ожидается дата ГГГГ-ММ-ДД')
+
+def export_query():
+    query = select(*(getattr(Zayavka, c) for c in EXPORT_COLUMNS)).order_by(Zayavka.id)
+    date_from, date_to = parse_day('date_from'), parse_day('date_to')
+    if date_from:
+        query = query.where(Zayavka.date >= date_from)
+    if date_to:
+        query = query.where(Zayavka.date < date_to + timedelta(days=1))
+    for name in ('service', 'urgency'):
+        if request.args.get(name):
+            query = query.where(getattr(Zayavka, name) == request.args[name])
+    return query
+
+def export_batches(query):
+    # yield_per включает серверный курсор (stream_results) там, где он есть
+    result = db.session.execute(query.execution_options(yield_per=EXPORT_BATCH))
+    for rows in result.partitions():
+        yield rows
+
+# Текст из заявок приходит от пользователей бота: ячейку, начинающуюся с
+# этих символов, Excel/LibreOffice примут за формулу (=HYPERLINK(...) и т.п.),
+# поэтому такие значения выгружаются с апострофом впереди — как текст
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def format_cell(value):
+    if isinstance(value, datetime):
+        return value.strftime('%d.%m.%Y %H:%M')
+    if value is None:
+        return ''
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return str(value)
+
+def csv_chunks(query):
+    # UTF-8 с BOM и «;» — так файл сразу открывается в русском Excel
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter=';')
+    buf.write('\ufeff')
+    writer.writerow(EXPORT_HEADERS)
+    for rows in export_batches(query):
+        writer.writerows([format_cell(v) for v in row] for row in rows)
+        yield buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue().encode('utf-8')
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)   # 31 — формат gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+class ChunkSink:
+    # Несжимаемый поток для zipfile: всё записанное забирается take()
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+XLSX_PARTS = {
+    '[Content_Types].xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    '_rels/.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>',
+    'xl/workbook.xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Заявки" sheetId="1" r:id="rId1"/></sheets></workbook>',
+    'xl/_rels/workbook.xml.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>',
+}
+
+def xlsx_row(values):
+    # Строки — inline strings (без общей таблицы строк, которую пришлось бы
+    # держать в памяти целиком), числа — как есть
+    cells = []
+    for value in values:
+        if isinstance(value, int) and not isinstance(value, bool):
+            cells.append(f'<c><v>{value}</v></c>')
+        else:
+            cells.append(f'<c t="inlineStr"><is><t>{xml_escape(format_cell(value))}</t></is></c>')
+    return '<row>' + ''.join(cells) + '</row>'
+
+def xlsx_chunks(query):
+    sink = ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, body in XLSX_PARTS.items():
+            zf.writestr(name, body)
+        with zf.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                        b'<sheetData>')
+            sheet.write(xlsx_row(EXPORT_HEADERS).encode('utf-8'))
+            for rows in export_batches(query):
+                sheet.write(''.join(xlsx_row(row) for row in rows).encode('utf-8'))
+                yield sink.take()
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.take()
+
+EXPORT_FORMATS = {
+    'csv':  (csv_chunks, 'text/csv; charset=utf-8'),
+    'xlsx': (xlsx_chunks, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+@app.route('/export/zayavki.<fmt>')
+def export_zayavki(fmt):
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    make_chunks, mimetype = EXPORT_FORMATS[fmt]
+    chunks = make_chunks(export_query())
+    headers = {'Content-Disposition':
+               f'attachment; filename="zayavki-{datetime.now():%Y%m%d-%H%M}.{fmt}"'}
+    if fmt == 'csv' and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+# 9. Метрики: время и число запросов по эндпоинтам, отдача на /metrics
+# (под тем же BasicAuth). У потоковой выгрузки меряется время до начала
+# ответа — сама передача идёт уже после after_request.
+HTTP_SECONDS = metrics.histogram(
+    'admin_http_request_seconds', 'Время запроса к админке', ['endpoint', 'method', 'status'])
+
+@app.before_request
+def _metrics_start():
+    g.metrics_t0 = time.perf_counter()
+
+@app.after_request
+def _metrics_finish(response):
+    t0 = g.pop('metrics_t0', None)
+    if t0 is not None:
+        HTTP_SECONDS.observe(time.perf_counter() - t0, endpoint=request.endpoint or 'unknown',
+                             method=request.method, status=response.status_code)
+    return response
+
+@app.route(os.getenv('METRICS_PATH', '/metrics'))
+def metrics_endpoint():
+    return Response(metrics.render(), headers={'Content-Type': metrics.CONTENT_TYPE})
 
-# 7. Создаем и запускаем Admin
+# 10. Создаем и запускаем Admin
 admin = Admin(
     app,
     name="BUH.KUZ’KA — Админка",
@@ -83,12 +528,21 @@ admin = Admin(
     template_mode='bootstrap4'
 )
 admin.add_view(ZayavkaView(Zayavka, db.session, name='Заявки', endpoint='zayavki'))
+admin.add_view(ServiceView(Service, db.session, name='Услуги', endpoint='services'))
 
-# 8. Создаем таблицы, если их ещё нет
+# 11. Создаем таблицы, если их ещё нет, и добавляем новые колонки и индексы
 with app.app_context():
-    db.create_all()
+    # В SQLite LIKE 'терм%' использует индекс только в регистрозависимом режиме
+    if db.engine.dialect.name == 'sqlite':
+        @event.listens_for(db.engine, 'connect')
+        def _sqlite_pragmas(dbapi_conn, _):
+            dbapi_conn.execute('PRAGMA case_sensitive_like=ON')
+    with db.engine.begin() as conn:
+        metadata.create_all(conn)
+        upgrade_schema(conn, metadata)
+        seed_services(conn)
 
-# 9. Запуск
+# 12. Запуск
 if __name__ == '__main__':
     port = int(os.getenv('FLASK_ADMIN_PORT', 59000))
     app.run(host='0.0.0.0', port=port, debug=False)
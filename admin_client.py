@@ -0,0 +1,110 @@
+# admin_client.py
+# coding: utf-8
+#
+# Асинхронный клиент API админки (FLASK_ADMIN_API).
+# Одна ClientSession с пулом соединений на всё время жизни бота:
+# открывается в on_startup, закрывается в on_shutdown.
+
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+# Статусы, при которых есть смысл повторить запрос
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# 4xx, которые говорят о настройке бота (адрес, логин), а не о самой
+# заявке: такой запрос тоже повторяем, когда настройку исправят
+CONFIG_STATUSES = {401, 403, 404, 405}
+
+API_SECONDS = metrics.histogram(
+    'admin_api_request_seconds', 'Время запроса к API админки с повторами', ['outcome'])
+API_ATTEMPTS = metrics.counter(
+    'admin_api_attempts_total', 'Попытки запроса к API админки', ['result'])
+
+
+class AdminApiError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+    @property
+    def permanent(self):
+        # Админка отклонила сами данные — повтор того же запроса не поможет
+        return (self.status is not None and 400 <= self.status < 500
+                and self.status not in RETRY_STATUSES and self.status not in CONFIG_STATUSES)
+
+
+class AdminApiClient:
+    def __init__(self, url, user=None, password=None, *,
+                 timeout=5, retries=3, backoff=0.5,
+                 pool_size=20, keepalive_timeout=30):
+        self.url       = url
+        self.auth      = aiohttp.BasicAuth(user, password) if user else None
+        self.timeout   = aiohttp.ClientTimeout(total=timeout)
+        self.retries   = retries
+        self.backoff   = backoff
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self._session  = None
+
+    async def start(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                auth=self.auth,
+                timeout=self.timeout,
+                raise_for_status=False,
+            )
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def post(self, payload):
+        # POST с ограниченным числом повторов и экспоненциальной паузой.
+        # Возвращает разобранный JSON ответа (или None, если тело пустое).
+        outcome = 'error'
+        t0 = time.perf_counter()
+        try:
+            result = await self._post(payload)
+            outcome = 'ok'
+            return result
+        finally:
+            API_SECONDS.observe(time.perf_counter() - t0, outcome=outcome)
+
+    async def _post(self, payload):
+        if self._session is None:
+            await self.start()
+
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                async with self._session.post(self.url, json=payload) as resp:
+                    API_ATTEMPTS.inc(result=str(resp.status))
+                    if resp.status in RETRY_STATUSES:
+                        last_error = AdminApiError(f"HTTP {resp.status}", resp.status)
+                        continue
+                    if resp.status >= 400:
+                        # 4xx — повтор не поможет
+                        raise AdminApiError(f"HTTP {resp.status}: {await resp.text()}", resp.status)
+                    if resp.content_type == 'application/json':
+                        return await resp.json()
+                    return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+                API_ATTEMPTS.inc(result=type(e).__name__)
+                log.warning("Admin API attempt %s failed: %r", attempt + 1, e)
+        raise AdminApiError(f"Admin API unavailable: {last_error!r}",
+                            getattr(last_error, 'status', None))
@@ -0,0 +1,218 @@
+# antiflood.py
+# coding: utf-8
+#
+# Защита ботов от флуда и повторов:
+#   AntiFlood — middleware aiogram. Апдейт с уже виденным update_id и
+#               callback_query с уже виденным id (повторная доставка)
+#               обрабатываются один раз; сверх лимита скользящего окна на
+#               пользователя и на чат апдейты отбрасываются до хэндлеров.
+#   AntiFlood.claim_order / release_order — заявка с тем же содержимым
+#               принимается один раз за окно, от одного пользователя — не
+#               больше order_limit заявок за окно.
+# Состояние хранится в бэкенде, он выбирается переменной ANTIFLOOD_STORAGE:
+#   memory (по умолчанию) — в памяти процесса, O(1) на ключ;
+#   redis  — общий для реплик, ANTIFLOOD_REDIS_URL (ставится отдельно:
+#            pip install redis).
+
+import hashlib
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+import metrics
+
+DROPPED = metrics.counter(
+    'antiflood_dropped_total', 'Отброшенные апдейты и заявки по причине', ['bot', 'reason'])
+
+
+# -- бэкенды: hit(key, limit, window) -> bool, mark(key, ttl) -> bool, unmark(key) --
+#
+# Скользящее окно считается по двум соседним фиксированным окнам: к счётчику
+# текущего добавляется та доля предыдущего, что ещё попадает в окно. Это два
+# числа на ключ вместо списка отметок времени. Отклонённые попытки тоже
+# считаются: пока флуд не прекратится, окно не освободится.
+
+class MemoryBackend:
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._windows = OrderedDict()   # key -> [номер окна, в текущем, в предыдущем]
+        self._marks   = OrderedDict()   # key -> истекает
+
+    async def hit(self, key, limit, window):
+        now = time.monotonic()
+        idx = int(now // window)
+        rec = self._windows.get(key)
+        if rec is None:
+            rec = self._windows[key] = [idx, 0, 0]
+            if len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+        elif rec[0] != idx:
+            rec[2] = rec[1] if rec[0] == idx - 1 else 0
+            rec[0], rec[1] = idx, 0
+        self._windows.move_to_end(key)
+        rec[1] += 1
+        return rec[1] + rec[2] * (1 - now % window / window) <= limit
+
+    async def mark(self, key, ttl):
+        # True — ключ поставлен впервые, False — уже стоит
+        now = time.monotonic()
+        expires = self._marks.get(key)
+        if expires is not None and expires > now:
+            return False
+        self._marks[key] = now + ttl
+        self._marks.move_to_end(key)
+        # в начале — самые старые отметки; чистим, пока они истекли
+        while self._marks and (len(self._marks) > self.max_keys
+                               or next(iter(self._marks.values())) <= now):
+            self._marks.popitem(last=False)
+        return True
+
+    async def unmark(self, key):
+        self._marks.pop(key, None)
+
+    async def close(self):
+        pass
+
+
+class RedisBackend:
+    def __init__(self, url, prefix='antiflood:'):
+        from redis.asyncio import Redis
+        self.redis  = Redis.from_url(url)
+        self.prefix = prefix
+
+    async def hit(self, key, limit, window):
+        # Общие для реплик окна — по системному времени, один запрос к Redis
+        now = time.time()
+        idx = int(now // window)
+        current = f'{self.prefix}{key}:{idx}'
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.incr(current)
+            pipe.expire(current, math.ceil(window * 2))
+            pipe.get(f'{self.prefix}{key}:{idx - 1}')
+            count, _, previous = await pipe.execute()
+        return count + int(previous or 0) * (1 - now % window / window) <= limit
+
+    async def mark(self, key, ttl):
+        return bool(await self.redis.set(self.prefix + key, 1, nx=True, ex=math.ceil(ttl)))
+
+    async def unmark(self, key):
+        await self.redis.delete(self.prefix + key)
+
+    async def close(self):
+        await self.redis.close()
+
+
+def create_backend(kind=None):
+    kind = (kind or os.getenv('ANTIFLOOD_STORAGE', 'memory')).lower()
+    if kind == 'memory':
+        return MemoryBackend()
+    if kind == 'redis':
+        return RedisBackend(os.getenv('ANTIFLOOD_REDIS_URL', 'redis://localhost:6379/0'))
+    raise ValueError(f"Неизвестный ANTIFLOOD_STORAGE: {kind}")
+
+
+# Поля, по которым заявки считаются одинаковыми (без учёта регистра и пробелов)
+ORDER_KEY_FIELDS = ('inn', 'email', 'name', 'phone', 'contact_time', 'service', 'urgency')
+
+
+def order_fingerprint(order):
+    values = [str(order.get(f) or '').strip().lower() for f in ORDER_KEY_FIELDS]
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False).encode()).hexdigest()
+
+
+class AntiFlood(BaseMiddleware):
+    # notice(event) -> текст, которым один раз за окно отвечают на флуд;
+    # None — отбрасывать молча. Ключи в бэкенде начинаются с имени бота:
+    # боты в одном процессе (launcher.py) и одном Redis друг другу не мешают.
+
+    def __init__(self, bot_name, backend=None, *, user_limit=30, chat_limit=60, window=60,
+                 update_ttl=3600, order_limit=5, order_window=3600, order_dedup_window=600,
+                 notice=None):
+        super().__init__()
+        self.bot_name   = bot_name
+        self.backend    = backend or MemoryBackend()
+        self.user_limit = user_limit
+        self.chat_limit = chat_limit
+        self.window     = window
+        self.update_ttl = update_ttl
+        self.order_limit        = order_limit
+        self.order_window       = order_window
+        self.order_dedup_window = order_dedup_window
+        self.notice = notice
+
+    def _drop(self, reason):
+        DROPPED.inc(bot=self.bot_name, reason=reason)
+        raise CancelHandler()
+
+    async def _repeated(self, key, ttl):
+        return not await self.backend.mark(f'{self.bot_name}:{key}', ttl)
+
+    async def _throttled(self, user_id, chat_id):
+        if user_id is not None and not await self.backend.hit(
+                f'{self.bot_name}:user:{user_id}', self.user_limit, self.window):
+            return 'user_rate'
+        if chat_id is not None and chat_id != user_id and not await self.backend.hit(
+                f'{self.bot_name}:chat:{chat_id}', self.chat_limit, self.window):
+            return 'chat_rate'
+        return None
+
+    async def _warn_once(self, user_id):
+        # Предупреждение — одно за окно, иначе флуд расходует квоту Bot API;
+        # без отправителя (посты каналов) предупреждать некого
+        return (self.notice is not None and user_id is not None
+                and not await self._repeated(f'warned:{user_id}', self.window))
+
+    # -- middleware --
+
+    async def on_pre_process_update(self, update, data):
+        # Повтор от Telegram; в режиме queue его обычно отсекает ещё
+        # webhook_pipeline, но только в своём процессе
+        if await self._repeated(f'update:{update.update_id}', self.update_ttl):
+            self._drop('update_repeat')
+
+    async def on_pre_process_message(self, message, data):
+        user_id = message.from_user.id if message.from_user else None
+        reason = await self._throttled(user_id, message.chat.id)
+        if reason:
+            if await self._warn_once(user_id):
+                await message.answer(self.notice(message))
+            self._drop(reason)
+
+    async def on_pre_process_callback_query(self, cq, data):
+        if await self._repeated(f'callback:{cq.id}', self.update_ttl):
+            self._drop('callback_repeat')
+        reason = await self._throttled(cq.from_user.id, cq.message.chat.id if cq.message else None)
+        if reason:
+            # на отброшенный callback всё равно отвечаем, иначе у кнопки
+            # крутятся «часики» до таймаута клиента
+            if await self._warn_once(cq.from_user.id):
+                await cq.answer(self.notice(cq))
+            else:
+                await cq.answer()
+            self._drop(reason)
+
+    # -- заявки --
+
+    async def claim_order(self, user_id, order):
+        # None — заявку можно сохранять; иначе причина отказа. После
+        # неудачного сохранения — release_order, чтобы повтор прошёл.
+        if await self._repeated(f'order:{order_fingerprint(order)}', self.order_dedup_window):
+            DROPPED.inc(bot=self.bot_name, reason='order_repeat')
+            return 'order_repeat'
+        if not await self.backend.hit(f'{self.bot_name}:orders:{user_id}',
+                                      self.order_limit, self.order_window):
+            await self.release_order(order)
+            DROPPED.inc(bot=self.bot_name, reason='order_rate')
+            return 'order_rate'
+        return None
+
+    async def release_order(self, order):
+        await self.backend.unmark(f'{self.bot_name}:order:{order_fingerprint(order)}')
+
+    async def close(self):
+        await self.backend.close()
@@ -0,0 +1,121 @@
+# bench_admin_list.py
+# coding: utf-8
+#
+# Время ответа списка заявок в админке (/admin/zayavki/) на большой таблице:
+# база наполняется до --rows строк, затем через тестовый клиент Flask
+# замеряются первая страница, глубокая страница по OFFSET, «Загрузить ещё»
+# по ключу, фильтр по услуге и префиксный поиск по ИНН/телефону — с пустыми
+# кэшами счётчиков (cold) и с заполненными (warm).
+#
+#   python bench/bench_admin_list.py --rows 1000000 --db /tmp/bench_admin.db
+
+import argparse
+import base64
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+SERVICES = ['Бухгалтерское сопровождение', 'Регистрация ООО', 'Регистрация ИП',
+            'Нулевая отчётность', 'Консультация', 'Кадровый учёт']
+URGENCIES = ['УСН', 'ОСНО', 'Патент', 'НПД']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--db', default='/tmp/bench_admin.db')
+    parser.add_argument('--chunk', type=int, default=50_000)
+    parser.add_argument('--repeat', type=int, default=30)
+    return parser.parse_args()
+
+
+def seed(app, db, Zayavka, rows, chunk):
+    rnd = random.Random(42)
+    start = datetime(2023, 1, 1)
+    with app.app_context():
+        seeded = 0
+        while seeded < rows:
+            n = min(chunk, rows - seeded)
+            db.session.execute(Zayavka.__table__.insert(), [{
+                'date': start + timedelta(seconds=30 * (seeded + i)),
+                'inn': f"{rnd.randrange(10**9, 10**10)}",
+                'email': f"client{rnd.randrange(10**6)}@example.ru",
+                'name': 'Клиент',
+                'phone': f"+79{rnd.randrange(10**9):09d}",
+                'contact_time': 'Днём',
+                'service': rnd.choice(SERVICES),
+                'urgency': rnd.choice(URGENCIES),
+            } for i in range(n)])
+            db.session.commit()
+            seeded += n
+
+
+def timed(client, url, headers, repeat, before=None):
+    samples = []
+    for _ in range(repeat):
+        if before:
+            before()
+        t0 = time.perf_counter()
+        resp = client.get(url, headers=headers)
+        samples.append(time.perf_counter() - t0)
+        assert resp.status_code == 200, (url, resp.status_code)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95)]
+
+
+def main(args):
+    from flask_admin.contrib.sqla.filters import FilterEqual
+    import flask_admin_app as admin_app
+    from flask_admin_app import app, db, Zayavka, counts_cache, facets_cache
+
+    def clear_caches():
+        counts_cache.clear()
+        facets_cache.clear()
+
+    t0 = time.perf_counter()
+    seed(app, db, Zayavka, args.rows, args.chunk)
+    print(f"seeded {args.rows} rows in {time.perf_counter() - t0:.1f}s")
+    with app.app_context():
+        last_id = db.session.query(db.func.max(Zayavka.id)).scalar()
+
+    token = base64.b64encode(b'bench:bench').decode()
+    headers = {'Authorization': f'Basic {token}'}
+    client = app.test_client()
+    view = next(v for v in admin_app.admin._views if v.endpoint == 'zayavki')
+    with app.test_request_context():
+        service_arg = next(view.get_filter_arg(i, f) for i, f in enumerate(view._filters)
+                           if f.column.name == 'service' and type(f) is FilterEqual)
+
+    urls = [
+        ('first page', '/admin/zayavki/'),
+        ('offset page 500', '/admin/zayavki/?page=500'),
+        ('keyset after', f'/admin/zayavki/?after={last_id - 500 * 20}'),
+        ('sort by date', '/admin/zayavki/?sort=1&desc=1'),
+        ('filter service', f'/admin/zayavki/?flt0_{service_arg}={SERVICES[1]}'),
+        ('search INN prefix', '/admin/zayavki/?search=77012'),
+        ('search phone prefix', '/admin/zayavki/?search=%2B7912'),
+    ]
+    print(f"{'query':<22} {'cold p50':>9} {'cold p95':>9} {'warm p50':>9} {'warm p95':>9}  (ms)")
+    for name, url in urls:
+        cold = timed(client, url, headers, max(3, args.repeat // 5), before=clear_caches)
+        warm = timed(client, url, headers, args.repeat)
+        print(f"{name:<22} {cold[0] * 1e3:>9.1f} {cold[1] * 1e3:>9.1f} "
+              f"{warm[0] * 1e3:>9.1f} {warm[1] * 1e3:>9.1f}")
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    # отдельная база, рабочая zayavki.db не затрагивается
+    os.environ['FLASK_DB_URI'] = f"sqlite:///{args.db}"
+    os.environ['FLASK_SECRET_KEY'] = 'bench'
+    os.environ['ADMIN_USER'] = 'bench'
+    os.environ['ADMIN_PASS'] = 'bench'
+    sys.path.insert(0, os.path.join(ROOT, 'admin'))
+    main(args)
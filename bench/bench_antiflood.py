@@ -0,0 +1,137 @@
+# bench_antiflood.py
+# coding: utf-8
+#
+# Защита от флуда и повторов (antiflood.py):
+#   - стоимость hit/mark бэкенда в памяти и память на ключ;
+#   - через настоящий вебхук (заглушки Bot API и админки из loadtest.py):
+#     повторная доставка апдейта и callback_query «Да, отправить», повторный
+#     проход анкеты с теми же данными — в админку уходит одна заявка;
+#     поток сообщений от одного пользователя — бот отвечает не больше
+#     ANTIFLOOD_USER_LIMIT раз и одно предупреждение.
+#
+#   python bench/bench_antiflood.py --flood 200
+
+import argparse
+import asyncio
+import os
+import random
+import signal
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import aiohttp
+from aiohttp import web
+
+from bench_startup import METRICS_TOKEN, wait_ready
+from loadtest import (ADMIN_CHAT, ROOT, TOKEN, WEBHOOK_PATH, Results, Stub,
+                      callback_update, message_update, script, send)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--flood', type=int, default=200, help='сообщений от одного пользователя')
+    parser.add_argument('--user-limit', type=int, default=30)
+    parser.add_argument('--stub-port', type=int, default=18190)
+    parser.add_argument('--bot-port', type=int, default=18191)
+    return parser.parse_args()
+
+
+async def backend_costs(n=100_000):
+    sys.path.insert(0, ROOT)
+    from antiflood import MemoryBackend
+    backend = MemoryBackend()
+    t0 = time.perf_counter()
+    for _ in range(n):
+        await backend.hit('user:1', 30, 60)
+    hit = (time.perf_counter() - t0) / n
+    t0 = time.perf_counter()
+    for i in range(n):
+        await backend.mark(f'callback:{i}', 60)
+    mark = (time.perf_counter() - t0) / n
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for i in range(n):
+        await backend.hit(f'kuzkabuh:user:{i}', 30, 60)
+    per_key = (tracemalloc.get_traced_memory()[0] - before) / n
+    tracemalloc.stop()
+    print(f"memory backend: hit {hit * 1e6:.2f} µs, mark {mark * 1e6:.2f} µs, "
+          f"{per_key:.0f} байт на ключ окна (вместе с ключом)")
+
+
+async def post(session, url, update):
+    async with session.post(url, json=update) as resp:
+        await resp.read()
+
+
+async def fill_order(session, url, stub, chat_id, results):
+    # Анкета без опечаток; -> апдейт «Да, отправить»
+    rnd = random.Random(chat_id)
+    markup, message_id, last = None, None, None
+    for step, action in script(chat_id, rnd):
+        if action[0] == 'text':
+            update = message_update(chat_id, action[1])
+        else:
+            update = callback_update(chat_id, action[1](markup), message_id)
+        last = update
+        message_id, markup = await send(session, url, stub, chat_id, update, results, step, 5)
+    return last
+
+
+async def main(args):
+    await backend_costs()
+
+    stub = Stub(api_latency=0.005, admin_latency=0.005)
+    app = web.Application()
+    app.router.add_route('*', '/bot{token}/{method}', stub.telegram)
+    app.router.add_post('/api/zayavki', stub.admin)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', args.stub_port).start()
+
+    tmp = tempfile.mkdtemp(prefix='bench_antiflood_')
+    env = dict(os.environ,
+               FSM_STORAGE='memory', DATABASE_URL=f'sqlite+aiosqlite:///{tmp}/bot.db',
+               ADMIN_DIGEST_WINDOW='0.2', ANTIFLOOD_USER_LIMIT=str(args.user_limit),
+               KUZKABUH_BOT_TOKEN=TOKEN, KUZKABUH_WEBHOOK_PATH=WEBHOOK_PATH,
+               WEBHOOK_HOST='https://bench.example',
+               TELEGRAM_API_SERVER=f'http://127.0.0.1:{args.stub_port}',
+               FLASK_ADMIN_API=f'http://127.0.0.1:{args.stub_port}/api/zayavki',
+               ADMIN_TELEGRAM_ID=str(ADMIN_CHAT),
+               LAUNCHER_BOTS='kuzkabuh', LAUNCHER_PORT=str(args.bot_port),
+               METRICS_TOKEN=METRICS_TOKEN)
+    log = open(os.path.join(tmp, 'bot.log'), 'wb')
+    bot = await asyncio.create_subprocess_exec(sys.executable, 'launcher.py', env=env, cwd=ROOT,
+                                               stdout=log, stderr=log)
+    url = f'http://127.0.0.1:{args.bot_port}{WEBHOOK_PATH}'
+    try:
+        await wait_ready([f'{url}/stats?token={METRICS_TOKEN}'], time.monotonic() + 30)
+        results = Results()
+        async with aiohttp.ClientSession() as session:
+            confirm = await fill_order(session, url, stub, 20_000, results)
+            # повтор того же апдейта и того же callback_query с новым update_id
+            await post(session, url, confirm)
+            await post(session, url, dict(confirm, update_id=confirm['update_id'] + 10 ** 6))
+            # та же анкета ещё раз
+            await fill_order(session, url, stub, 20_000, results)
+            await asyncio.sleep(1)
+            print(f"одна заявка, отправленная 4 раза: в админку ушло {len(stub.orders)}")
+
+            flooder = 30_000
+            t0 = time.perf_counter()
+            await asyncio.gather(*(post(session, url, message_update(flooder, '/start'))
+                                   for _ in range(args.flood)))
+            await asyncio.sleep(1)
+            print(f"{args.flood} /start за {time.perf_counter() - t0 - 1:.2f} с: "
+                  f"ответов бота {stub.replies[flooder]} (лимит {args.user_limit} + предупреждение)")
+    finally:
+        bot.send_signal(signal.SIGINT)
+        await bot.wait()
+        await runner.cleanup()
+        log.close()
+    print(f"лог бота: {log.name}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,141 @@
+# bench_dispatch.py
+# coding: utf-8
+#
+# Пропускная способность диспетчера kuzkabuh_bot: поддельные апдейты
+# (шаги анкеты до подтверждения, включая неверный ввод) прогоняются через
+# dp.process_update, запросы к Bot API подменены заглушкой. Каждая анкета
+# должна дойти до подтверждения — иначе бенчмарк падает.
+#
+#   python bench/bench_dispatch.py --chats 200 --rounds 5
+
+import argparse
+import asyncio
+import importlib.util
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+os.environ.setdefault('KUZKABUH_BOT_TOKEN', '123456:BENCH')
+os.environ.setdefault('ADMIN_TELEGRAM_ID', '1')
+os.environ.setdefault('FLASK_ADMIN_API', 'http://127.0.0.1:9/api/zayavki')
+os.environ.setdefault('FSM_STORAGE', 'memory')
+# справочник услуг читается из базы бота
+os.environ.setdefault('DATABASE_URL',
+                      f"sqlite+aiosqlite:///{tempfile.mkdtemp(prefix='bench_dispatch_')}/bot.db")
+
+
+def load_bot():
+    path = os.path.join(ROOT, 'bots', 'kuzkabuh_bot', 'bot.py')
+    spec = importlib.util.spec_from_file_location('kuzkabuh_bot', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+async def fake_request(method, data=None, files=None, **kwargs):
+    if method == 'answerCallbackQuery':
+        return True
+    if method == 'getMe':
+        return {'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+    return {'message_id': 1, 'date': 0, 'chat': {'id': data.get('chat_id', 1), 'type': 'private'}}
+
+
+update_ids = itertools.count(1)
+
+
+def message_update(chat_id, text):
+    return {
+        'update_id': next(update_ids),
+        'message': {
+            'message_id': 1, 'date': 0, 'text': text,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'},
+        },
+    }
+
+
+def callback_update(chat_id, data):
+    return {
+        'update_id': next(update_ids),
+        'callback_query': {
+            'id': str(next(update_ids)), 'chat_instance': '1', 'data': data,
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'},
+            'message': {
+                'message_id': 1, 'date': 0, 'text': '-',
+                'chat': {'id': chat_id, 'type': 'private'},
+            },
+        },
+    }
+
+
+def flow(chat_id, service):
+    # service — callback_data кнопки услуги («svc:<id>»)
+    return [
+        message_update(chat_id, '/start'),
+        callback_update(chat_id, 'new_order'),
+        message_update(chat_id, '12345'),
+        message_update(chat_id, '1234567890'),   # контрольные цифры не сходятся
+        message_update(chat_id, '7707083893'),
+        message_update(chat_id, 'not-an-email'),
+        message_update(chat_id, 'user@example.com'),
+        message_update(chat_id, 'Иван'),
+        message_update(chat_id, '+71234567890'),
+        callback_update(chat_id, 'back'),
+        message_update(chat_id, '+71234567890'),
+        callback_update(chat_id, 'time_14_16'),
+        callback_update(chat_id, service),
+        callback_update(chat_id, 'urgency_normal'),
+        callback_update(chat_id, 'cancel'),
+    ]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    from aiogram import Bot, Dispatcher, types
+
+    module = load_bot()
+    dp = module.dp
+    dp.bot.request = fake_request
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+    await module.init_db()
+    service = f"svc:{(await module.catalog.get()).items[0].id}"
+
+    best = 0
+    for _ in range(args.rounds):
+        steps = len(flow(0, service))
+        updates = [types.Update(**u) for chat in range(args.chats)
+                   for u in flow(10_000 + chat, service)]
+        confirmed = module.FUNNEL.value(step='confirm')
+        t0 = time.perf_counter()
+        # чаты обрабатываются параллельно, апдейты одного чата — по порядку
+        chats = [updates[i:i + steps] for i in range(0, len(updates), steps)]
+
+        async def run_chat(chat_updates):
+            for update in chat_updates:
+                # отдельная задача = свежий контекст, как у запроса вебхука
+                # (StateFilter кэширует состояние в contextvar)
+                await asyncio.create_task(dp.process_update(update))
+
+        await asyncio.gather(*(run_chat(c) for c in chats))
+        rate = len(updates) / (time.perf_counter() - t0)
+        best = max(best, rate)
+        print(f"{len(updates)} апдейтов: {rate:,.0f} updates/s")
+        confirmed = module.FUNNEL.value(step='confirm') - confirmed
+        if confirmed != args.chats:
+            sys.exit(f"до подтверждения дошло {confirmed} анкет из {args.chats}")
+    print(f"best: {best:,.0f} updates/s")
+    await dp.storage.close()
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, ROOT)
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+# bench_export.py
+# coding: utf-8
+#
+# Пиковая память выгрузки /export/zayavki.<fmt>: база наполняется до --rows
+# строк, затем каждая выгрузка (1 тыс., 100 тыс. и все строки — через фильтр
+# date_to) запускается в отдельном процессе и читается потоком. Пиковый RSS
+# самой большой выгрузки не должен превышать RSS малой больше чем на
+# --budget МБ, иначе скрипт завершается с кодом 1.
+#
+#   python bench/bench_export.py --rows 5000000 --db /tmp/bench_export.db
+
+import argparse
+import base64
+import os
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# bench_admin_list.seed кладёт заявки с шагом 30 секунд от START
+START = datetime(2023, 1, 1)
+STEP = timedelta(seconds=30)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--db', default='/tmp/bench_export.db')
+    parser.add_argument('--chunk', type=int, default=50_000)
+    parser.add_argument('--budget', type=float, default=30.0, help='МБ')
+    parser.add_argument('--child', nargs=3, metavar=('FMT', 'ROWS', 'GZIP'))
+    return parser.parse_args()
+
+
+def setup_env(db):
+    os.environ['FLASK_DB_URI'] = f"sqlite:///{db}"
+    os.environ['FLASK_SECRET_KEY'] = 'bench'
+    os.environ['ADMIN_USER'] = 'bench'
+    os.environ['ADMIN_PASS'] = 'bench'
+    sys.path.insert(0, os.path.join(ROOT, 'admin'))
+
+
+def child(fmt, rows, use_gzip):
+    # Выгрузка rows первых строк; печатает: байт, секунд, пиковый RSS в КБ
+    from flask_admin_app import app
+
+    date_to = (START + STEP * (int(rows) - 1)).strftime('%Y-%m-%d')
+    headers = {'Authorization': 'Basic ' + base64.b64encode(b'bench:bench').decode()}
+    if use_gzip == '1':
+        headers['Accept-Encoding'] = 'gzip'
+    client = app.test_client()
+    t0 = time.perf_counter()
+    resp = client.get(f'/export/zayavki.{fmt}?date_to={date_to}', headers=headers, buffered=False)
+    assert resp.status_code == 200, resp.status_code
+    size = sum(len(chunk) for chunk in resp.response)
+    resp.close()
+    elapsed = time.perf_counter() - t0
+    print(size, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def run_child(args, fmt, rows, use_gzip):
+    out = subprocess.run([sys.executable, __file__, '--db', args.db,
+                          '--child', fmt, str(rows), use_gzip],
+                         check=True, capture_output=True, text=True).stdout.split()
+    return int(out[0]), float(out[1]), int(out[2]) / 1024
+
+
+def main(args):
+    from bench_admin_list import seed
+    from flask_admin_app import app, db, Zayavka
+
+    t0 = time.perf_counter()
+    seed(app, db, Zayavka, args.rows, args.chunk)
+    print(f"seeded {args.rows} rows in {time.perf_counter() - t0:.1f}s")
+
+    # date_to включает весь день — выгрузка захватывает строки до конца суток
+    sizes = sorted({min(args.rows, n) for n in (1_000, 100_000, args.rows)})
+    print(f"{'format':<8} {'rows':>9} {'MB out':>9} {'sec':>7} {'peak RSS, MB':>13}")
+    failed = False
+    for fmt, use_gzip in (('csv', '0'), ('csv', '1'), ('xlsx', '0')):
+        peaks = []
+        for rows in sizes:
+            size, elapsed, peak = run_child(args, fmt, rows, use_gzip)
+            peaks.append(peak)
+            name = fmt + ('.gz' if use_gzip == '1' else '')
+            print(f"{name:<8} {rows:>9} {size / 2**20:>9.1f} {elapsed:>7.2f} {peak:>13.1f}")
+        growth = max(peaks) - peaks[0]
+        if growth > args.budget:
+            print(f"FAIL: {fmt} peak RSS grew by {growth:.1f} MB (budget {args.budget} MB)")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    setup_env(args.db)
+    if args.child:
+        child(*args.child)
+        sys.exit(0)
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    # отдельная база, рабочая zayavki.db не затрагивается
+    sys.exit(main(args))
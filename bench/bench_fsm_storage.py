@@ -0,0 +1,83 @@
+# bench_fsm_storage.py
+# coding: utf-8
+#
+# Задержка get_state/set_state/update_data/get_data хранилищ FSM под
+# конкурентной нагрузкой: N «пользователей» одновременно проходят форму.
+# Каждый шаг сразу перечитывает записанное: чтение, не увидевшее только
+# что сделанной записи, считается ошибкой (код выхода 1).
+#
+#   python bench/bench_fsm_storage.py --users 200 --steps 8 --think 0.02 --kinds memory sqlite
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import init_db
+from fsm_storage import create_storage
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def user_flow(storage, uid, steps, think, timings, stale):
+    async def timed(name, coro):
+        t0 = time.perf_counter()
+        result = await coro
+        timings.setdefault(name, []).append(time.perf_counter() - t0)
+        return result
+
+    for step in range(steps):
+        # пауза — чтобы записи шагов попадали в разные сбросы SQLiteStorage
+        await asyncio.sleep(think)
+        state = await timed('get_state', storage.get_state(chat=uid, user=uid))
+        if state != (f'OrderStates:s{step - 1}' if step else None):
+            stale['state'] += 1
+        await timed('update_data', storage.update_data(chat=uid, user=uid, data={f'f{step}': 'x' * 20}))
+        await timed('set_state', storage.set_state(chat=uid, user=uid, state=f'OrderStates:s{step}'))
+    data = await timed('get_data', storage.get_data(chat=uid, user=uid))
+    if sorted(data) != sorted(f'f{step}' for step in range(steps)):
+        stale['data'] += 1
+    await timed('finish', storage.finish(chat=uid, user=uid))
+
+
+async def bench(kind, users, steps, think):
+    storage = create_storage(kind)
+    timings, stale = {}, {'state': 0, 'data': 0}
+    t0 = time.perf_counter()
+    await asyncio.gather(*(user_flow(storage, 10_000 + i, steps, think, timings, stale) for i in range(users)))
+    await storage.close()
+    total = time.perf_counter() - t0
+
+    ops = sum(len(v) for v in timings.values())
+    print(f"\n[{kind}] {users} users x {steps} steps: {ops} ops за {total:.3f} s ({ops / total:,.0f} ops/s)")
+    for name, values in timings.items():
+        print(f"  {name:12} mean {statistics.mean(values) * 1e3:7.3f} ms"
+              f"  p95 {pct(values, 95) * 1e3:7.3f} ms  p99 {pct(values, 99) * 1e3:7.3f} ms")
+    print(f"  устаревших чтений: state {stale['state']}, data {stale['data']}")
+    return stale['state'] + stale['data']
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--steps', type=int, default=8)
+    parser.add_argument('--kinds', nargs='+', default=['memory', 'sqlite'])
+    parser.add_argument('--think', type=float, default=0.02, help='пауза между шагами, с')
+    args = parser.parse_args()
+
+    await init_db()
+    stale = 0
+    for kind in args.kinds:
+        stale += await bench(kind, args.users, args.steps, args.think)
+    return 1 if stale else 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
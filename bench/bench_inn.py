@@ -0,0 +1,115 @@
+# bench_inn.py
+# coding: utf-8
+#
+# Сервис ИНН (inn_service.py) против локальной заглушки провайдера в
+# формате DaData findById/party с задержкой --latency:
+#   - стоимость проверки контрольной суммы;
+#   - первый поиск (провайдер), повтор из памяти, из таблицы inn_info
+#     после «перезапуска» (новый InnService с пустым кэшем);
+#   - --concurrency одновременных поисков одного ИНН — сколько запросов
+#     ушло провайдеру (ожидается 1);
+#   - таймаут: медленный провайдер не задерживает lookup дольше timeout.
+#
+#   python bench/bench_inn.py --latency 0.2 --concurrency 100
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import timeit
+
+from aiohttp import web
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.2, help='задержка провайдера, с')
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--port', type=int, default=18280)
+    return parser.parse_args()
+
+
+class FakeProvider:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls   = 0
+
+    async def handle(self, request):
+        self.calls += 1
+        inn = (await request.json())['query']
+        await asyncio.sleep(self.latency)
+        if inn.startswith('0'):
+            return web.json_response({'suggestions': []})
+        return web.json_response({'suggestions': [{
+            'value': f'ООО "Тест {inn[-4:]}" & Ко',
+            'data': {'inn': inn, 'state': {'status': 'ACTIVE'}, 'finance': {'tax_system': 'USN'}},
+        }]})
+
+
+def random_inn(rnd, first=None):
+    from inn_service import WEIGHTS_10, _check_digit
+    digits = [rnd.randint(1, 9) if first is None else first] + [rnd.randint(0, 9) for _ in range(8)]
+    return ''.join(map(str, digits + [_check_digit(digits, WEIGHTS_10)]))
+
+
+async def timed(coro):
+    t0 = time.perf_counter()
+    result = await coro
+    return result, (time.perf_counter() - t0) * 1e3
+
+
+async def main(args):
+    tmp = tempfile.mkdtemp(prefix='bench_inn_')
+    os.environ['DATABASE_URL'] = f'sqlite+aiosqlite:///{tmp}/bot.db'
+    sys.path.insert(0, ROOT)
+    from database import init_db
+    from inn_service import DadataProvider, InnService, is_valid_inn
+
+    fake = FakeProvider(args.latency)
+    app = web.Application()
+    app.router.add_post('/party', fake.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', args.port).start()
+    await init_db()
+
+    rnd = random.Random(1)
+    inn = random_inn(rnd)
+    n = 100_000
+    per_check = timeit.timeit(lambda: is_valid_inn(inn), number=n) / n
+    print(f"checksum: {per_check * 1e6:.2f} µs")
+
+    url = f'http://127.0.0.1:{args.port}/party'
+    service = InnService(DadataProvider('bench', url=url))
+    info, ms = await timed(service.lookup(inn))
+    print(f"provider: {ms:7.1f} ms  {info.name!r} {info.status} {info.tax_regime}")
+    _, ms = await timed(service.lookup(inn))
+    print(f"memory:   {ms:7.3f} ms")
+    _, ms = await timed(service.lookup(random_inn(rnd, first=0)))
+    print(f"not found:{ms:7.1f} ms  (кэшируется на negative_ttl)")
+    await service.close()
+
+    restarted = InnService(DadataProvider('bench', url=url))
+    _, ms = await timed(restarted.lookup(inn))
+    print(f"inn_info: {ms:7.1f} ms  (после перезапуска, без провайдера)")
+
+    before = fake.calls
+    other = random_inn(rnd)
+    _, ms = await timed(asyncio.gather(*(restarted.lookup(other) for _ in range(args.concurrency))))
+    print(f"{args.concurrency} параллельных поисков одного ИНН: {ms:.1f} ms, "
+          f"запросов к провайдеру: {fake.calls - before}")
+
+    fake.latency = 2.0
+    result, ms = await timed(restarted.lookup(random_inn(rnd), timeout=0.1))
+    print(f"timeout 0.1 с при медленном провайдере: {ms:.1f} ms -> {result}")
+    await restarted.close()
+    await runner.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,124 @@
+# bench_repository.py
+# coding: utf-8
+#
+# Задержка типовых запросов repository.py по мере роста таблицы zayavki:
+# база наполняется пачками до --rows строк, на контрольных точках
+# замеряются заявки пользователя, новые/срочные, поиск по ИНН,
+# вторая страница keyset-пагинации и upsert пользователей.
+#
+#   python bench/bench_repository.py --rows 1000000 --db /tmp/bench_repo.db
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=50_000)
+    parser.add_argument('--db', default='/tmp/bench_repository.db')
+    parser.add_argument('--chunk', type=int, default=50_000)
+    parser.add_argument('--repeat', type=int, default=200)
+    return parser.parse_args()
+
+
+async def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - t0)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95)]
+
+
+async def main(args):
+    from sqlalchemy import insert
+    from database import init_db, SessionLocal
+    from models import User
+    from schema import Order
+    import repository
+
+    await init_db()
+    rnd = random.Random(42)
+    inns = [f"{rnd.randrange(10**9, 10**10)}" for _ in range(20_000)]
+    start = datetime(2024, 1, 1)
+
+    async with SessionLocal() as session:
+        await session.execute(insert(User), [
+            {'telegram_id': 10**9 + i, 'name': f'user{i}'} for i in range(args.users)
+        ])
+        await session.commit()
+
+    checkpoints = sorted({min(args.rows, n) for n in (10_000, 100_000, args.rows)})
+    seeded = 0
+    print(f"{'rows':>10} {'query':<24} {'p50, ms':>9} {'p95, ms':>9}")
+    for checkpoint in checkpoints:
+        async with SessionLocal() as session:
+            while seeded < checkpoint:
+                n = min(args.chunk, checkpoint - seeded)
+                await session.execute(insert(Order), [{
+                    'telegram_id': 10**9 + rnd.randrange(args.users),
+                    'inn': rnd.choice(inns),
+                    'email': 'client@example.ru',
+                    'name': 'Клиент',
+                    'phone': '+79000000000',
+                    'contact_time': 'Днём',
+                    'service': 'Консультация',
+                    'urgency': 'Срочно' if rnd.random() < 0.1 else 'Обычная',
+                    'status': 'new' if rnd.random() < 0.2 else 'done',
+                    'date': start + timedelta(seconds=seeded + i),
+                } for i in range(n)])
+                seeded += n
+            await session.commit()
+
+        async with SessionLocal() as session:
+            async def user_orders():
+                await repository.list_user_orders(session, 10**9 + rnd.randrange(args.users))
+
+            async def new_urgent():
+                await repository.list_orders(session, status='new', urgency='Срочно')
+
+            async def new_any():
+                await repository.list_orders(session, status='new')
+
+            async def by_inn():
+                await repository.find_by_inn(session, rnd.choice(inns))
+
+            async def second_page():
+                rows = await repository.list_orders(session, status='new')
+                await repository.list_orders(session, status='new',
+                                             after=repository.page_cursor(rows))
+
+            async def upsert_100():
+                await repository.upsert_users(session, [
+                    {'telegram_id': 10**9 + rnd.randrange(args.users * 2), 'name': 'x'}
+                    for _ in range(100)
+                ])
+
+            for name, fn in (('user orders', user_orders), ('new + urgent', new_urgent),
+                             ('new', new_any), ('by INN', by_inn),
+                             ('keyset page 2', second_page), ('upsert 100 users', upsert_100)):
+                p50, p95 = await timed(fn, args.repeat)
+                print(f"{checkpoint:>10} {name:<24} {p50 * 1e3:>9.3f} {p95 * 1e3:>9.3f}")
+            await session.rollback()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    # отдельная база, рабочая kuzkabuh.db не затрагивается; заявки — в ней же
+    os.environ['DATABASE_URL'] = f"sqlite+aiosqlite:///{args.db}"
+    os.environ.pop('ORDERS_DATABASE_URL', None)
+    os.environ.pop('FLASK_DB_URI', None)
+    sys.path.insert(0, ROOT)
+    asyncio.run(main(args))
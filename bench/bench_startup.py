@@ -0,0 +1,159 @@
+# bench_startup.py
+# coding: utf-8
+#
+# Время холодного старта и память ботов: два отдельных процесса
+# (bots/*/bot.py) против одного launcher.py. Telegram подменяется
+# заглушкой (TELEGRAM_API_SERVER) с задержкой --latency на каждый вызов;
+# она помнит зарегистрированные вебхуки, поэтому второй запуск показывает
+# рестарт без повторного set_webhook.
+#
+#   python bench/bench_startup.py --latency 0.1
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import aiohttp
+from aiohttp import web
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+TOKENS = {'KUZKABUH_BOT_TOKEN': '111:bench', 'KUZKAINFO_BOT_TOKEN': '222:bench'}
+PATHS = {'KUZKABUH_WEBHOOK_PATH': '/kuzkabuh', 'KUZKAINFO_WEBHOOK_PATH': '/kuzkainfo'}
+# <путь вебхука>/stats отдаётся только с METRICS_TOKEN — по нему ждём готовности
+METRICS_TOKEN = 'bench'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.1, help='задержка Bot API, с')
+    parser.add_argument('--api-port', type=int, default=18080)
+    parser.add_argument('--launcher-port', type=int, default=18001)
+    parser.add_argument('--timeout', type=float, default=30.0)
+    return parser.parse_args()
+
+
+class FakeTelegram:
+    def __init__(self, latency):
+        self.latency  = latency
+        self.webhooks = {}
+        self.calls    = Counter()
+
+    async def handle(self, request):
+        token, method = request.match_info['token'], request.match_info['method']
+        self.calls[method] += 1
+        await asyncio.sleep(self.latency)
+        params = dict(await request.post()) if request.can_read_body else {}
+        if method == 'getMe':
+            result = {'id': int(token.split(':')[0]), 'is_bot': True,
+                      'first_name': 'bench', 'username': f'bench{token[:3]}_bot'}
+        elif method == 'getWebhookInfo':
+            url, allowed = self.webhooks.get(token, ('', None))
+            result = {'url': url, 'has_custom_certificate': False, 'pending_update_count': 0}
+            if allowed:
+                result['allowed_updates'] = allowed
+        elif method == 'setWebhook':
+            allowed = params.get('allowed_updates')
+            self.webhooks[token] = (params['url'], json.loads(allowed) if allowed else None)
+            result = True
+        elif method == 'deleteWebhook':
+            self.webhooks.pop(token, None)
+            result = True
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+
+def rss_mb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def wait_ready(urls, deadline):
+    async with aiohttp.ClientSession() as session:
+        pending = list(urls)
+        while pending:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"not ready: {pending}")
+            url = pending[0]
+            try:
+                async with session.get(url) as resp:
+                    if resp.status == 200:
+                        pending.pop(0)
+                        continue
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.01)
+
+
+async def boot(commands, ready_urls, env, timeout):
+    # Запускает процессы, ждёт готовности всех вебхуков и останавливает их.
+    # Возвращает (секунды до готовности, суммарный RSS в МБ)
+    t0 = time.monotonic()
+    procs = [await asyncio.create_subprocess_exec(sys.executable, *cmd, env=env, cwd=ROOT,
+                                                  stdout=asyncio.subprocess.DEVNULL,
+                                                  stderr=asyncio.subprocess.DEVNULL)
+             for cmd in commands]
+    try:
+        await wait_ready(ready_urls, t0 + timeout)
+        elapsed = time.monotonic() - t0
+        rss = sum(rss_mb(p.pid) for p in procs)
+    finally:
+        for p in procs:
+            if p.returncode is None:
+                p.send_signal(signal.SIGINT)
+        await asyncio.gather(*(p.wait() for p in procs))
+    return elapsed, rss
+
+
+async def main(args):
+    fake = FakeTelegram(args.latency)
+    app = web.Application()
+    app.router.add_route('*', '/bot{token}/{method}', fake.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', args.api_port).start()
+
+    tmp = tempfile.mkdtemp(prefix='bench_startup_')
+    env = dict(os.environ, **TOKENS, **PATHS,
+               TELEGRAM_API_SERVER=f'http://127.0.0.1:{args.api_port}',
+               WEBHOOK_HOST='https://bench.example',
+               ADMIN_TELEGRAM_ID='1',
+               FLASK_ADMIN_API='http://127.0.0.1:9/api/zayavki',
+               DATABASE_URL=f'sqlite+aiosqlite:///{tmp}/bot.db',
+               CBR_CACHE_PATH=f'{tmp}/cbr.json',
+               FSM_STORAGE='memory',
+               METRICS_TOKEN=METRICS_TOKEN,
+               LAUNCHER_PORT=str(args.launcher_port))
+
+    setups = [
+        ('separate', [['bots/kuzkabuh_bot/bot.py'], ['bots/kuzkainfo_bot/bot.py']],
+         [f'http://127.0.0.1:8001/kuzkabuh/stats?token={METRICS_TOKEN}',
+          f'http://127.0.0.1:8002/kuzkainfo/stats?token={METRICS_TOKEN}']),
+        ('launcher', [['launcher.py']],
+         [f'http://127.0.0.1:{args.launcher_port}/kuzkabuh/stats?token={METRICS_TOKEN}',
+          f'http://127.0.0.1:{args.launcher_port}/kuzkainfo/stats?token={METRICS_TOKEN}']),
+    ]
+    print(f"Bot API latency {args.latency * 1e3:.0f} ms")
+    print(f"{'setup':<10} {'boot':<8} {'ready, s':>9} {'RSS, MB':>8} {'setWebhook':>11}")
+    for name, commands, urls in setups:
+        fake.webhooks.clear()
+        for boot_name in ('cold', 'restart'):
+            before = fake.calls['setWebhook']
+            elapsed, rss = await boot(commands, urls, env, args.timeout)
+            print(f"{name:<10} {boot_name:<8} {elapsed:>9.2f} {rss:>8.1f} "
+                  f"{fake.calls['setWebhook'] - before:>11}")
+    await runner.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,325 @@
+# loadtest.py
+# coding: utf-8
+#
+# Нагрузочный прогон воронки заявки kuzkabuh_bot через настоящий вебхук:
+# бот запускается отдельным процессом (launcher.py), Bot API и API админки
+# (FLASK_ADMIN_API) подменяются локальной заглушкой в этом процессе.
+# Виртуальные пользователи приходят с частотой --rate и проходят анкету:
+# /start, «Оставить заявку», ИНН, email, имя, телефон, время, услуга,
+# срочность, «Да, отправить». Кнопки нажимаются по клавиатуре, которую бот
+# реально прислал, поэтому сценарий не зависит от формата callback_data.
+#
+# Задержка шага — от POST апдейта до ответа бота этому чату (sendMessage /
+# editMessageText на заглушке). Итог — p50/p95/p99 по шагам и в целом,
+# пропускная способность и число заявок, дошедших до API админки.
+#
+#   python bench/loadtest.py --users 500 --rate 50 --api-latency 0.03
+#   python bench/loadtest.py --users 2000 --rate 200 --budget-p95 250   # код 1 при регрессии
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import signal
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+import aiohttp
+from aiohttp import web
+
+from bench_startup import METRICS_TOKEN, wait_ready
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+TOKEN = '333:loadtest'
+WEBHOOK_PATH = '/kuzkabuh'
+ADMIN_CHAT = 1   # сюда бот шлёт дайджест новых заявок, пользователи начинаются с 10_000
+REPLY_METHODS = {'sendMessage', 'editMessageText'}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500, help='сколько пользователей пройдёт анкету')
+    parser.add_argument('--rate', type=float, default=50.0, help='новых пользователей в секунду')
+    parser.add_argument('--think', type=float, default=0.0, help='пауза пользователя между шагами, с')
+    parser.add_argument('--typos', type=float, default=0.1,
+                        help='доля текстовых шагов с неверным вводом перед верным')
+    parser.add_argument('--api-latency', type=float, default=0.03, help='задержка Bot API, с')
+    parser.add_argument('--admin-latency', type=float, default=0.01, help='задержка API админки, с')
+    parser.add_argument('--timeout', type=float, default=10.0, help='ожидание ответа бота, с')
+    parser.add_argument('--stub-port', type=int, default=18180)
+    parser.add_argument('--bot-port', type=int, default=18181)
+    parser.add_argument('--budget-p95', type=float, default=None,
+                        help='порог p95 по всем шагам, мс; выше — код выхода 1')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+# -- заглушки Bot API и API админки --
+
+class Stub:
+    def __init__(self, api_latency, admin_latency):
+        self.api_latency   = api_latency
+        self.admin_latency = admin_latency
+        self.calls   = Counter()
+        self.replies = Counter()   # chat_id -> ответов бота этому чату
+        self.waiters = {}          # chat_id -> Future ответа бота
+        self.orders  = set()       # idempotency_key заявок, принятых «админкой»
+        self.order_posts = 0
+        self._message_ids = itertools.count(1)
+        self._webhook = ('', None)
+
+    async def telegram(self, request):
+        method = request.match_info['method']
+        self.calls[method] += 1
+        params = dict(await request.post()) if request.can_read_body else {}
+        await asyncio.sleep(self.api_latency)
+        if method == 'getMe':
+            result = {'id': int(TOKEN.split(':')[0]), 'is_bot': True,
+                      'first_name': 'loadtest', 'username': 'loadtest_bot'}
+        elif method == 'getWebhookInfo':
+            url, allowed = self._webhook
+            result = {'url': url, 'has_custom_certificate': False, 'pending_update_count': 0}
+            if allowed:
+                result['allowed_updates'] = allowed
+        elif method == 'setWebhook':
+            allowed = params.get('allowed_updates')
+            self._webhook = (params['url'], json.loads(allowed) if allowed else None)
+            result = True
+        elif method in REPLY_METHODS:
+            chat_id = int(params.get('chat_id', 0))
+            self.replies[chat_id] += 1
+            markup = json.loads(params['reply_markup']) if params.get('reply_markup') else None
+            message_id = int(params.get('message_id') or next(self._message_ids))
+            waiter = self.waiters.pop(chat_id, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result((time.perf_counter(), message_id, markup))
+            result = {'message_id': message_id,
+                      'date': int(time.time()), 'text': params.get('text', ''),
+                      'chat': {'id': chat_id, 'type': 'private'}}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def admin(self, request):
+        payload = await request.json()
+        await asyncio.sleep(self.admin_latency)
+        items = payload if isinstance(payload, list) else [payload]
+        self.order_posts += 1
+        self.orders.update(item.get('idempotency_key') for item in items)
+        return web.json_response({'ok': True, 'ids': list(range(len(items)))}, status=201)
+
+
+# -- апдейты --
+
+update_ids = itertools.count(1)
+
+
+def user(chat_id):
+    return {'id': chat_id, 'is_bot': False, 'first_name': 'Load'}
+
+
+def message_update(chat_id, text):
+    update = {
+        'update_id': next(update_ids),
+        'message': {'message_id': next(update_ids), 'date': int(time.time()), 'text': text,
+                    'chat': {'id': chat_id, 'type': 'private'}, 'from': user(chat_id)},
+    }
+    if text.startswith('/'):
+        update['message']['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+    return update
+
+
+def callback_update(chat_id, data, message_id):
+    return {
+        'update_id': next(update_ids),
+        'callback_query': {
+            'id': str(next(update_ids)), 'chat_instance': str(chat_id), 'data': data,
+            'from': user(chat_id),
+            'message': {'message_id': message_id, 'date': int(time.time()), 'text': '-',
+                        'chat': {'id': chat_id, 'type': 'private'}},
+        },
+    }
+
+
+def valid_inn(rnd):
+    # 10-значный ИНН юрлица с верной контрольной цифрой
+    digits = [rnd.randint(0, 9) for _ in range(9)]
+    weights = (2, 4, 10, 3, 5, 9, 4, 6, 8)
+    return ''.join(map(str, digits)) + str(sum(d * w for d, w in zip(digits, weights)) % 11 % 10)
+
+
+def buttons(markup):
+    return [b['callback_data'] for row in (markup or {}).get('inline_keyboard', []) for b in row]
+
+
+def pick(markup, rnd, exclude=('back', 'cancel')):
+    choices = [data for data in buttons(markup) if data not in exclude]
+    return rnd.choice(choices) if choices else None
+
+
+def script(chat_id, rnd):
+    # (имя шага, что сделать): текст или выбор кнопки из последней клавиатуры
+    return [
+        ('start',        ('text', '/start')),
+        ('new_order',    ('button', lambda m: buttons(m)[0])),
+        ('inn',          ('text', valid_inn(rnd), '12345')),
+        ('email',        ('text', f'user{chat_id}@example.com', 'not-an-email')),
+        ('name',         ('text', 'Иван', 'И')),
+        ('phone',        ('text', f'+7{rnd.randint(10 ** 9, 10 ** 10 - 1)}', '12345')),
+        ('contact_time', ('button', lambda m: pick(m, rnd))),
+        ('service',      ('button', lambda m: pick(m, rnd))),
+        ('urgency',      ('button', lambda m: pick(m, rnd))),
+        ('confirm',      ('button', lambda m: 'confirm' if 'confirm' in buttons(m) else pick(m, rnd))),
+    ]
+
+
+# -- виртуальный пользователь --
+
+class Results:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.updates   = 0
+        self.rejected  = 0
+        self.timeouts  = 0
+        self.completed = 0
+
+
+async def send(session, url, stub, chat_id, update, results, step, timeout):
+    # POST апдейта и ожидание ответа бота этому чату -> (id сообщения, клавиатура) или None
+    waiter = asyncio.get_running_loop().create_future()
+    stub.waiters[chat_id] = waiter
+    t0 = time.perf_counter()
+    for _ in range(5):
+        async with session.post(url, json=update) as resp:
+            if resp.status != 503:
+                break
+            results.rejected += 1
+            await asyncio.sleep(float(resp.headers.get('Retry-After', 1)))
+    results.updates += 1
+    try:
+        replied, message_id, markup = await asyncio.wait_for(waiter, timeout)
+    except asyncio.TimeoutError:
+        stub.waiters.pop(chat_id, None)
+        results.timeouts += 1
+        return None
+    results.latencies[step].append(replied - t0)
+    return message_id, markup
+
+
+async def virtual_user(session, url, stub, chat_id, args, results):
+    rnd = random.Random(args.seed * 1_000_003 + chat_id)
+    markup, message_id = None, None
+    for step, action in script(chat_id, rnd):
+        if args.think:
+            await asyncio.sleep(args.think)
+        if action[0] == 'text':
+            if len(action) > 2 and rnd.random() < args.typos:
+                if await send(session, url, stub, chat_id, message_update(chat_id, action[2]),
+                              results, f'{step}:invalid', args.timeout) is None:
+                    return
+            update = message_update(chat_id, action[1])
+        else:
+            data = action[1](markup)
+            if data is None:
+                return
+            update = callback_update(chat_id, data, message_id)
+        reply = await send(session, url, stub, chat_id, update, results, step, args.timeout)
+        if reply is None:
+            return
+        # следующая кнопка нажимается на сообщении с этой клавиатурой
+        message_id, markup = reply
+    results.completed += 1
+
+
+def pct(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def report(results, elapsed, stub, args):
+    print(f"{'step':<22} {'n':>6} {'p50, ms':>8} {'p95, ms':>8} {'p99, ms':>8}")
+    every = []
+    for step, values in results.latencies.items():
+        every.extend(values)
+        print(f"{step:<22} {len(values):>6} {pct(values, 50) * 1e3:>8.1f} "
+              f"{pct(values, 95) * 1e3:>8.1f} {pct(values, 99) * 1e3:>8.1f}")
+    print(f"{'all':<22} {len(every):>6} {pct(every, 50) * 1e3:>8.1f} "
+          f"{pct(every, 95) * 1e3:>8.1f} {pct(every, 99) * 1e3:>8.1f}")
+    print(f"updates: {results.updates} за {elapsed:.1f} с — {results.updates / elapsed:,.0f} updates/s")
+    print(f"анкет пройдено: {results.completed}/{args.users}, "
+          f"таймаутов: {results.timeouts}, 503: {results.rejected}")
+    print(f"заявок в API админки: {len(stub.orders)} ({stub.order_posts} POST), "
+          f"вызовов Bot API: {sum(stub.calls.values())}")
+    return pct(every, 95) * 1e3
+
+
+async def main(args):
+    stub = Stub(args.api_latency, args.admin_latency)
+    app = web.Application()
+    app.router.add_route('*', '/bot{token}/{method}', stub.telegram)
+    app.router.add_post('/api/zayavki', stub.admin)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', args.stub_port).start()
+
+    tmp = tempfile.mkdtemp(prefix='loadtest_')
+    # переменные окружения вызывающего (FSM_STORAGE, ORDER_WRITE_MODE,
+    # WEBHOOK_WORKERS, ...) важнее значений по умолчанию
+    env = dict({'FSM_STORAGE': 'memory',
+                'DATABASE_URL': f'sqlite+aiosqlite:///{tmp}/bot.db',
+                'ADMIN_DIGEST_WINDOW': '1'},
+               **os.environ,
+               KUZKABUH_BOT_TOKEN=TOKEN,
+               KUZKABUH_WEBHOOK_PATH=WEBHOOK_PATH,
+               WEBHOOK_HOST='https://loadtest.example',
+               TELEGRAM_API_SERVER=f'http://127.0.0.1:{args.stub_port}',
+               FLASK_ADMIN_API=f'http://127.0.0.1:{args.stub_port}/api/zayavki',
+               ADMIN_TELEGRAM_ID=str(ADMIN_CHAT),
+               LAUNCHER_BOTS='kuzkabuh',
+               LAUNCHER_PORT=str(args.bot_port),
+               METRICS_TOKEN=METRICS_TOKEN)
+    # вывод бота (в т.ч. access log) — в файл, чтобы не мешал отчёту
+    log = open(os.path.join(tmp, 'bot.log'), 'wb')
+    bot = await asyncio.create_subprocess_exec(sys.executable, 'launcher.py', env=env, cwd=ROOT,
+                                               stdout=log, stderr=log)
+    url = f'http://127.0.0.1:{args.bot_port}{WEBHOOK_PATH}'
+    try:
+        await wait_ready([f'{url}/stats?token={METRICS_TOKEN}'], time.monotonic() + 30)
+        results = Results()
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            t0 = time.perf_counter()
+            users = []
+            for i in range(args.users):
+                users.append(asyncio.ensure_future(
+                    virtual_user(session, url, stub, 10_000 + i, args, results)))
+                await asyncio.sleep(1 / args.rate)
+            await asyncio.gather(*users)
+            elapsed = time.perf_counter() - t0
+            # outbox доставляет заявки в фоне — ждём, пока дойдут все
+            deadline = time.monotonic() + args.timeout
+            while len(stub.orders) < results.completed and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+    finally:
+        bot.send_signal(signal.SIGINT)
+        await bot.wait()
+        await runner.cleanup()
+        log.close()
+
+    p95 = report(results, elapsed, stub, args)
+    print(f"лог бота: {log.name}")
+    if args.budget_p95 is not None and p95 > args.budget_p95:
+        print(f"p95 {p95:.1f} ms > {args.budget_p95:.1f} ms")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main(parse_args())))
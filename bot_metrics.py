@@ -0,0 +1,101 @@
+# bot_metrics.py
+# coding: utf-8
+#
+# Метрики ботов поверх metrics.py:
+#   HandlerMetrics  — middleware aiogram: время апдейта и каждого хэндлера
+#                     с разбивкой по состоянию FSM;
+#   instrument_bot  — число и время вызовов Bot API по методам;
+#   instrument_pipeline — очередь вебхука (webhook_pipeline.UpdatePipeline).
+# Метка bot различает ботов, работающих в одном процессе (launcher.py).
+
+import time
+
+from aiogram.dispatcher.filters.builtin import StateFilter
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+import metrics
+
+UPDATE_SECONDS = metrics.histogram(
+    'bot_update_seconds', 'Время обработки апдейта целиком', ['bot', 'type'])
+HANDLER_SECONDS = metrics.histogram(
+    'bot_handler_seconds', 'Время хэндлера', ['bot', 'handler', 'state'])
+UNHANDLED = metrics.counter(
+    'bot_unhandled_total', 'Апдейты без подходящего хэндлера', ['bot', 'type'])
+
+TG_SECONDS = metrics.histogram(
+    'telegram_request_seconds', 'Время вызова Bot API', ['bot', 'method'])
+TG_ERRORS = metrics.counter(
+    'telegram_request_errors_total', 'Ошибки вызовов Bot API', ['bot', 'method', 'error'])
+
+QUEUE_DEPTH = metrics.gauge(
+    'webhook_queue_depth', 'Апдейтов в очереди вебхука', ['path'])
+PIPELINE_UPDATES = metrics.counter(
+    'webhook_updates_total', 'Апдейты вебхука по исходу', ['path', 'outcome'])
+
+
+class HandlerMetrics(BaseMiddleware):
+    # Отметки времени кладутся в data апдейта/события — общего состояния нет
+
+    def __init__(self, bot_name):
+        super().__init__()
+        self.bot_name = bot_name
+
+    async def on_pre_process_update(self, update, data):
+        data['_metrics_t0'] = time.perf_counter()
+
+    async def on_post_process_update(self, update, results, data):
+        t0 = data.get('_metrics_t0')
+        if t0 is not None:
+            kind = next((k for k in ('message', 'callback_query') if getattr(update, k)), 'other')
+            UPDATE_SECONDS.observe(time.perf_counter() - t0, bot=self.bot_name, type=kind)
+
+    def _start(self, data):
+        # process_* вызывается, когда фильтры прошли и хэндлер выбран
+        data['_metrics_handler'] = current_handler.get().__name__
+        data['_metrics_state'] = StateFilter.ctx_state.get(None) or 'none'
+        data['_metrics_t1'] = time.perf_counter()
+
+    def _finish(self, kind, data):
+        handler = data.get('_metrics_handler')
+        if handler is None:
+            UNHANDLED.inc(bot=self.bot_name, type=kind)
+            return
+        HANDLER_SECONDS.observe(time.perf_counter() - data['_metrics_t1'],
+                                bot=self.bot_name, handler=handler, state=data['_metrics_state'])
+
+    async def on_process_message(self, message, data):
+        self._start(data)
+
+    async def on_post_process_message(self, message, results, data):
+        self._finish('message', data)
+
+    async def on_process_callback_query(self, cq, data):
+        self._start(data)
+
+    async def on_post_process_callback_query(self, cq, results, data):
+        self._finish('callback_query', data)
+
+
+def instrument_bot(bot, bot_name):
+    # Все методы Bot (send_message, edit_message_text, ...) идут через request
+    request = bot.request
+
+    async def timed_request(method, data=None, files=None, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return await request(method, data, files, **kwargs)
+        except Exception as e:
+            TG_ERRORS.inc(bot=bot_name, method=method, error=type(e).__name__)
+            raise
+        finally:
+            TG_SECONDS.observe(time.perf_counter() - t0, bot=bot_name, method=method)
+
+    bot.request = timed_request
+    return bot
+
+
+def instrument_pipeline(pipeline, path):
+    QUEUE_DEPTH.set_function(pipeline.depth, path=path)
+    for outcome in ('processed', 'failed', 'rejected', 'duplicates'):
+        PIPELINE_UPDATES.set_function(lambda o=outcome: getattr(pipeline, o), path=path, outcome=outcome)
@@ -1,18 +1,37 @@
+import asyncio
+import logging
 import os
 import re
-import requests
+import sys
+from collections import namedtuple
 
 from aiogram import Bot, Dispatcher, types
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
-from aiogram.utils.executor import start_webhook
 from dotenv import load_dotenv
+from sqlalchemy.exc import IntegrityError
 
-# 1. Загружаем .env
+# Корень проекта — для общих модулей (admin_client.py, models.py, ...)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+# 1. Загружаем .env — до общих модулей: database.py читает адреса баз при импорте
 load_dotenv('/root/kuzkabuh/.env')
 
+from admin_client import AdminApiClient
+from antiflood import AntiFlood, create_backend
+from bot_metrics import HandlerMetrics, instrument_bot
+from database import init_db, SessionLocal, OrderSession, SHARED_ORDERS_DB
+from fsm_storage import create_storage
+from inn_service import InnService, company_fields, create_provider, is_valid_inn
+from outbox import Outbox, new_key
+from schema import Order
+from service_catalog import ServiceCatalog, parse_callback
+from texts import DEFAULT_LOCALE, Keyboards, Texts
+from tg_sender import MessageScheduler
+from webhook_pipeline import run_webhook, ensure_webhook, api_server
+import metrics
+import repository
+
 BOT_TOKEN       = os.getenv('KUZKABUH_BOT_TOKEN')
 WEBHOOK_HOST    = os.getenv('WEBHOOK_HOST')
 WEBHOOK_PATH    = os.getenv('KUZKABUH_WEBHOOK_PATH')
@@ -25,6 +44,19 @@ ADMIN_USER      = os.getenv('ADMIN_USER')
 ADMIN_PASS      = os.getenv('ADMIN_PASS')
 FLASK_ADMIN_API = os.getenv('FLASK_ADMIN_API')
 
+# Куда пишется подтверждённая заявка:
+#   api  — через outbox в API админки;
+#   db   — сразу в общую с админкой базу заявок (database.py), без HTTP;
+#   dual — в базу и в API с одним idempotency_key: админка узнаёт ключ
+#          и не создаёт вторую строку (режим на время перехода)
+ORDER_WRITE_MODE = os.getenv('ORDER_WRITE_MODE', 'api')
+if ORDER_WRITE_MODE not in ('api', 'db', 'dual'):
+    raise ValueError(f"Неизвестный ORDER_WRITE_MODE: {ORDER_WRITE_MODE}")
+# иначе заявки молча оседали бы в базе бота, которую админка не читает
+if ORDER_WRITE_MODE in ('db', 'dual') and not SHARED_ORDERS_DB:
+    raise ValueError(f"ORDER_WRITE_MODE={ORDER_WRITE_MODE}: нужна база админки "
+                     "(ORDERS_DATABASE_URL или FLASK_DB_URI)")
+
 # 2. FSM — состояния
 class OrderStates(StatesGroup):
     waiting_for_inn          = State()
@@ -36,259 +68,437 @@ class OrderStates(StatesGroup):
     waiting_for_urgency      = State()
     confirm                  = State()
 
-# 3. Клавиатуры
-main_kb = InlineKeyboardMarkup().add(
-    InlineKeyboardButton("Оставить заявку", callback_data="new_order")
+# 3. Тексты и клавиатуры по языкам (texts.py): шаблоны разбираются один
+# раз, подстановки экранируются для HTML. Язык — по language_code
+# пользователя; админу и в заявку всё уходит по-русски. Услуги — из
+# справочника в базе заявок (service_catalog.py), правятся в админке.
+ORDER_FIELDS_RU = (
+    "ИНН: <code>{inn}</code>\n"
+    "Email: <code>{email}</code>\n"
+    "Имя: <code>{name}</code>\n"
+    "Телефон: <code>{phone}</code>\n"
+    "Время связи: <code>{contact_time}</code>\n"
+    "Услуга: <code>{service}</code>\n"
+    "Срочность: <code>{urgency}</code>"
 )
-cancel_kb = InlineKeyboardMarkup().add(
-    InlineKeyboardButton("❌ Отмена", callback_data="cancel")
+ORDER_FIELDS_EN = (
+    "INN: <code>{inn}</code>\n"
+    "Email: <code>{email}</code>\n"
+    "Name: <code>{name}</code>\n"
+    "Phone: <code>{phone}</code>\n"
+    "Contact time: <code>{contact_time}</code>\n"
+    "Service: <code>{service}</code>\n"
+    "Urgency: <code>{urgency}</code>"
 )
-back_cancel_kb = InlineKeyboardMarkup(row_width=2).add(
-    InlineKeyboardButton("⬅️ Назад", callback_data="back"),
-    InlineKeyboardButton("❌ Отмена", callback_data="cancel")
+TEXTS = {
+    'ru': {
+        'welcome':             "👋 Добро пожаловать! Нажмите кнопку ниже, чтобы оставить заявку.",
+        'prompt_inn':          "Введите ИНН (10 или 12 цифр):",
+        'error_inn':           "❗️ Неверный ИНН: нужно 10 или 12 цифр с верной контрольной суммой.",
+        'prompt_email':        "Введите ваш Email:",
+        'error_email':         "❗️ Некорректный email. Пример: example@mail.ru",
+        'prompt_name':         "Введите ваше имя:",
+        'error_name':          "❗️ Имя должно быть от 2 до 50 символов.",
+        'prompt_phone':        "Введите ваш телефон (+7XXXXXXXXXX или 8XXXXXXXXXX):",
+        'error_phone':         "❗️ Неверный формат. Пример: +71231234567 или 81231234567",
+        'prompt_contact_time': "Выберите желаемое время для связи:",
+        'prompt_service':      "Выберите услугу:",
+        'prompt_urgency':      "Укажите срочность:",
+        'service_unavailable': "Эта услуга больше недоступна, выберите другую:",
+        'order_summary':       "<b>Проверьте данные:</b>\n" + ORDER_FIELDS_RU + "\n\nВсе верно?",
+        'order_admin':         "💼 <b>Новая заявка!</b>\n" + ORDER_FIELDS_RU,
+        'order_company':       "\nОрганизация: <code>{company}</code>",
+        'order_saved':         "✅ Заявка принята и сохранена.",
+        'order_store_error':   "❌ Ошибка при сохранении. Попробуйте позже.",
+        'order_cancelled':     "⚠️ Заявка отменена.",
+        'order_duplicate':     "✅ Такая заявка уже принята, повторно отправлять не нужно.",
+        'order_rate_limited':  "⏳ Слишком много заявок. Попробуйте позже.",
+        'too_many_requests':   "⏳ Слишком много запросов. Подождите минуту.",
+        'btn_new_order':       "Оставить заявку",
+        'btn_cancel':          "❌ Отмена",
+        'btn_back':            "⬅️ Назад",
+        'btn_confirm':         "✅ Да, отправить",
+        'time_14_16':          "Сегодня 14:00-16:00",
+        'time_16_18':          "Сегодня 16:00-18:00",
+        'time_tomorrow_10_12': "Завтра 10:00-12:00",
+        'time_tomorrow_12_14': "Завтра 12:00-14:00",
+        'urgency_normal':      "Обычная",
+        'urgency_urgent':      "Срочно",
+    },
+    'en': {
+        'welcome':             "👋 Welcome! Tap the button below to leave a request.",
+        'prompt_inn':          "Enter the INN (10 or 12 digits):",
+        'error_inn':           "❗️ Invalid INN: 10 or 12 digits with a valid checksum are expected.",
+        'prompt_email':        "Enter your email:",
+        'error_email':         "❗️ Invalid email. Example: example@mail.com",
+        'prompt_name':         "Enter your name:",
+        'error_name':          "❗️ The name must be 2 to 50 characters long.",
+        'prompt_phone':        "Enter your phone number (+7XXXXXXXXXX or 8XXXXXXXXXX):",
+        'error_phone':         "❗️ Invalid format. Example: +71231234567 or 81231234567",
+        'prompt_contact_time': "Choose a convenient time to contact you:",
+        'prompt_service':      "Choose a service:",
+        'prompt_urgency':      "How urgent is it?",
+        'service_unavailable': "This service is no longer available, please choose another one:",
+        'order_summary':       "<b>Please check your details:</b>\n" + ORDER_FIELDS_EN + "\n\nIs everything correct?",
+        'order_saved':         "✅ Your request has been received.",
+        'order_store_error':   "❌ Could not save the request. Please try again later.",
+        'order_cancelled':     "⚠️ Request cancelled.",
+        'order_duplicate':     "✅ This request has already been received, no need to send it again.",
+        'order_rate_limited':  "⏳ Too many requests. Please try again later.",
+        'too_many_requests':   "⏳ Too many requests. Please wait a minute.",
+        'btn_new_order':       "Leave a request",
+        'btn_cancel':          "❌ Cancel",
+        'btn_back':            "⬅️ Back",
+        'btn_confirm':         "✅ Yes, send",
+        'time_14_16':          "Today 14:00-16:00",
+        'time_16_18':          "Today 16:00-18:00",
+        'time_tomorrow_10_12': "Tomorrow 10:00-12:00",
+        'time_tomorrow_12_14': "Tomorrow 12:00-14:00",
+        'urgency_normal':      "Normal",
+        'urgency_urgent':      "Urgent",
+    },
+}
+TIME_SLOTS = ('time_14_16', 'time_16_18', 'time_tomorrow_10_12', 'time_tomorrow_12_14')
+URGENCIES  = ('urgency_normal', 'urgency_urgent')
+
+# (ширина ряда, [(ключ надписи, callback_data), ...]); клавиатура услуг — из справочника
+KEYBOARDS = {
+    'main':        (3, [('btn_new_order', 'new_order')]),
+    'cancel':      (3, [('btn_cancel', 'cancel')]),
+    'back_cancel': (2, [('btn_back', 'back'), ('btn_cancel', 'cancel')]),
+    'time':        (2, [(slot, slot) for slot in TIME_SLOTS]),
+    'urgency':     (2, [(u, u) for u in URGENCIES]),
+    'confirm':     (2, [('btn_confirm', 'confirm'), ('btn_cancel', 'cancel')]),
+}
+
+texts = Texts(TEXTS)
+keyboards = Keyboards(texts, KEYBOARDS)
+# справочник — в базе админки (OrderSession, см. database.py)
+catalog = ServiceCatalog(OrderSession, ttl=float(os.getenv('SERVICES_CACHE_TTL', 30)))
+
+def user_locale():
+    user = types.User.get_current()
+    return texts.locale(user.language_code if user else None)
+
+async def keyboard(name, locale):
+    if name == 'service':
+        return (await catalog.get()).keyboard(locale)
+    return keyboards.get(name, locale)
+
+# 4. Бот и диспетчер
+bot = instrument_bot(Bot(token=BOT_TOKEN, server=api_server()), 'kuzkabuh')
+storage = create_storage()
+dp = Dispatcher(bot, storage=storage)
+dp.middleware.setup(HandlerMetrics('kuzkabuh'))
+# Повторы и флуд отсекаются до хэндлеров; заявки — ещё и по содержимому
+antiflood = AntiFlood(
+    'kuzkabuh', create_backend(),
+    user_limit=int(os.getenv('ANTIFLOOD_USER_LIMIT', 30)),
+    chat_limit=int(os.getenv('ANTIFLOOD_CHAT_LIMIT', 60)),
+    window=float(os.getenv('ANTIFLOOD_WINDOW', 60)),
+    order_limit=int(os.getenv('ORDER_LIMIT', 5)),
+    order_window=float(os.getenv('ORDER_LIMIT_WINDOW', 3600)),
+    order_dedup_window=float(os.getenv('ORDER_DEDUP_WINDOW', 600)),
+    notice=lambda event: texts.render(
+        'too_many_requests', texts.locale(event.from_user and event.from_user.language_code)),
 )
-time_kb = InlineKeyboardMarkup(row_width=2).add(
-    InlineKeyboardButton("Сегодня 14:00-16:00", callback_data="time_14_16"),
-    InlineKeyboardButton("Сегодня 16:00-18:00", callback_data="time_16_18"),
-    InlineKeyboardButton("Завтра 10:00-12:00", callback_data="time_tomorrow_10_12"),
-    InlineKeyboardButton("Завтра 12:00-14:00", callback_data="time_tomorrow_12_14"),
+dp.middleware.setup(antiflood)
+admin_api = AdminApiClient(
+    FLASK_ADMIN_API, ADMIN_USER, ADMIN_PASS,
+    timeout=float(os.getenv('FLASK_ADMIN_API_TIMEOUT', 5)),
+    retries=int(os.getenv('FLASK_ADMIN_API_RETRIES', 2)),
 )
-services = [
-    "Бухгалтерское обслуживание",
-    "Регистрация ИП/ООО",
-    "Сдача отчетности",
-    "Консультация",
-    "Другое"
-]
-service_kb = InlineKeyboardMarkup(row_width=1)
-for svc in services:
-    service_kb.add(InlineKeyboardButton(svc, callback_data=f"service_{svc}"))
-urgency_kb = InlineKeyboardMarkup(row_width=2).add(
-    InlineKeyboardButton("Обычная", callback_data="urgency_normal"),
-    InlineKeyboardButton("Срочно",   callback_data="urgency_urgent")
+outbox = Outbox(admin_api, batch_size=int(os.getenv('OUTBOX_BATCH_SIZE', 50)))
+# Сведения об организации по ИНН (INN_PROVIDER) — необязательное дополнение
+# заявки; без провайдера проверяется только контрольная сумма
+inn_service = InnService(
+    create_provider(),
+    ttl=int(os.getenv('INN_CACHE_TTL', 86400)),
+    cache_size=int(os.getenv('INN_CACHE_SIZE', 10000)),
+)
+INN_LOOKUP_TIMEOUT = float(os.getenv('INN_LOOKUP_TIMEOUT', 1.5))
+sender = MessageScheduler(
+    bot,
+    digest_window=float(os.getenv('ADMIN_DIGEST_WINDOW', 3)),
+    digest_header="💼 <b>Новых заявок: {count}</b>",
 )
 
-# 4. Бот и диспетчер
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(bot, storage=storage)
+# 5. Шаги анкеты: состояние, поле, подсказка, клавиатура, валидатор, ошибка
+# (подсказка и ошибка — ключи TEXTS). Таблица задаёт и переходы вперёд, и
+# кнопку «Назад».
+EMAIL_RE = re.compile(r'[^@]+@[^@]+\.[^@]+')
+PHONE_RE = re.compile(r'(?:\+7|8)\d{10}')
+
+# Предельные длины — как у колонок заявки: длиннее API админки не примет,
+# и заявка застрянет в outbox, хотя пользователю уже ответили «принята»
+MAX_LENGTH = {col.name: col.type.length for col in Order.__table__.columns
+              if getattr(col.type, 'length', None)}
+
+def matches(pattern, field):
+    def check(text):
+        text = text.strip()
+        return text if len(text) <= MAX_LENGTH[field] and pattern.fullmatch(text) else None
+    return check
+
+def checked_inn(text):
+    # контрольная сумма — сразу; сведения об организации начинают
+    # загружаться, пока пользователь заполняет остальные шаги
+    text = text.strip()
+    if not is_valid_inn(text):
+        return None
+    inn_service.prefetch(text)
+    return text
+
+def length_between(n, field):
+    def check(text):
+        text = text.strip()
+        return text if n <= len(text) <= MAX_LENGTH[field] else None
+    return check
+
+Step = namedtuple('Step', 'state field prompt keyboard validator error',
+                  defaults=(None, None))
+
+ORDER_STEPS = [
+    Step(OrderStates.waiting_for_inn, 'inn', 'prompt_inn', 'cancel',
+         checked_inn, 'error_inn'),
+    Step(OrderStates.waiting_for_email, 'email', 'prompt_email', 'back_cancel',
+         matches(EMAIL_RE, 'email'), 'error_email'),
+    Step(OrderStates.waiting_for_name, 'name', 'prompt_name', 'back_cancel',
+         length_between(2, 'name'), 'error_name'),
+    Step(OrderStates.waiting_for_phone, 'phone', 'prompt_phone', 'back_cancel',
+         matches(PHONE_RE, 'phone'), 'error_phone'),
+    Step(OrderStates.waiting_for_contact_time, 'contact_time', 'prompt_contact_time', 'time'),
+    Step(OrderStates.waiting_for_service, 'service', 'prompt_service', 'service'),
+    Step(OrderStates.waiting_for_urgency, 'urgency', 'prompt_urgency', 'urgency'),
+]
+STEP_BY_FIELD = {s.field: s for s in ORDER_STEPS}
+STEP_INDEX    = {s.state.state: i for i, s in enumerate(ORDER_STEPS)}
+STEP_INDEX[OrderStates.confirm.state] = len(ORDER_STEPS)
 
-# 5. Хэндлеры
+# Воронка: сколько раз анкета дошла до шага (поле шага, confirm, submitted)
+# и чем закончилась. Конверсия шага — отношение соседних счётчиков.
+FUNNEL = metrics.counter('order_funnel_total', 'Переходы анкеты по шагам', ['step'])
+INVALID = metrics.counter('order_step_invalid_total', 'Отклонённые ответы на шагах', ['step'])
+
+async def go_to_step(step, state, message, edit=False, back=False):
+    if not back:
+        FUNNEL.inc(step=step.field)
+    await state.set_state(step.state)
+    locale = user_locale()
+    text, markup = texts.render(step.prompt, locale), await keyboard(step.keyboard, locale)
+    if edit:
+        await message.edit_text(text, reply_markup=markup)
+    else:
+        await message.answer(text, reply_markup=markup)
+
+# 6. Хэндлеры
 
 @dp.message_handler(commands=['start'])
 async def cmd_start(message: types.Message, state: FSMContext):
     await state.finish()
-    await message.answer(
-        "👋 Добро пожаловать! Нажмите кнопку ниже, чтобы оставить заявку.",
-        reply_markup=main_kb
-    )
+    locale = user_locale()
+    await message.answer(texts.render('welcome', locale), reply_markup=keyboards.get('main', locale))
 
 @dp.callback_query_handler(lambda c: c.data=="new_order")
 async def process_new_order(cq: types.CallbackQuery, state: FSMContext):
-    await OrderStates.waiting_for_inn.set()
-    await cq.message.answer("Введите ИНН (10 или 12 цифр):", reply_markup=cancel_kb)
+    await go_to_step(ORDER_STEPS[0], state, cq.message)
     await cq.answer()
 
-# Ввод ИНН
-@dp.message_handler(lambda m: not re.fullmatch(r'\d{10}|\d{12}', m.text),
-                    state=OrderStates.waiting_for_inn)
-async def invalid_inn(message: types.Message):
-    await message.answer("❗️ ИНН должен быть 10 или 12 цифр.", reply_markup=cancel_kb)
-
-@dp.message_handler(lambda m: re.fullmatch(r'\d{10}|\d{12}', m.text),
-                    state=OrderStates.waiting_for_inn)
-async def process_inn(message: types.Message, state: FSMContext):
-    await state.update_data(inn=message.text)
-    await OrderStates.next()
-    await message.answer("Введите ваш Email:", reply_markup=back_cancel_kb)
-
-# Ввод Email
-@dp.message_handler(lambda m: not re.fullmatch(r"[^@]+@[^@]+\.[^@]+", m.text),
-                    state=OrderStates.waiting_for_email)
-async def invalid_email(message: types.Message):
-    await message.answer("❗️ Некорректный email. Пример: example@mail.ru", reply_markup=back_cancel_kb)
-
-@dp.message_handler(lambda m: re.fullmatch(r"[^@]+@[^@]+\.[^@]+", m.text),
-                    state=OrderStates.waiting_for_email)
-async def process_email(message: types.Message, state: FSMContext):
-    await state.update_data(email=message.text)
-    await OrderStates.next()
-    await message.answer("Введите ваше имя:", reply_markup=back_cancel_kb)
-
-# Ввод Имени
-@dp.message_handler(lambda m: len(m.text.strip())<2,
-                    state=OrderStates.waiting_for_name)
-async def invalid_name(message: types.Message):
-    await message.answer("❗️ Имя должно быть минимум 2 символа.", reply_markup=back_cancel_kb)
-
-@dp.message_handler(state=OrderStates.waiting_for_name)
-async def process_name(message: types.Message, state: FSMContext):
-    await state.update_data(name=message.text.strip())
-    await OrderStates.next()
-    await message.answer(
-        "Введите ваш телефон (+7XXXXXXXXXX или 8XXXXXXXXXX):",
-        reply_markup=back_cancel_kb
-    )
+# Текстовые шаги: один хэндлер на состояние, валидация — один раз
+def text_step_handler(step, next_step):
+    async def handler(message: types.Message, state: FSMContext):
+        value = step.validator(message.text)
+        if value is None:
+            INVALID.inc(step=step.field)
+            locale = user_locale()
+            await message.answer(texts.render(step.error, locale),
+                                 reply_markup=keyboards.get(step.keyboard, locale))
+            return
+        await state.update_data({step.field: value})
+        await go_to_step(next_step, state, message)
+    handler.__name__ = f'step_{step.field}'   # имя хэндлера — метка в метриках
+    return handler
 
-# Ввод телефона
-@dp.message_handler(lambda m: not re.fullmatch(r'^(?:\+7|8)\d{10}$', m.text),
-                    state=OrderStates.waiting_for_phone)
-async def invalid_phone(message: types.Message):
-    await message.answer(
-        "❗️ Неверный формат. Пример: +71231234567 или 81231234567",
-        reply_markup=back_cancel_kb
-    )
+for step, next_step in zip(ORDER_STEPS, ORDER_STEPS[1:]):
+    if step.validator is not None:
+        dp.register_message_handler(text_step_handler(step, next_step), state=step.state)
 
-@dp.message_handler(lambda m: re.fullmatch(r'^(?:\+7|8)\d{10}$', m.text),
-                    state=OrderStates.waiting_for_phone)
-async def process_phone(message: types.Message, state: FSMContext):
-    await state.update_data(phone=message.text)
-    await OrderStates.next()
-    await message.answer("Выберите желаемое время для связи:", reply_markup=time_kb)
+# Время и срочность храним ключами TEXTS, услугу — id из справочника;
+# надписи подставляются при показе (на языке пользователя) и при записи
+# заявки (по-русски). Старые значения-строки показываются как есть.
+def label(value, locale):
+    return texts.text(value, locale) if value in TIME_SLOTS or value in URGENCIES else value
+
+async def order_fields(data, locale):
+    services = await catalog.get()
+    service = services.title(data.get('service_id'), locale) or data['service']
+    return dict(
+        inn=data['inn'], email=data['email'], name=data['name'], phone=data['phone'],
+        contact_time=label(data['contact_time'], locale), service=service,
+        urgency=label(data['urgency'], locale),
+    )
 
 # Выбор времени
-@dp.callback_query_handler(lambda c: c.data.startswith("time_"),
+@dp.callback_query_handler(lambda c: c.data in TIME_SLOTS,
                            state=OrderStates.waiting_for_contact_time)
 async def process_contact_time(cq: types.CallbackQuery, state: FSMContext):
-    slot = cq.data.replace("time_","").replace("_"," ").capitalize()
-    await state.update_data(contact_time=slot)
-    await OrderStates.next()
-    await cq.message.edit_text("Выберите услугу:", reply_markup=service_kb)
+    await state.update_data(contact_time=cq.data)
+    await go_to_step(STEP_BY_FIELD['service'], state, cq.message, edit=True)
     await cq.answer()
 
-# Выбор услуги
-@dp.callback_query_handler(lambda c: c.data.startswith("service_"),
+# Выбор услуги; «service_<название>» — кнопки, отправленные до справочника
+@dp.callback_query_handler(lambda c: c.data.startswith(("svc:", "service_")),
                            state=OrderStates.waiting_for_service)
 async def process_service(cq: types.CallbackQuery, state: FSMContext):
-    svc = cq.data.replace("service_","")
-    await state.update_data(service=svc)
-    await OrderStates.next()
-    await cq.message.edit_text("Укажите срочность:", reply_markup=urgency_kb)
+    services = await catalog.get()
+    if cq.data.startswith("service_"):
+        item = services.by_title.get(cq.data[len("service_"):])
+    else:
+        item = services.by_id.get(parse_callback(cq.data))
+    if item is None:
+        # услугу выключили в админке — перечитаем справочник и покажем заново
+        catalog.invalidate()
+        locale = user_locale()
+        await cq.message.edit_text(texts.render('service_unavailable', locale),
+                                   reply_markup=await keyboard('service', locale))
+        await cq.answer()
+        return
+    await state.update_data(service=item.title, service_id=item.id)
+    await go_to_step(STEP_BY_FIELD['urgency'], state, cq.message, edit=True)
     await cq.answer()
 
 # Выбор срочности
-@dp.callback_query_handler(lambda c: c.data.startswith("urgency_"),
+@dp.callback_query_handler(lambda c: c.data in URGENCIES,
                            state=OrderStates.waiting_for_urgency)
 async def process_urgency(cq: types.CallbackQuery, state: FSMContext):
-    urg = "Срочно" if cq.data=="urgency_urgent" else "Обычная"
-    await state.update_data(urgency=urg)
-
-    d = await state.get_data()
-    summary = (
-        f"<b>Проверьте данные:</b>\n"
-        f"ИНН: <code>{d['inn']}</code>\n"
-        f"Email: <code>{d['email']}</code>\n"
-        f"Имя: <code>{d['name']}</code>\n"
-        f"Телефон: <code>{d['phone']}</code>\n"
-        f"Время связи: <code>{d['contact_time']}</code>\n"
-        f"Услуга: <code>{d['service']}</code>\n"
-        f"Срочность: <code>{d['urgency']}</code>\n\n"
-        "Все верно?"
-    )
-    kb = InlineKeyboardMarkup(row_width=2).add(
-        InlineKeyboardButton("✅ Да, отправить", callback_data="confirm"),
-        InlineKeyboardButton("❌ Отмена",       callback_data="cancel")
-    )
-    await OrderStates.next()
-    await cq.message.edit_text(summary, reply_markup=kb, parse_mode="HTML")
+    await state.update_data(urgency=cq.data)
+
+    locale = user_locale()
+    fields = await order_fields(await state.get_data(), locale)
+    FUNNEL.inc(step='confirm')
+    await state.set_state(OrderStates.confirm)
+    await cq.message.edit_text(texts.render('order_summary', locale, **fields),
+                               reply_markup=keyboards.get('confirm', locale), parse_mode="HTML")
     await cq.answer()
 
+async def store_order(telegram_id, order, key):
+    # Профиль и outbox — в базе бота одной транзакцией; в режимах db/dual
+    # заявка затем пишется напрямую в базу заявок. Повтор с тем же ключом
+    # упирается в уникальный индекс — значит, эта часть уже сделана.
+    try:
+        async with SessionLocal() as session:
+            await repository.upsert_user(session, telegram_id, **order)
+            if ORDER_WRITE_MODE in ('api', 'dual'):
+                outbox.add(session, dict(order, telegram_id=telegram_id), key=key)
+            await session.commit()
+    except IntegrityError:
+        pass
+    outbox.wake()
+
+    if ORDER_WRITE_MODE in ('db', 'dual'):
+        try:
+            async with OrderSession() as session:
+                await repository.create_order(session, telegram_id, order, key=key)
+                await session.commit()
+        except IntegrityError:
+            pass
+        except Exception:
+            if ORDER_WRITE_MODE == 'db':
+                raise
+            # в режиме dual заявку доставит outbox
+            logging.exception("Direct order write failed")
+
 # Подтверждение
 @dp.callback_query_handler(lambda c: c.data=="confirm", state=OrderStates.confirm)
 async def process_confirm(cq: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
-    ok = False
+    locale = user_locale()
+    order = await order_fields(data, DEFAULT_LOCALE)
+    # та же заявка ещё раз (новый проход анкеты, другой аккаунт) или поток
+    # заявок от одного пользователя — без записи и уведомления админа
+    refused = await antiflood.claim_order(cq.from_user.id, order)
+    if refused:
+        FUNNEL.inc(step=refused)
+        await state.finish()
+        await cq.message.edit_text(
+            texts.render('order_duplicate' if refused == 'order_repeat' else 'order_rate_limited', locale),
+            reply_markup=None)
+        await cq.answer()
+        return
+    # обычно уже в кэше (загрузка началась на шаге ИНН); не дождались — без неё
+    order.update(company_fields(await inn_service.lookup(data['inn'], INN_LOOKUP_TIMEOUT)))
+    # ключ живёт в FSM: повторное «Да» после сбоя не создаст вторую заявку
+    key = data.get('order_key') or new_key()
+    await state.update_data(order_key=key)
     try:
-        resp = requests.post(
-            FLASK_ADMIN_API,
-            json={
-                "inn":          data['inn'],
-                "email":        data['email'],
-                "name":         data['name'],
-                "phone":        data['phone'],
-                "contact_time": data['contact_time'],
-                "service":      data['service'],
-                "urgency":      data['urgency'],
-            },
-            auth=(ADMIN_USER, ADMIN_PASS),
-            timeout=5
-        )
-        ok = resp.ok
-    except Exception as e:
-        print("API error:", e)
-        ok = False
+        await store_order(cq.from_user.id, order, key)
+    except Exception:
+        logging.exception("Order store error")
+        FUNNEL.inc(step='store_error')
+        await antiflood.release_order(order)
+        # данные FSM не сбрасываем — пользователь может нажать «Да» ещё раз
+        await cq.message.edit_text(texts.render('order_store_error', locale),
+                                   reply_markup=keyboards.get('confirm', locale))
+        await cq.answer()
+        return
 
     # уведомляем админа в Telegram
-    admin_msg = (
-        f"💼 <b>Новая заявка!</b>\n"
-        f"ИНН: <code>{data['inn']}</code>\n"
-        f"Email: <code>{data['email']}</code>\n"
-        f"Имя: <code>{data['name']}</code>\n"
-        f"Телефон: <code>{data['phone']}</code>\n"
-        f"Время связи: <code>{data['contact_time']}</code>\n"
-        f"Услуга: <code>{data['service']}</code>\n"
-        f"Срочность: <code>{data['urgency']}</code>"
-    )
-    await bot.send_message(ADMIN_ID, admin_msg, parse_mode="HTML")
-
-    if ok:
-        await cq.message.edit_text("✅ Заявка принята и сохранена.", reply_markup=None)
-    else:
-        await cq.message.edit_text("❌ Ошибка при сохранении. Попробуйте позже.", reply_markup=None)
+    admin_msg = texts.render('order_admin', **order)
+    if order.get('company_name'):
+        company = order['company_name']
+        if order.get('tax_regime'):
+            company += f" ({order['tax_regime']})"
+        admin_msg += texts.render('order_company', company=company)
+    sender.notify(ADMIN_ID, admin_msg, parse_mode="HTML")
+    FUNNEL.inc(step='submitted')
 
+    await cq.message.edit_text(texts.render('order_saved', locale), reply_markup=None)
     await state.finish()
     await cq.answer()
 
 # Отмена
 @dp.callback_query_handler(lambda c: c.data=="cancel", state="*")
 async def process_cancel(cq: types.CallbackQuery, state: FSMContext):
+    FUNNEL.inc(step='cancelled')
     await state.finish()
-    await cq.message.edit_text("⚠️ Заявка отменена.", reply_markup=None)
+    await cq.message.edit_text(texts.render('order_cancelled', user_locale()), reply_markup=None)
     await cq.answer()
 
 # Назад
 @dp.callback_query_handler(lambda c: c.data=="back", state="*")
 async def process_back(cq: types.CallbackQuery, state: FSMContext):
-    cur = await state.get_state()
-    if cur == OrderStates.waiting_for_email.state:
-        await OrderStates.waiting_for_inn.set()
-        await cq.message.edit_text("Введите ИНН (10 или 12 цифр):", reply_markup=cancel_kb)
-    elif cur == OrderStates.waiting_for_name.state:
-        await OrderStates.waiting_for_email.set()
-        await cq.message.edit_text("Введите ваш Email:", reply_markup=back_cancel_kb)
-    elif cur == OrderStates.waiting_for_phone.state:
-        await OrderStates.waiting_for_name.set()
-        await cq.message.edit_text("Введите ваше имя:", reply_markup=back_cancel_kb)
-    elif cur == OrderStates.waiting_for_contact_time.state:
-        await OrderStates.waiting_for_phone.set()
-        await cq.message.edit_text(
-            "Введите ваш телефон (+7XXXXXXXXXX или 8XXXXXXXXXX):",
-            reply_markup=back_cancel_kb
-        )
-    elif cur == OrderStates.waiting_for_service.state:
-        await OrderStates.waiting_for_contact_time.set()
-        await cq.message.edit_text("Выберите время:", reply_markup=time_kb)
-    elif cur == OrderStates.waiting_for_urgency.state:
-        await OrderStates.waiting_for_service.set()
-        await cq.message.edit_text("Выберите услугу:", reply_markup=service_kb)
-    elif cur == OrderStates.confirm.state:
-        await OrderStates.waiting_for_urgency.set()
-        await cq.message.edit_text("Укажите срочность:", reply_markup=urgency_kb)
+    idx = STEP_INDEX.get(await state.get_state())
+    if idx:
+        await go_to_step(ORDER_STEPS[idx - 1], state, cq.message, edit=True, back=True)
     await cq.answer()
 
 # WEBHOOK
 async def on_startup(dp):
-    await bot.set_webhook(WEBHOOK_URL, allowed_updates=["message","callback_query"])
+    if not SHARED_ORDERS_DB:
+        logging.error("ORDERS_DATABASE_URL и FLASK_DB_URI не заданы: справочник услуг "
+                      "читается из базы бота, правки услуг в админке боту не видны")
+    # база и проверка вебхука — параллельно, это два независимых ожидания
+    await asyncio.gather(
+        init_db(),
+        ensure_webhook(bot, WEBHOOK_URL, allowed_updates=["message","callback_query"],
+                       drop_pending_updates=True),
+    )
+    await admin_api.start()
+    outbox.start()
 
+# Вебхук при остановке не снимаем: Telegram копит апдейты до перезапуска
 async def on_shutdown(dp):
-    await bot.delete_webhook()
-    await storage.close()
-    await storage.wait_closed()
+    await outbox.stop()
+    await sender.stop()
+    await admin_api.close()
+    await inn_service.close()
+    await antiflood.close()
+    # хранилище FSM закрывает run_webhook (и executor aiogram) после этого хука
 
 if __name__ == "__main__":
-    start_webhook(
-        dispatcher=dp,
-        webhook_path=WEBHOOK_PATH,
+    run_webhook(
+        dp,
+        WEBHOOK_PATH,
         on_startup=on_startup,
         on_shutdown=on_shutdown,
         skip_updates=True,
@@ -1,47 +1,127 @@
+import asyncio
 import os
-import aiohttp
+import sys
 from aiogram import Bot, Dispatcher, types
-from aiogram.utils.executor import start_webhook
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from dotenv import load_dotenv
 
+# Корень проекта — для общих модулей
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+# .env — до общих модулей: database.py читает адреса баз при импорте
 load_dotenv('/root/kuzkabuh/.env')
 
+from bot_metrics import HandlerMetrics, instrument_bot
+from database import init_db
+from job_scheduler import create_scheduler, start_cron_jobs, task
+from rates import CBR_DAILY, CbrRates, RatesUnavailable
+from rates_history import RatesHistory
+from tg_sender import MessageScheduler
+from webhook_pipeline import run_webhook, ensure_webhook, api_server
+
 BOT_TOKEN = os.getenv('KUZKAINFO_BOT_TOKEN')
 WEBHOOK_HOST = os.getenv('WEBHOOK_HOST')
 WEBHOOK_PATH = os.getenv('KUZKAINFO_WEBHOOK_PATH')
 WEBHOOK_URL = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
 GROUP_ID = os.getenv('ADMIN_GROUP_ID')
 
-bot = Bot(token=BOT_TOKEN)
+bot = instrument_bot(Bot(token=BOT_TOKEN, server=api_server()), 'kuzkainfo')
 dp = Dispatcher(bot)
-scheduler = AsyncIOScheduler()
-
-CBR_DAILY = "https://www.cbr-xml-daily.ru/daily_json.js"
-
-async def fetch_currency():
-    async with aiohttp.ClientSession() as session:
-        async with session.get(CBR_DAILY) as resp:
-            data = await resp.json()
-    usd = data['Valute']['USD']['Value']
-    eur = data['Valute']['EUR']['Value']
-    prev_usd = data['Valute']['USD']['Previous']
-    prev_eur = data['Valute']['EUR']['Previous']
-    msg = (
-        f"💵 Доллар: {usd:.2f} ({'+' if usd > prev_usd else ''}{usd-prev_usd:.2f})\n"
-        f"💶 Евро: {eur:.2f} ({'+' if eur > prev_eur else ''}{eur-prev_eur:.2f})"
-    )
-    return msg
+dp.middleware.setup(HandlerMetrics('kuzkainfo'))
+# Планировщик создаётся в on_startup — APScheduler не нужен, пока бот не
+# запущен. Задания хранятся в базе (см. job_scheduler.py)
+scheduler = None
+SCHEDULE = {
+    'send_currency':          {'hour': 9, 'minute': 0},
+    'send_currency_next_day': {'hour': 18, 'minute': 0},
+}
+sender = MessageScheduler(bot)
+
+rates = CbrRates(
+    os.getenv('CBR_DAILY_URL', CBR_DAILY),
+    cache_path=os.getenv('CBR_CACHE_PATH', 'cbr_daily.json'),
+    ttl=int(os.getenv('CBR_CACHE_TTL', 600)),
+)
+
+history = RatesHistory(rates)
+
+def format_currency(history):
+    day = history.latest_date()
+    lines = []
+    for code, icon, title in (('USD', '💵', 'Доллар'), ('EUR', '💶', 'Евро')):
+        value = history.value(code, day)
+        prev = history.previous(code)
+        if value is None:
+            continue
+        if prev is None:
+            lines.append(f"{icon} {title}: {value:.2f}")
+        else:
+            lines.append(f"{icon} {title}: {value:.2f} ({'+' if value > prev else ''}{value-prev:.2f})")
+    return "\n".join(lines)
+
+def format_history(history, code, days):
+    points = history.series(code, days)
+    if not points:
+        return f"Нет данных по {code}."
+    name = history.names.get(code, code)
+    lines = [f"{name} ({code}), последние {len(points)} дн.:"]
+    lines += [f"{d:%d.%m.%Y} — {v:.4f}" for d, v in points]
+    return "\n".join(lines)
 
+def format_week(history):
+    rows = sorted(history.changes(7), key=lambda r: -abs(r[3]))
+    lines = [f"Изменение за неделю (на {history.latest_date():%d.%m.%Y}):"]
+    lines += [f"{code}: {now:.4f} ({pct:+.2f}%)" for code, now, then, pct in rows]
+    return "\n".join(lines)
+
+async def fetch_currency(revalidate=False):
+    await history.sync(revalidate)
+    return history.render(format_currency)
+
+@task('send_currency')
 async def send_currency():
-    msg = await fetch_currency()
+    msg = await fetch_currency(revalidate=True)
     if GROUP_ID:
-        await bot.send_message(GROUP_ID, f"Курс валют на сегодня:\n{msg}")
+        await sender.send(GROUP_ID, f"Курс валют на сегодня:\n{msg}")
 
+@task('send_currency_next_day')
 async def send_currency_next_day():
-    msg = await fetch_currency()
+    msg = await fetch_currency(revalidate=True)
     if GROUP_ID:
-        await bot.send_message(GROUP_ID, f"Курс валют на завтра:\n{msg}")
+        await sender.send(GROUP_ID, f"Курс валют на завтра:\n{msg}")
+
+@dp.message_handler(commands="rates")
+async def cmd_rates(message: types.Message):
+    try:
+        msg = await fetch_currency()
+    except RatesUnavailable:
+        await message.reply("⚠️ Курсы временно недоступны, попробуйте позже.")
+        return
+    await message.reply(f"Курс валют ЦБ РФ:\n{msg}")
+
+# /history CNY 10 — курс валюты за последние N дней
+@dp.message_handler(commands="history")
+async def cmd_history(message: types.Message):
+    args = message.get_args().split()
+    code = args[0].upper() if args else 'USD'
+    # isdecimal, а не isdigit: '²'.isdigit() истинно, но int('²') падает
+    days = max(1, min(int(args[1]), 60)) if len(args) > 1 and args[1].isdecimal() else 7
+    try:
+        await history.sync()
+    except RatesUnavailable:
+        pass
+    await message.reply(history.render(format_history, code, days))
+
+# /week — изменение всех валют за неделю
+@dp.message_handler(commands="week")
+async def cmd_week(message: types.Message):
+    try:
+        await history.sync()
+    except RatesUnavailable:
+        pass
+    if history.latest_date() is None:
+        await message.reply("⚠️ Курсы временно недоступны, попробуйте позже.")
+        return
+    await message.reply(history.render(format_week))
 
 @dp.message_handler(commands="start")
 async def welcome(message: types.Message):
@@ -53,18 +133,29 @@ async def new_user(message: types.Message):
         await message.reply(f"👋 Добро пожаловать, {user.first_name}! Мы рады вас видеть!")
 
 async def on_startup(dp):
-    await bot.set_webhook(WEBHOOK_URL)
-    scheduler.add_job(send_currency, 'cron', hour=9, minute=0)
-    scheduler.add_job(send_currency_next_day, 'cron', hour=18, minute=0)
-    scheduler.start()
+    global scheduler
+    await rates.start()
+
+    async def load_history():
+        await init_db()
+        await history.load()
+
+    # база и проверка вебхука — параллельно, это два независимых ожидания
+    await asyncio.gather(load_history(), ensure_webhook(bot, WEBHOOK_URL, drop_pending_updates=True))
+    scheduler = create_scheduler('kuzkainfo')
+    start_cron_jobs(scheduler, SCHEDULE)
 
+# Вебхук при остановке не снимаем: Telegram копит апдейты до перезапуска
 async def on_shutdown(dp):
-    await bot.delete_webhook()
+    if scheduler is not None:
+        scheduler.shutdown(wait=False)
+    await sender.stop()
+    await rates.close()
 
 if __name__ == "__main__":
-    start_webhook(
-        dispatcher=dp,
-        webhook_path=WEBHOOK_PATH,
+    run_webhook(
+        dp,
+        WEBHOOK_PATH,
         on_startup=on_startup,
         on_shutdown=on_shutdown,
         skip_updates=True,
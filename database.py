@@ -1,8 +1,40 @@
+import asyncio
+import os
+
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from models import Base, engine
+from models import Base, engine, sqlite_pragmas
+from schema import metadata as order_metadata, upgrade_schema, seed_services, async_url
 
-async def init_db():
+# Заявки (schema.Order) и справочник услуг живут в общей с админкой базе:
+# ORDERS_DATABASE_URL, а без неё — FLASK_DB_URI админки из того же .env.
+# Без обеих — в базе бота, которую админка не читает (SHARED_ORDERS_DB)
+ORDERS_DATABASE_URL = os.getenv("ORDERS_DATABASE_URL") or os.getenv("FLASK_DB_URI")
+SHARED_ORDERS_DB = bool(ORDERS_DATABASE_URL)
+if ORDERS_DATABASE_URL:
+    orders_engine = create_async_engine(async_url(ORDERS_DATABASE_URL), echo=False)
+    if orders_engine.dialect.name == "sqlite":
+        event.listen(orders_engine.sync_engine, "connect", sqlite_pragmas)
+else:
+    orders_engine = engine
+
+_init_task = None
+
+async def _create_tables():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema, Base.metadata)
+    async with orders_engine.begin() as conn:
+        await conn.run_sync(order_metadata.create_all)
+        await conn.run_sync(upgrade_schema, order_metadata)
+        await conn.run_sync(seed_services)
+
+async def init_db():
+    # Один раз на процесс: в launcher.py оба бота стартуют одновременно
+    global _init_task
+    if _init_task is None:
+        _init_task = asyncio.ensure_future(_create_tables())
+    await _init_task
 SessionLocal = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+OrderSession = sessionmaker(orders_engine, expire_on_commit=False, class_=AsyncSession)
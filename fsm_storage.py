@@ -0,0 +1,212 @@
+# fsm_storage.py
+# coding: utf-8
+#
+# Хранилища FSM для aiogram. Бэкенд выбирается переменной FSM_STORAGE:
+#   sqlite (по умолчанию) — таблица fsm_states в базе models.py;
+#   redis  — aiogram RedisStorage2 (ставится отдельно: pip install redis);
+#   memory — MemoryStorage, состояние теряется при перезапуске.
+
+import asyncio
+import copy
+import logging
+import os
+from datetime import datetime, timedelta
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher.storage import BaseStorage
+from sqlalchemy import delete
+
+from database import SessionLocal
+from models import FsmRecord
+from schema import dialect_insert
+
+log = logging.getLogger(__name__)
+
+# Незавершённые заявки старше суток считаем брошенными
+FSM_TTL = int(os.getenv('FSM_TTL', 24 * 3600))
+
+
+def _empty():
+    return {'state': None, 'data': {}, 'bucket': {}}
+
+
+class SQLiteStorage(BaseStorage):
+    # Записи копятся в памяти и пишутся в базу одной транзакцией раз в
+    # flush_interval: несколько update_data/set_state одного апдейта
+    # превращаются в один upsert. Пока запись не сброшена, чтение идёт из
+    # памяти; остальное читается из базы, поэтому хранилище можно делить
+    # между процессами (расхождение — не больше flush_interval). Сбросы
+    # идут строго по одному: пачка уходит из _flushing только после своего
+    # commit, и более старая пачка не может перезаписать более новую.
+
+    def __init__(self, *, session_factory=SessionLocal, flush_interval=0.05,
+                 ttl=FSM_TTL, cleanup_interval=600):
+        self.session_factory  = session_factory
+        self.flush_interval   = flush_interval
+        self.ttl              = ttl
+        self.cleanup_interval = cleanup_interval
+        self._pending  = {}
+        self._flushing = {}
+        self._flush_task   = None
+        self._flush_lock   = asyncio.Lock()
+        self._last_cleanup = datetime.utcnow()
+
+    def _key(self, chat, user):
+        chat, user = self.check_address(chat=chat, user=user)
+        return str(chat), str(user)
+
+    async def _load(self, key):
+        rec = self._pending.get(key) or self._flushing.get(key)
+        if rec is not None:
+            return rec
+        async with self.session_factory() as session:
+            row = await session.get(FsmRecord, key)
+        if row is None or row.updated_at < datetime.utcnow() - timedelta(seconds=self.ttl):
+            return _empty()
+        return {'state': row.state, 'data': row.data or {}, 'bucket': row.bucket or {}}
+
+    def _store(self, key, rec):
+        self._pending[key] = rec
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        # Пока задача жива, новые записи копятся в _pending и ждут её;
+        # что накопилось за время commit — следующим тиком
+        try:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+        finally:
+            self._flush_task = None
+        if self._pending:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def flush(self):
+        async with self._flush_lock:
+            if self._pending:
+                await self._flush_batch()
+
+    async def _flush_batch(self):
+        batch = self._flushing = self._pending
+        self._pending = {}
+        now = datetime.utcnow()
+        try:
+            async with self.session_factory() as session:
+                insert = dialect_insert(session.bind.dialect.name)
+                for (chat, user), rec in batch.items():
+                    if rec == _empty():
+                        await session.execute(delete(FsmRecord).where(
+                            FsmRecord.chat == chat, FsmRecord.user == user))
+                        continue
+                    values = dict(rec, chat=chat, user=user, updated_at=now)
+                    stmt = insert(FsmRecord).values(**values)
+                    await session.execute(stmt.on_conflict_do_update(
+                        index_elements=[FsmRecord.chat, FsmRecord.user],
+                        set_={k: stmt.excluded[k] for k in ('state', 'data', 'bucket', 'updated_at')},
+                    ))
+                if now - self._last_cleanup > timedelta(seconds=self.cleanup_interval):
+                    await session.execute(delete(FsmRecord).where(
+                        FsmRecord.updated_at < now - timedelta(seconds=self.ttl)))
+                    self._last_cleanup = now
+                await session.commit()
+        except asyncio.CancelledError:
+            # close() посреди commit — запишем при финальном flush
+            self._requeue(batch)
+            raise
+        except Exception:
+            log.exception("FSM storage: не удалось сохранить %s записей", len(batch))
+            # не теряем данные; повторит _flush_later
+            self._requeue(batch)
+        finally:
+            self._flushing = {}
+
+    def _requeue(self, batch):
+        # вернуть в очередь всё, что не было перезаписано позже
+        for key, rec in batch.items():
+            self._pending.setdefault(key, rec)
+
+    async def close(self):
+        task, self._flush_task = self._flush_task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *, chat=None, user=None, default=None):
+        rec = await self._load(self._key(chat, user))
+        return rec['state'] if rec['state'] is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default=None):
+        rec = await self._load(self._key(chat, user))
+        return copy.deepcopy(rec['data']) if rec['data'] else copy.deepcopy(default or {})
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        key = self._key(chat, user)
+        rec = dict(await self._load(key))
+        rec['state'] = self.resolve_state(state)
+        self._store(key, rec)
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        key = self._key(chat, user)
+        rec = dict(await self._load(key))
+        rec['data'] = copy.deepcopy(data or {})
+        self._store(key, rec)
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        key = self._key(chat, user)
+        rec = dict(await self._load(key))
+        rec['data'] = dict(rec['data'])
+        rec['data'].update(copy.deepcopy(data or {}), **kwargs)
+        self._store(key, rec)
+
+    async def reset_state(self, *, chat=None, user=None, with_data=True):
+        key = self._key(chat, user)
+        rec = dict(await self._load(key))
+        rec['state'] = None
+        if with_data:
+            rec['data'] = {}
+        self._store(key, rec)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat=None, user=None, default=None):
+        rec = await self._load(self._key(chat, user))
+        return copy.deepcopy(rec['bucket']) if rec['bucket'] else copy.deepcopy(default or {})
+
+    async def set_bucket(self, *, chat=None, user=None, bucket=None):
+        key = self._key(chat, user)
+        rec = dict(await self._load(key))
+        rec['bucket'] = copy.deepcopy(bucket or {})
+        self._store(key, rec)
+
+    async def update_bucket(self, *, chat=None, user=None, bucket=None, **kwargs):
+        key = self._key(chat, user)
+        rec = dict(await self._load(key))
+        rec['bucket'] = dict(rec['bucket'])
+        rec['bucket'].update(copy.deepcopy(bucket or {}), **kwargs)
+        self._store(key, rec)
+
+
+def create_storage(kind=None):
+    kind = (kind or os.getenv('FSM_STORAGE', 'sqlite')).lower()
+    if kind == 'memory':
+        return MemoryStorage()
+    if kind == 'sqlite':
+        return SQLiteStorage(
+            flush_interval=float(os.getenv('FSM_FLUSH_INTERVAL', 0.05)),
+            ttl=FSM_TTL,
+        )
+    if kind == 'redis':
+        from aiogram.contrib.fsm_storage.redis import RedisStorage2
+        return RedisStorage2(
+            host=os.getenv('FSM_REDIS_HOST', 'localhost'),
+            port=int(os.getenv('FSM_REDIS_PORT', 6379)),
+            db=int(os.getenv('FSM_REDIS_DB', 0)),
+            password=os.getenv('FSM_REDIS_PASSWORD'),
+            state_ttl=FSM_TTL, data_ttl=FSM_TTL, bucket_ttl=FSM_TTL,
+        )
+    raise ValueError(f"Неизвестный FSM_STORAGE: {kind}")
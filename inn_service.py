@@ -0,0 +1,220 @@
+# inn_service.py
+# coding: utf-8
+#
+# Проверка и обогащение ИНН:
+#   - is_valid_inn — длина и контрольные цифры по алгоритму ФНС, без сети;
+#   - InnService.lookup — название, статус и налоговый режим организации
+#     от провайдера (INN_PROVIDER, сейчас dadata). Ответы кэшируются в
+#     памяти (LRU + TTL) и в таблице inn_info базы бота, параллельные
+#     запросы одного ИНН идут к провайдеру одним запросом. Повторный клиент
+#     провайдера не трогает. Недоступный провайдер заявку не задерживает:
+#     lookup вернёт None по таймауту, а ответ осядет в кэше к следующему разу.
+#
+#   INN_PROVIDER=dadata INN_PROVIDER_TOKEN=... [INN_PROVIDER_URL=http://127.0.0.1:18280/party]
+
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+import aiohttp
+
+import metrics
+import repository
+from database import SessionLocal
+from schema import Order
+
+log = logging.getLogger(__name__)
+
+INN_RE = re.compile(r'[0-9]{10}|[0-9]{12}')
+WEIGHTS_10 = (2, 4, 10, 3, 5, 9, 4, 6, 8)
+WEIGHTS_11 = (7, 2, 4, 10, 3, 5, 9, 4, 6, 8)
+WEIGHTS_12 = (3, 7, 2, 4, 10, 3, 5, 9, 4, 6, 8)
+
+LOOKUPS = metrics.counter('inn_lookups_total', 'Поиск сведений по ИНН по источнику', ['source'])
+
+
+def _check_digit(digits, weights):
+    return sum(d * w for d, w in zip(digits, weights)) % 11 % 10
+
+
+def is_valid_inn(inn):
+    # 10 цифр — организация, 12 — ИП/физлицо (две контрольные цифры)
+    if not INN_RE.fullmatch(inn):
+        return False
+    digits = [int(c) for c in inn]
+    if len(digits) == 10:
+        return _check_digit(digits, WEIGHTS_10) == digits[9]
+    return (_check_digit(digits, WEIGHTS_11) == digits[10]
+            and _check_digit(digits, WEIGHTS_12) == digits[11])
+
+
+CompanyInfo = namedtuple('CompanyInfo', 'inn name status tax_regime')
+
+
+def company_fields(info):
+    # CompanyInfo -> необязательные поля заявки (schema.COMPANY_FIELDS)
+    if info is None:
+        return {}
+    columns = Order.__table__.columns
+    values = {'company_name': info.name, 'company_status': info.status,
+              'tax_regime': info.tax_regime}
+    return {k: v[:columns[k].type.length] for k, v in values.items() if v}
+
+
+# -- провайдеры: async lookup(inn) -> CompanyInfo | None (не найден) --
+
+class DadataProvider:
+    # https://dadata.ru/api/find-party/ — налоговый режим отдаётся
+    # только на тарифе «Максимальный», иначе tax_regime пустой
+    URL = 'https://suggestions.dadata.ru/suggestions/api/4_1/rs/findById/party'
+    TAX_SYSTEMS = {'USN': 'УСН', 'ENVD': 'ЕНВД', 'ESHN': 'ЕСХН', 'SRP': 'СРП',
+                   'AUSN': 'АУСН', 'PSN': 'Патент', 'NPD': 'НПД'}
+
+    def __init__(self, token, url=None, timeout=3):
+        self.token    = token
+        self.url      = url or self.URL
+        self.timeout  = aiohttp.ClientTimeout(total=timeout)
+        self._session = None
+
+    async def lookup(self, inn):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=self.timeout, headers={'Authorization': f'Token {self.token}'})
+        async with self._session.post(self.url, json={'query': inn, 'count': 1}) as resp:
+            resp.raise_for_status()
+            suggestions = (await resp.json()).get('suggestions') or []
+        if not suggestions:
+            return None
+        data = suggestions[0].get('data') or {}
+        tax = (data.get('finance') or {}).get('tax_system')
+        return CompanyInfo(inn, suggestions[0].get('value'),
+                           (data.get('state') or {}).get('status'),
+                           self.TAX_SYSTEMS.get(tax, tax))
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+PROVIDERS = {'dadata': DadataProvider}
+
+
+def create_provider():
+    name = os.getenv('INN_PROVIDER', '')
+    if not name:
+        return None
+    return PROVIDERS[name](os.getenv('INN_PROVIDER_TOKEN'), url=os.getenv('INN_PROVIDER_URL'),
+                           timeout=float(os.getenv('INN_PROVIDER_TIMEOUT', 3)))
+
+
+_MISS = object()
+
+
+class InnService:
+    def __init__(self, provider, *, session_factory=SessionLocal, cache_size=10000,
+                 ttl=86400, negative_ttl=3600, db_ttl=30 * 86400):
+        self.provider        = provider
+        self.session_factory = session_factory
+        self.cache_size      = cache_size
+        self.ttl             = ttl
+        self.negative_ttl    = negative_ttl
+        self.db_ttl          = db_ttl
+        self._cache    = OrderedDict()   # inn -> (истекает, CompanyInfo | None)
+        self._inflight = {}              # inn -> задача загрузки
+
+    # -- кэш в памяти --
+
+    def _cache_get(self, inn):
+        item = self._cache.get(inn)
+        if item is None:
+            return _MISS
+        expires, info = item
+        if expires < time.monotonic():
+            del self._cache[inn]
+            return _MISS
+        self._cache.move_to_end(inn)
+        return info
+
+    def _cache_put(self, inn, info):
+        ttl = self.ttl if info is not None else self.negative_ttl
+        self._cache[inn] = (time.monotonic() + ttl, info)
+        self._cache.move_to_end(inn)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    # -- поиск --
+
+    async def lookup(self, inn, timeout=None):
+        # CompanyInfo, None (не найден, нет провайдера, ошибка или таймаут)
+        if self.provider is None or not is_valid_inn(inn):
+            return None
+        info = self._cache_get(inn)
+        if info is not _MISS:
+            LOOKUPS.inc(source='memory')
+            return info
+        task = self._inflight.get(inn)
+        if task is None:
+            task = self._inflight[inn] = asyncio.ensure_future(self._load(inn))
+            task.add_done_callback(lambda _: self._inflight.pop(inn, None))
+        else:
+            LOOKUPS.inc(source='joined')
+        try:
+            # shield: таймаут вызывающего не отменяет общую загрузку
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            LOOKUPS.inc(source='timeout')
+            return None
+
+    def prefetch(self, inn):
+        # Запустить загрузку заранее (на шаге ИНН), результат не нужен
+        if self.provider is not None and is_valid_inn(inn) and self._cache_get(inn) is _MISS:
+            asyncio.ensure_future(self.lookup(inn))
+
+    async def _load(self, inn):
+        try:
+            async with self.session_factory() as session:
+                row = await repository.get_inn_info(session, inn)
+        except Exception:
+            # база недоступна — идём к провайдеру
+            log.exception("INN info read failed for %s", inn)
+            row = None
+        # «не найден» в базе живёт negative_ttl, как и в памяти
+        ttl = self.db_ttl if row is not None and row.found else self.negative_ttl
+        if row is not None and row.fetched_at > datetime.utcnow() - timedelta(seconds=ttl):
+            info = CompanyInfo(inn, row.name, row.status, row.tax_regime) if row.found else None
+            LOOKUPS.inc(source='db')
+            self._cache_put(inn, info)
+            return info
+
+        try:
+            info = await self.provider.lookup(inn)
+        except Exception as e:
+            # ошибку не кэшируем — следующий запрос попробует снова
+            LOOKUPS.inc(source='error')
+            log.warning("INN provider failed for %s: %r", inn, e)
+            return None
+        LOOKUPS.inc(source='provider')
+        self._cache_put(inn, info)
+        try:
+            async with self.session_factory() as session:
+                await repository.upsert_inn_info(
+                    session, inn, found=info is not None, fetched_at=datetime.utcnow(),
+                    name=info and info.name, status=info and info.status,
+                    tax_regime=info and info.tax_regime)
+                await session.commit()
+        except Exception:
+            log.exception("INN info save failed for %s", inn)
+        return info
+
+    async def close(self):
+        for task in list(self._inflight.values()):
+            task.cancel()
+        await asyncio.gather(*self._inflight.values(), return_exceptions=True)
+        close = getattr(self.provider, 'close', None)
+        if close is not None:
+            await close()
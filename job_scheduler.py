@@ -0,0 +1,132 @@
+# job_scheduler.py
+# coding: utf-8
+#
+# Планировщик задач ботов на APScheduler с хранением в базе:
+#   - задания лежат в SQLAlchemyJobStore (SCHEDULER_DATABASE_URL, по
+#     умолчанию база бота), поэтому пропущенный за время простоя запуск
+#     выполняется при старте, если опоздание меньше SCHEDULER_MISFIRE_GRACE;
+#     несколько пропусков схлопываются в один (coalesce);
+#   - в хранилище пишется только ссылка job_scheduler:run_task и имя задачи,
+#     сама функция берётся из реестра TASKS — ссылка не зависит от того,
+#     как загружен модуль бота (напрямую или через launcher.py);
+#   - запуск захватывает строку job_leases (models.JobLease): при нескольких
+#     репликах с общей базой задачу выполняет ровно одна из них.
+# Задачи — корутины, они выполняются на цикле событий бота отдельными
+# задачами и не задерживают обработку вебхука.
+
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+
+from database import SessionLocal
+from models import DATABASE_URL, JobLease
+from schema import sync_url
+
+log = logging.getLogger(__name__)
+
+MISFIRE_GRACE = int(os.getenv('SCHEDULER_MISFIRE_GRACE', 3600))
+LEASE_TTL     = int(os.getenv('SCHEDULER_LEASE_TTL', 300))
+OWNER         = f"{socket.gethostname()}:{os.getpid()}"
+
+# имя задачи -> (корутинная функция, окно в секундах, в течение которого
+# повторный запуск с другой реплики считается тем же самым)
+TASKS = {}
+
+
+def task(name, *, window=600):
+    def register(fn):
+        TASKS[name] = (fn, window)
+        return fn
+    return register
+
+
+async def acquire_lease(name, window, ttl=LEASE_TTL):
+    # True — запуск наш. Строка захватывается одним UPDATE с условием, так
+    # что из двух реплик его выполнит только одна; чужая аренда истекает
+    # через ttl, если реплика упала посреди задачи.
+    now = datetime.utcnow()
+    async with SessionLocal() as session:
+        if await session.get(JobLease, name) is None:
+            session.add(JobLease(name=name))
+            try:
+                await session.commit()
+            except IntegrityError:
+                await session.rollback()
+        result = await session.execute(
+            update(JobLease)
+            .where(JobLease.name == name,
+                   or_(JobLease.expires_at.is_(None), JobLease.expires_at < now),
+                   or_(JobLease.started_at.is_(None),
+                       JobLease.started_at < now - timedelta(seconds=window)))
+            .values(owner=OWNER, started_at=now, expires_at=now + timedelta(seconds=ttl))
+        )
+        await session.commit()
+        return result.rowcount == 1
+
+
+async def release_lease(name, ok):
+    # После сбоя started_at сбрасывается — другая реплика может повторить
+    values = {'expires_at': None}
+    if not ok:
+        values['started_at'] = None
+    async with SessionLocal() as session:
+        await session.execute(
+            update(JobLease).where(JobLease.name == name, JobLease.owner == OWNER).values(**values)
+        )
+        await session.commit()
+
+
+async def run_task(name):
+    # Точка входа всех заданий в хранилище APScheduler
+    if name not in TASKS:
+        log.warning("Scheduler: задача %s не зарегистрирована", name)
+        return
+    fn, window = TASKS[name]
+    if not await acquire_lease(name, window):
+        log.info("Scheduler: %s уже выполняется другой репликой", name)
+        return
+    ok = False
+    try:
+        await fn()
+        ok = True
+    finally:
+        await release_lease(name, ok)
+
+
+def create_scheduler(name, url=None):
+    # name — имя бота: у каждого своя таблица заданий apscheduler_<name>
+    from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+    url = url or os.getenv('SCHEDULER_DATABASE_URL') or sync_url(DATABASE_URL)
+    if not isinstance(url, str):
+        url = url.render_as_string(hide_password=False)
+    return AsyncIOScheduler(
+        jobstores={'default': SQLAlchemyJobStore(url=url, tablename=f'apscheduler_{name}')},
+        job_defaults={'coalesce': True, 'misfire_grace_time': MISFIRE_GRACE, 'max_instances': 1},
+    )
+
+
+def start_cron_jobs(scheduler, jobs):
+    # jobs: {имя задачи: поля CronTrigger}. Задание из хранилища с тем же
+    # расписанием не трогаем — иначе потеряется его пропущенный запуск;
+    # изменённое расписание заменяем, лишние задания удаляем.
+    from apscheduler.triggers.cron import CronTrigger
+
+    scheduler.start(paused=True)
+    for name, fields in jobs.items():
+        trigger = CronTrigger(timezone=scheduler.timezone, **fields)
+        job = scheduler.get_job(name)
+        if job is not None and str(job.trigger) == str(trigger):
+            continue
+        scheduler.add_job(run_task, trigger, args=[name], id=name, name=name,
+                          replace_existing=True)
+    for job in scheduler.get_jobs():
+        if job.id not in jobs:
+            job.remove()
+    scheduler.resume()
+
@@ -0,0 +1,66 @@
+# launcher.py
+# coding: utf-8
+#
+# Оба бота в одном процессе на одном aiohttp-приложении: у каждого свой
+# путь вебхука (KUZKABUH_WEBHOOK_PATH, KUZKAINFO_WEBHOOK_PATH) и своя
+# очередь апдейтов, а aiogram, SQLAlchemy, aiohttp и общие модули
+# загружаются один раз. Боты стартуют и останавливаются параллельно.
+#
+#   LAUNCHER_BOTS=kuzkabuh,kuzkainfo LAUNCHER_PORT=8001 python launcher.py
+#
+# Отдельный запуск bots/<имя>_bot/bot.py по-прежнему работает.
+
+import asyncio
+import importlib.util
+import logging
+import os
+import sys
+
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+from webhook_pipeline import attach_webhook
+
+BOTS = {
+    'kuzkabuh':  'bots/kuzkabuh_bot/bot.py',
+    'kuzkainfo': 'bots/kuzkainfo_bot/bot.py',
+}
+
+
+def load_bot(name):
+    # Модули ботов не пакеты — загружаем по пути под уникальным именем
+    spec = importlib.util.spec_from_file_location(f'{name}_bot', os.path.join(ROOT, BOTS[name]))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def build_app(names):
+    app = web.Application()
+    hooks = []
+    for name in names:
+        module = load_bot(name)
+        hooks.append(attach_webhook(app, module.dp, module.WEBHOOK_PATH,
+                                    on_startup=module.on_startup,
+                                    on_shutdown=module.on_shutdown))
+
+    async def startup(app):
+        await asyncio.gather(*(start() for start, _ in hooks))
+
+    async def shutdown(app):
+        await asyncio.gather(*(stop() for _, stop in hooks), return_exceptions=True)
+
+    app.on_startup.append(startup)
+    app.on_shutdown.append(shutdown)
+    return app
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    names = [n.strip() for n in os.getenv('LAUNCHER_BOTS', ','.join(BOTS)).split(',') if n.strip()]
+    web.run_app(build_app(names),
+                host=os.getenv('LAUNCHER_HOST', '0.0.0.0'),
+                port=int(os.getenv('LAUNCHER_PORT', 8001)))
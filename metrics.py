@@ -0,0 +1,172 @@
+# metrics.py
+# coding: utf-8
+#
+# Минимальный реестр метрик в текстовом формате Prometheus (без внешних
+# зависимостей): счётчики, гистограммы и gauge с метками. Метрика с одним
+# именем создаётся один раз на процесс — боты в launcher.py пишут в общие
+# метрики с меткой bot. Отдача — render(), aiohttp-хэндлер handle или
+# token_handler(token) — то же, но только с токеном.
+
+import bisect
+import hmac
+import threading
+import time
+from contextlib import contextmanager
+
+# секунды: от быстрых хэндлеров до медленных внешних вызовов
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REGISTRY = {}
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels_text(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{v}"' for n, v in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, doc, labels=()):
+        self.name       = name
+        self.doc        = doc
+        self.labelnames = tuple(labels)
+        self._values    = {}
+        self._functions = {}
+        self._lock      = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def set_function(self, fn, **labels):
+        # значение считается в момент отдачи /metrics — для счётчиков,
+        # которые уже ведёт сам объект (очередь вебхука и т.п.)
+        self._functions[self._key(labels)] = fn
+
+    def header(self):
+        return [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} {self.kind}']
+
+    def render(self):
+        lines = self.header()
+        values = dict(self._values)
+        for key, fn in self._functions.items():
+            values[key] = fn()
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_labels_text(self.labelnames, key)} {value}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [счётчики по корзинам (не накопительные) + +Inf, сумма]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][i] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def render(self):
+        lines = self.header()
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket'
+                             f'{_labels_text(self.labelnames, key, [("le", le)])} {cumulative}')
+            labels = _labels_text(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+def _get_or_create(cls, name, *args, **kwargs):
+    with _registry_lock:
+        metric = REGISTRY.get(name)
+        if metric is None:
+            metric = REGISTRY[name] = cls(name, *args, **kwargs)
+        return metric
+
+
+def counter(name, doc, labels=()):
+    return _get_or_create(Counter, name, doc, labels)
+
+
+def gauge(name, doc, labels=()):
+    return _get_or_create(Gauge, name, doc, labels)
+
+
+def histogram(name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+    return _get_or_create(Histogram, name, doc, labels, buckets)
+
+
+def render():
+    lines = []
+    for metric in list(REGISTRY.values()):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+async def handle(request):
+    # aiohttp: GET /metrics
+    from aiohttp import web
+    return web.Response(body=render().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+
+def token_handler(token, handler=handle):
+    # aiohttp-хэндлер (по умолчанию /metrics), отвечающий только с токеном:
+    # «Authorization: Bearer <token>» (bearer_token в Prometheus) или ?token=
+    from aiohttp import web
+
+    async def handle_with_token(request):
+        auth = request.headers.get('Authorization', '')
+        given = auth[7:] if auth.startswith('Bearer ') else request.query.get('token', '')
+        if not hmac.compare_digest(given.encode(), token.encode()):
+            raise web.HTTPUnauthorized()
+        return await handler(request)
+
+    return handle_with_token
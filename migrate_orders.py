@@ -0,0 +1,175 @@
+# migrate_orders.py
+# coding: utf-8
+#
+# Перенос заявок из старых таблиц в общую zayavki (schema.Order) пачками.
+# Понимает все прежние раскладки:
+#   requests + users   — база бота (models.Request до общей схемы);
+#   zayavka            — admin/models.py и admin/instance/buhkuzka.db;
+#   zayavki            — Flask-Admin, в т.ч. старые столбцы "Date", "Inn", ...
+# Каждой строке назначается idempotency_key из (база, таблица, id), поэтому
+# повторный запуск ничего не дублирует, а прерванный — продолжается.
+#
+#   python migrate_orders.py sqlite:///kuzkabuh.db sqlite:///admin/instance/buhkuzka.db \
+#       --target "$ORDERS_DATABASE_URL" --batch 1000
+
+import argparse
+import hashlib
+import logging
+import os
+from datetime import datetime
+
+from sqlalchemy import MetaData, create_engine, select, insert
+from sqlalchemy.engine import make_url
+
+from schema import Order, metadata, upgrade_schema, sync_url
+
+log = logging.getLogger(__name__)
+
+LEGACY_TABLES = ('requests', 'zayavka', 'zayavki')
+
+# поле zayavki -> возможные имена в старых таблицах (без учёта регистра)
+ALIASES = {
+    'date':         ('date', 'created_at'),
+    'inn':          ('inn',),
+    'email':        ('email',),
+    'name':         ('name', 'contact_name'),
+    'phone':        ('phone',),
+    'contact_time': ('contact_time', 'time_to_call'),
+    'service':      ('service', 'services'),
+    'urgency':      ('urgency', 'urgent'),
+    'status':       ('status',),
+    'telegram_id':  ('telegram_id',),
+}
+USER_FIELDS = ('name', 'email', 'phone', 'telegram_id')
+DATE_FORMATS = ('%d.%m.%Y %H:%M', '%d.%m.%Y')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sources', nargs='+', help='адреса баз со старыми таблицами')
+    parser.add_argument('--target', default=os.getenv('ORDERS_DATABASE_URL'),
+                        help='база общей схемы (по умолчанию ORDERS_DATABASE_URL)')
+    parser.add_argument('--batch', type=int, default=1000)
+    return parser.parse_args()
+
+
+def db_label(url):
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite':
+        return os.path.abspath(url.database)
+    return url.render_as_string(hide_password=True)
+
+
+def parse_date(value):
+    if isinstance(value, datetime) or value is None:
+        return value
+    value = str(value).strip()
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return None
+
+
+def source_columns(table, users=None):
+    # {поле zayavki: колонка источника}
+    columns = {c.name.lower(): c for c in table.columns}
+    if users is not None:
+        for name in USER_FIELDS:
+            if name in users.c:
+                columns.setdefault(name, users.c[name])
+    picked = {}
+    for field, names in ALIASES.items():
+        column = next((columns[n] for n in names if n in columns), None)
+        if column is not None:
+            picked[field] = column
+    return picked
+
+
+def convert(values, key):
+    urgency = values.get('urgency')
+    if isinstance(urgency, bool):
+        values['urgency'] = "Срочно" if urgency else "Обычная"
+    row = {'idempotency_key': key,
+           'date': parse_date(values.get('date')) or datetime.now(),
+           'status': values.get('status') or 'new',
+           'telegram_id': values.get('telegram_id')}
+    for column in Order.__table__.columns:
+        if column.name in row or column.primary_key:
+            continue
+        value = values.get(column.name)
+        if value is None and column.nullable:
+            row[column.name] = None
+            continue
+        value = '' if value is None else str(value).strip()
+        row[column.name] = value[:column.type.length] if column.type.length else value
+    return row
+
+
+def migrate_table(source, target, label, table, users, batch):
+    picked = source_columns(table, users)
+    pk = table.primary_key.columns.values()[0]
+    query = select(pk.label('_pk'), *(c.label(f) for f, c in picked.items()))
+    if users is not None and 'user_id' in table.c:
+        query = query.select_from(table.outerjoin(users, table.c.user_id == users.c.id))
+    copied = skipped = 0
+    last = None
+    while True:
+        page = query.order_by(pk).limit(batch)
+        if last is not None:
+            page = page.where(pk > last)
+        with source.connect() as conn:
+            rows = conn.execute(page).mappings().all()
+        if not rows:
+            break
+        last = rows[-1]['_pk']
+        converted = [
+            convert(dict(r), hashlib.sha1(f"{label}|{table.name}|{r['_pk']}".encode()).hexdigest())
+            for r in rows
+        ]
+        with target.begin() as conn:
+            keys = [r['idempotency_key'] for r in converted]
+            known = set(conn.execute(select(Order.idempotency_key)
+                                     .where(Order.idempotency_key.in_(keys))).scalars())
+            fresh = [r for r in converted if r['idempotency_key'] not in known]
+            if fresh:
+                conn.execute(insert(Order.__table__), fresh)
+        copied += len(fresh)
+        skipped += len(converted) - len(fresh)
+    log.info("%s:%s — перенесено %s, уже были %s", label, table.name, copied, skipped)
+    return copied
+
+
+def main(args):
+    if not args.target:
+        raise SystemExit("--target или ORDERS_DATABASE_URL обязателен")
+    target = create_engine(sync_url(args.target))
+    with target.begin() as conn:
+        metadata.create_all(conn)
+        upgrade_schema(conn, metadata)
+
+    total = 0
+    for url in args.sources:
+        label = db_label(url)
+        source = create_engine(sync_url(url))
+        legacy = MetaData()
+        legacy.reflect(source, only=lambda name, _: name in LEGACY_TABLES + ('users',))
+        for name in LEGACY_TABLES:
+            if name not in legacy.tables:
+                continue
+            if name == Order.__tablename__ and label == db_label(args.target):
+                continue   # это и есть целевая таблица
+            users = legacy.tables.get('users') if name == 'requests' else None
+            total += migrate_table(source, target, label, legacy.tables[name], users, args.batch)
+        source.dispose()
+    log.info("Всего перенесено заявок: %s", total)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    main(parse_args())
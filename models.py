@@ -1,34 +1,95 @@
+import os
+
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, func
+from sqlalchemy import (Column, Integer, BigInteger, String, Boolean, Date, DateTime, JSON,
+                        LargeBinary, func, event)
 
-DATABASE_URL = "sqlite+aiosqlite:///kuzkabuh.db"
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///kuzkabuh.db")
 engine = create_async_engine(DATABASE_URL, echo=False)
+
+# WAL: читатели не блокируют писателя — базу делят несколько процессов бота
+def sqlite_pragmas(dbapi_conn, _):
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+if engine.dialect.name == "sqlite":
+    event.listen(engine.sync_engine, "connect", sqlite_pragmas)
+
 SessionLocal = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 Base = declarative_base()
 
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True)
-    telegram_id = Column(Integer, unique=True, nullable=False)
+    telegram_id = Column(BigInteger, unique=True, nullable=False)
     name = Column(String)
     email = Column(String)
     phone = Column(String)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
-class Request(Base):
-    __tablename__ = "requests"
-    id = Column(Integer, primary_key=True)
-    user_id = Column(Integer)
-    inn = Column(String)
-    services = Column(String)
-    urgent = Column(Boolean, default=False)
-    status = Column(String, default="new")
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-
 class Admin(Base):
     __tablename__ = "admins"
     id = Column(Integer, primary_key=True)
     username = Column(String, unique=True, nullable=False)
     password = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
+
+class OutboxOrder(Base):
+    # Локальная очередь заявок, ещё не доставленных в админку
+    __tablename__ = "outbox_orders"
+    id = Column(Integer, primary_key=True)
+    key = Column(String(36), unique=True, nullable=False)
+    payload = Column(JSON, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, nullable=False, index=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Отклонённые админкой (4xx): больше не отправляются, ждут разбора
+    failed_at = Column(DateTime, index=True)
+    error = Column(String)
+
+class FsmRecord(Base):
+    # Состояние FSM aiogram (см. fsm_storage.SQLiteStorage)
+    __tablename__ = "fsm_states"
+    chat = Column(String, primary_key=True)
+    user = Column(String, primary_key=True)
+    state = Column(String)
+    data = Column(JSON, nullable=False, default=dict)
+    bucket = Column(JSON, nullable=False, default=dict)
+    updated_at = Column(DateTime, nullable=False, index=True)
+
+class RateCurrency(Base):
+    # Валюта и её позиция в массиве значений RateSnapshot.values
+    __tablename__ = "rate_currencies"
+    code = Column(String(3), primary_key=True)
+    position = Column(Integer, unique=True, nullable=False)
+    name = Column(String)
+
+class RateSnapshot(Base):
+    # Курсы ЦБ за дату: array('d') курсов за 1 единицу по позициям валют, NaN — нет котировки
+    __tablename__ = "rate_history"
+    date = Column(Date, primary_key=True)
+    values = Column(LargeBinary, nullable=False)
+
+class JobLease(Base):
+    # Аренда запуска задачи планировщика (см. job_scheduler.py): строку
+    # захватывает одна реплика, остальные пропускают этот запуск
+    __tablename__ = "job_leases"
+    name = Column(String, primary_key=True)
+    owner = Column(String)
+    started_at = Column(DateTime)
+    expires_at = Column(DateTime)
+
+class InnInfo(Base):
+    # Ответ провайдера сведений об организации (см. inn_service.py);
+    # found=False — провайдер такого ИНН не знает
+    __tablename__ = "inn_info"
+    inn = Column(String(12), primary_key=True)
+    name = Column(String)
+    status = Column(String)
+    tax_regime = Column(String)
+    found = Column(Boolean, nullable=False, default=True)
+    fetched_at = Column(DateTime, nullable=False)
@@ -0,0 +1,160 @@
+# outbox.py
+# coding: utf-8
+#
+# Локальный outbox заявок: бот кладёт подтверждённую заявку в SQLite
+# (одна вставка) и сразу отвечает пользователю, а фоновая задача пачками
+# доставляет накопленное в API админки. Каждая заявка несёт
+# idempotency_key, поэтому повторная отправка после сбоя не создаёт дублей.
+# Сетевые ошибки и 5xx повторяются с растущей паузой; заявку, которую
+# админка отклонила (4xx), outbox больше не шлёт и помечает failed_at.
+
+import asyncio
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, delete
+
+from admin_client import AdminApiError
+from database import SessionLocal
+from models import OutboxOrder
+
+log = logging.getLogger(__name__)
+
+
+def new_key():
+    return str(uuid.uuid4())
+
+
+class Outbox:
+    def __init__(self, client, *, session_factory=SessionLocal,
+                 batch_size=50, interval=5.0, backoff=2.0, max_backoff=300.0):
+        self.client          = client
+        self.session_factory = session_factory
+        self.batch_size      = batch_size
+        self.interval        = interval
+        self.backoff         = backoff
+        self.max_backoff     = max_backoff
+        self._wakeup = None
+        self._task   = None
+
+    def add(self, session, order, key=None):
+        # Добавляет заявку в транзакцию вызывающего кода; после commit —
+        # wake(), чтобы фоновая задача отправила её сразу
+        key = key or new_key()
+        session.add(OutboxOrder(
+            key=key,
+            payload=dict(order, idempotency_key=key),
+            next_attempt_at=datetime.utcnow(),
+        ))
+        return key
+
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def put(self, order):
+        # Сохраняет заявку в outbox и возвращает её idempotency_key
+        async with self.session_factory() as session:
+            key = self.add(session, order)
+            await session.commit()
+        self.wake()
+        return key
+
+    async def flush(self):
+        # Одна пачка: отправить готовые к отправке заявки.
+        # Возвращает число обработанных заявок (доставленных и отклонённых).
+        async with self.session_factory() as session:
+            rows = (await session.execute(
+                select(OutboxOrder)
+                .where(OutboxOrder.failed_at.is_(None),
+                       OutboxOrder.next_attempt_at <= datetime.utcnow())
+                .order_by(OutboxOrder.id)
+                .limit(self.batch_size)
+            )).scalars().all()
+            if not rows:
+                return 0
+
+            delivered, rejected, retry = [], [], []
+            await self._send(rows, delivered, rejected, retry)
+
+            if retry:
+                log.warning("Outbox: %s заявок не доставлено: %s", len(retry), retry[0][1])
+            for r, _ in retry:
+                delay = min(self.backoff * 2 ** r.attempts, self.max_backoff)
+                await session.execute(
+                    update(OutboxOrder)
+                    .where(OutboxOrder.id == r.id)
+                    .values(attempts=r.attempts + 1,
+                            next_attempt_at=datetime.utcnow() + timedelta(seconds=delay))
+                )
+            for r, error in rejected:
+                # Пользователю уже ответили «принята» — заявка не должна
+                # пропасть молча: строка остаётся в outbox_orders с ошибкой
+                log.error("Outbox: админка отклонила заявку %s: %s; payload=%s",
+                          r.key, error, r.payload)
+                await session.execute(
+                    update(OutboxOrder)
+                    .where(OutboxOrder.id == r.id)
+                    .values(attempts=r.attempts + 1, failed_at=datetime.utcnow(),
+                            error=str(error)[:1000])
+                )
+            # Удаление по id идемпотентно: строка могла уже уйти с другого воркера
+            if delivered:
+                await session.execute(delete(OutboxOrder).where(
+                    OutboxOrder.id.in_([r.id for r in delivered])))
+            await session.commit()
+            return len(delivered) + len(rejected)
+
+    async def _send(self, rows, delivered, rejected, retry):
+        # Админка отвечает на пачку ошибками по индексам (207) — откладываем
+        # только отклонённые. Отказ 4xx на всю пачку делит её пополам, пока
+        # не останутся отдельные плохие заявки; остальные ошибки — повтор
+        try:
+            result = await self.client.post([r.payload for r in rows])
+        except AdminApiError as e:
+            if not e.permanent:
+                retry.extend((r, e) for r in rows)
+            elif len(rows) == 1:
+                rejected.append((rows[0], e))
+            else:
+                mid = len(rows) // 2
+                await self._send(rows[:mid], delivered, rejected, retry)
+                await self._send(rows[mid:], delivered, rejected, retry)
+            return
+        errors = {e['index']: e['errors'] for e in (result or {}).get('errors') or []}
+        for i, r in enumerate(rows):
+            if i in errors:
+                rejected.append((r, json.dumps(errors[i], ensure_ascii=False)))
+            else:
+                delivered.append(r)
+
+    async def run(self):
+        while True:
+            try:
+                while await self.flush() == self.batch_size:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("Outbox: ошибка фоновой отправки")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,182 @@
+# rates.py
+# coding: utf-8
+#
+# Курсы ЦБ РФ (зеркало cbr-xml-daily.ru) с кэшем в памяти и на диске.
+# Одна ClientSession на всё время жизни бота, условный GET (ETag /
+# If-Modified-Since). Устаревшие данные отдаются сразу, а обновление идёт
+# в фоне (stale-while-revalidate); при недоступности зеркала остаётся
+# последний удачный ответ. Снимки хранятся по дате ЦБ (поле Date) — и
+# текущий, и архивные за прошлые дни (они уже не меняются): ответ зеркала
+# со старой датой не затирает более новый снимок, а архив за уже знакомую
+# дату берётся из кэша без сети.
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import aiohttp
+
+log = logging.getLogger(__name__)
+
+CBR_DAILY = "https://www.cbr-xml-daily.ru/daily_json.js"
+
+
+class RatesUnavailable(Exception):
+    pass
+
+
+def cbr_date(data):
+    # "2026-10-18T11:30:00+03:00" -> "2026-10-18"
+    return data['Date'][:10]
+
+
+class CbrRates:
+    def __init__(self, url=CBR_DAILY, *, cache_path='cbr_daily.json', ttl=600, timeout=10,
+                 keep_days=45):
+        self.url        = url
+        self.cache_path = cache_path
+        self.ttl        = ttl
+        self.timeout    = aiohttp.ClientTimeout(total=timeout)
+        self.keep_days  = keep_days
+        self._session   = None
+        self._data      = None            # снимок с самой поздней датой
+        self._days      = OrderedDict()   # дата ЦБ -> снимок, по возрастанию
+        self._etag          = None
+        self._last_modified = None
+        self._fetched_at    = 0.0
+        self._refreshing    = None
+
+    # -- жизненный цикл --
+
+    async def start(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+        if self._data is None:
+            self._load_disk()
+
+    async def close(self):
+        if self._refreshing is not None:
+            self._refreshing.cancel()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    # -- дисковый кэш --
+
+    def _load_disk(self):
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return
+        # файл прежнего формата — один снимок в 'data'
+        days = cached.get('days') or ({cbr_date(cached['data']): cached['data']}
+                                      if cached.get('data') else {})
+        for data in days.values():
+            self._remember(data)
+        self._etag          = cached.get('etag')
+        self._last_modified = cached.get('last_modified')
+        # время загрузки неизвестно — считаем данные устаревшими
+
+    def _save_disk(self):
+        tmp = f"{self.cache_path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'days': self._days, 'etag': self._etag,
+                       'last_modified': self._last_modified}, f, ensure_ascii=False)
+        os.replace(tmp, self.cache_path)
+
+    def _remember(self, data):
+        day = cbr_date(data)
+        newest = next(reversed(self._days), None)
+        self._days[day] = data
+        if newest is not None and day < newest:
+            self._days = OrderedDict(sorted(self._days.items()))
+        while len(self._days) > self.keep_days:
+            self._days.popitem(last=False)
+        self._data = self._days[next(reversed(self._days))]
+
+    def day(self, day):
+        # Снимок на дату ЦБ ('2026-10-18') из кэша или None
+        return self._days.get(day)
+
+    # -- загрузка --
+
+    def is_fresh(self):
+        return self._data is not None and time.monotonic() - self._fetched_at < self.ttl
+
+    async def refresh(self):
+        if self._session is None:
+            await self.start()
+        headers = {}
+        if self._data is not None:
+            if self._etag:
+                headers['If-None-Match'] = self._etag
+            if self._last_modified:
+                headers['If-Modified-Since'] = self._last_modified
+
+        async with self._session.get(self.url, headers=headers) as resp:
+            if resp.status == 304:
+                self._fetched_at = time.monotonic()
+                return self._data
+            resp.raise_for_status()
+            # зеркало отдаёт application/javascript
+            data = await resp.json(content_type=None)
+            self._etag          = resp.headers.get('ETag')
+            self._last_modified = resp.headers.get('Last-Modified')
+
+        if 'Valute' not in data or 'Date' not in data:
+            raise RatesUnavailable("Unexpected CBR response")
+        # узел зеркала с отставанием может отдать снимок старше нашего
+        self._remember(data)
+        self._fetched_at = time.monotonic()
+        await asyncio.get_event_loop().run_in_executor(None, self._save_disk)
+        return self._data
+
+    async def archive(self, day, url):
+        # Снимок за прошлую дату: из кэша по дате ЦБ, иначе из архива
+        # зеркала (url — PreviousURL предыдущего снимка)
+        data = self._days.get(day)
+        if data is not None:
+            return data
+        if self._session is None:
+            await self.start()
+        async with self._session.get(url) as resp:
+            resp.raise_for_status()
+            data = await resp.json(content_type=None)
+        if 'Valute' not in data or 'Date' not in data:
+            raise RatesUnavailable("Unexpected CBR archive response")
+        self._remember(data)
+        await asyncio.get_event_loop().run_in_executor(None, self._save_disk)
+        return data
+
+    async def _refresh_quietly(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            log.warning("CBR refresh failed, serving stale data: %r", e)
+        finally:
+            self._refreshing = None
+
+    async def get(self, revalidate=False):
+        # Свежие данные — из памяти; устаревшие — тоже из памяти, но с
+        # фоновым обновлением; без данных вообще — ждём загрузку.
+        # revalidate=True — сначала спросить зеркало (для рассылок).
+        if revalidate and self._data is not None:
+            try:
+                return await self.refresh()
+            except Exception as e:
+                log.warning("CBR refresh failed, serving stale data: %r", e)
+                return self._data
+        if self.is_fresh():
+            return self._data
+        if self._data is not None:
+            if self._refreshing is None:
+                self._refreshing = asyncio.ensure_future(self._refresh_quietly())
+            return self._data
+        try:
+            return await self.refresh()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise RatesUnavailable(f"CBR unavailable: {e!r}") from e
@@ -0,0 +1,219 @@
+# rates_history.py
+# coding: utf-8
+#
+# История курсов ЦБ по всем валютам. В базе — одна строка rate_history на
+# дату (массив курсов по позициям валют), в памяти — колоночное хранилище:
+# отсортированный список дат и по массиву array('d') на валюту. Запросы
+# («последние N дней CNY», «изменение за неделю по всем валютам») идут по
+# памяти без обращения к сети. Пропущенные даты добираются по цепочке
+# PreviousURL архива ЦБ — только те, которых ещё нет.
+
+import bisect
+import logging
+import math
+from array import array
+from collections import OrderedDict
+from datetime import date, timedelta
+from urllib.parse import urljoin
+
+from sqlalchemy import select
+
+from database import SessionLocal
+from models import RateCurrency, RateSnapshot
+from schema import dialect_insert
+
+log = logging.getLogger(__name__)
+
+NAN = float('nan')
+
+
+def snapshot_date(data):
+    # "2026-10-18T11:30:00+03:00" -> date(2026, 10, 18)
+    return date.fromisoformat(data['Date'][:10])
+
+
+class RatesHistory:
+    def __init__(self, provider, *, session_factory=SessionLocal, max_backfill=30,
+                 render_cache_size=256):
+        self.provider        = provider
+        self.session_factory = session_factory
+        self.max_backfill    = max_backfill
+        self.dates     = []
+        self.index     = {}
+        self.columns   = {}
+        self.names     = {}
+        self.positions = {}
+        self.render_cache_size = render_cache_size
+        self._rendered = OrderedDict()
+        self._rendered_for = None
+
+    # -- колоночное хранилище в памяти --
+
+    def _ensure_currency(self, code, name=None):
+        if code not in self.columns:
+            self.positions[code] = len(self.positions)
+            self.columns[code] = array('d', [NAN] * len(self.dates))
+        if name:
+            self.names[code] = name
+
+    def _put(self, day, values):
+        # values: {код: курс за 1 единицу}
+        for code in values:
+            self._ensure_currency(code)
+        row = self.index.get(day)
+        if row is None and (not self.dates or day > self.dates[-1]):
+            row = self.index[day] = len(self.dates)
+            self.dates.append(day)
+            for column in self.columns.values():
+                column.append(NAN)
+        elif row is None:
+            # дата из прошлого (добор пропусков) — вставка в середину
+            row = bisect.bisect(self.dates, day)
+            self.dates.insert(row, day)
+            for column in self.columns.values():
+                column.insert(row, NAN)
+            self.index = {d: i for i, d in enumerate(self.dates)}
+        for code, value in values.items():
+            self.columns[code][row] = value
+
+    def _row_values(self, day):
+        row = self.index[day]
+        packed = array('d', [NAN] * len(self.positions))
+        for code, pos in self.positions.items():
+            packed[pos] = self.columns[code][row]
+        return packed
+
+    # -- база --
+
+    async def load(self):
+        async with self.session_factory() as session:
+            currencies = (await session.execute(
+                select(RateCurrency).order_by(RateCurrency.position))).scalars().all()
+            rows = (await session.execute(
+                select(RateSnapshot).order_by(RateSnapshot.date))).scalars().all()
+
+        codes = [c.code for c in currencies]
+        self.dates   = [r.date for r in rows]
+        self.index   = {d: i for i, d in enumerate(self.dates)}
+        self.positions = {code: i for i, code in enumerate(codes)}
+        self.names   = {c.code: c.name for c in currencies if c.name}
+        self.columns = {code: array('d', [NAN] * len(rows)) for code in codes}
+        for i, r in enumerate(rows):
+            packed = array('d')
+            packed.frombytes(r.values)
+            for code, value in zip(codes, packed):
+                self.columns[code][i] = value
+
+    async def _save(self, days):
+        async with self.session_factory() as session:
+            insert = dialect_insert(session.bind.dialect.name)
+            for code, pos in self.positions.items():
+                stmt = insert(RateCurrency).values(code=code, position=pos, name=self.names.get(code))
+                await session.execute(stmt.on_conflict_do_update(
+                    index_elements=[RateCurrency.code], set_={'name': stmt.excluded['name']}))
+            for day in days:
+                stmt = insert(RateSnapshot).values(date=day, values=self._row_values(day).tobytes())
+                await session.execute(stmt.on_conflict_do_update(
+                    index_elements=[RateSnapshot.date], set_={'values': stmt.excluded['values']}))
+            await session.commit()
+
+    # -- загрузка из ЦБ --
+
+    def _add(self, data):
+        values = {}
+        for code, v in data['Valute'].items():
+            self._ensure_currency(code, v.get('Name'))
+            values[code] = v['Value'] / v.get('Nominal', 1)
+        day = snapshot_date(data)
+        self._put(day, values)
+        return day
+
+    async def sync(self, revalidate=False):
+        # Добавляет свежий снимок и недостающие даты до него.
+        # Если дата снимка уже есть — ничего не делает (без сети при revalidate=False
+        # и свежем кэше провайдера).
+        data = await self.provider.get(revalidate)
+        if snapshot_date(data) in self.index:
+            return
+        changed = [self._add(data)]
+
+        # идём назад по PreviousURL до первой уже известной даты
+        url = data.get('PreviousURL')
+        for _ in range(self.max_backfill):
+            if not url:
+                break
+            try:
+                data = await self.provider.archive(data.get('PreviousDate', '')[:10],
+                                                   urljoin(self.provider.url, url))
+            except Exception as e:
+                log.warning("CBR archive %s unavailable: %r", url, e)
+                break
+            if snapshot_date(data) in self.index:
+                break
+            changed.append(self._add(data))
+            url = data.get('PreviousURL')
+        await self._save(changed)
+
+    # -- запросы --
+
+    def latest_date(self):
+        return self.dates[-1] if self.dates else None
+
+    def value(self, code, day):
+        row = self.index.get(day)
+        if row is None or code not in self.columns:
+            return None
+        value = self.columns[code][row]
+        return None if math.isnan(value) else value
+
+    def series(self, code, days):
+        # Последние days снимков по валюте: [(дата, курс), ...]
+        column = self.columns.get(code)
+        if column is None:
+            return []
+        start = max(0, len(self.dates) - days)
+        return [(d, v) for d, v in zip(self.dates[start:], column[start:]) if not math.isnan(v)]
+
+    def previous(self, code, day=None):
+        # Курс на ближайшую дату раньше day (по умолчанию — раньше последней)
+        column = self.columns.get(code)
+        day = day or self.latest_date()
+        if column is None or day is None:
+            return None
+        for row in range(bisect.bisect_left(self.dates, day) - 1, -1, -1):
+            if not math.isnan(column[row]):
+                return column[row]
+        return None
+
+    def changes(self, days=7):
+        # Изменение всех валют: последний снимок против снимка на (дата - days) или раньше
+        if not self.dates:
+            return []
+        last = len(self.dates) - 1
+        then = bisect.bisect_right(self.dates, self.dates[last] - timedelta(days=days)) - 1
+        if then < 0:
+            then = 0
+        result = []
+        for code, column in self.columns.items():
+            now_value, then_value = column[last], column[then]
+            if math.isnan(now_value) or math.isnan(then_value) or not then_value:
+                continue
+            result.append((code, now_value, then_value, (now_value / then_value - 1) * 100))
+        return result
+
+    def render(self, formatter, *args):
+        # Готовый текст кэшируется до появления нового снимка. Аргументы
+        # приходят от пользователей (/history XYZ 5) — кэш ограничен LRU
+        version = (self.latest_date(), len(self.dates))
+        if version != self._rendered_for:
+            self._rendered.clear()
+            self._rendered_for = version
+        key = (formatter, args)
+        text = self._rendered.get(key)
+        if text is None:
+            text = self._rendered[key] = formatter(self, *args)
+            if len(self._rendered) > self.render_cache_size:
+                self._rendered.popitem(last=False)
+        else:
+            self._rendered.move_to_end(key)
+        return text
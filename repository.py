@@ -0,0 +1,100 @@
+# repository.py
+# coding: utf-8
+#
+# Асинхронный слой доступа к пользователям и сведениям по ИНН (models.User,
+# models.InnInfo — база бота) и заявкам (schema.Order, база заявок — см.
+# database.OrderSession).
+# Функции принимают открытую AsyncSession и не коммитят — транзакцией
+# управляет вызывающий код. Upsert — INSERT ... ON CONFLICT в диалекте
+# базы сессии (SQLite или PostgreSQL). Списки — keyset-пагинация по id
+# (новые сверху): следующая страница запрашивается с курсором последней
+# строки, без OFFSET.
+
+from sqlalchemy import select, update
+
+from models import InnInfo, User
+from schema import Order, dialect_insert, order_row
+
+USER_FIELDS = ('name', 'email', 'phone')
+
+
+def _insert(session, model):
+    return dialect_insert(session.bind.dialect.name)(model)
+
+
+def page_cursor(rows):
+    # Курсор следующей страницы — id последней строки
+    return rows[-1].id if rows else None
+
+
+def _keyset(query, after, limit):
+    if after is not None:
+        query = query.where(Order.id < after)
+    return query.order_by(Order.id.desc()).limit(limit)
+
+
+async def upsert_users(session, users):
+    # Массовый upsert по telegram_id одним INSERT ... ON CONFLICT.
+    # users: [{'telegram_id': ..., 'name': ..., 'email': ..., 'phone': ...}, ...]
+    if not users:
+        return
+    rows = [{'telegram_id': u['telegram_id'], **{f: u.get(f) for f in USER_FIELDS}} for u in users]
+    stmt = _insert(session, User).values(rows)
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=[User.telegram_id],
+        set_={f: stmt.excluded[f] for f in USER_FIELDS},
+    ))
+
+
+async def upsert_user(session, telegram_id, **fields):
+    # Возвращает id пользователя
+    values = {f: fields.get(f) for f in USER_FIELDS}
+    stmt = _insert(session, User).values(telegram_id=telegram_id, **values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.telegram_id],
+        set_={f: stmt.excluded[f] for f in USER_FIELDS},
+    ).returning(User.id)
+    return (await session.execute(stmt)).scalar_one()
+
+
+async def create_order(session, telegram_id, order, *, key=None):
+    # Заявка из FSM бота; key — тот же idempotency_key, что уходит в API
+    # админки при двойной записи
+    row = Order(**order_row(order, telegram_id=telegram_id, idempotency_key=key))
+    session.add(row)
+    await session.flush()
+    return row
+
+
+async def list_user_orders(session, telegram_id, *, limit=20, after=None):
+    query = _keyset(select(Order).where(Order.telegram_id == telegram_id), after, limit)
+    return (await session.execute(query)).scalars().all()
+
+
+async def list_orders(session, *, status="new", urgency=None, limit=50, after=None):
+    query = select(Order).where(Order.status == status)
+    if urgency is not None:
+        query = query.where(Order.urgency == urgency)
+    return (await session.execute(_keyset(query, after, limit))).scalars().all()
+
+
+async def find_by_inn(session, inn, *, limit=20, after=None):
+    query = _keyset(select(Order).where(Order.inn == inn), after, limit)
+    return (await session.execute(query)).scalars().all()
+
+
+async def set_status(session, order_id, status):
+    await session.execute(update(Order).where(Order.id == order_id).values(status=status))
+
+
+async def get_inn_info(session, inn):
+    return await session.get(InnInfo, inn)
+
+
+async def upsert_inn_info(session, inn, *, found, fetched_at, **fields):
+    values = {f: fields.get(f) for f in ('name', 'status', 'tax_regime')}
+    stmt = _insert(session, InnInfo).values(inn=inn, found=found, fetched_at=fetched_at, **values)
+    await session.execute(stmt.on_conflict_do_update(
+        index_elements=[InnInfo.inn],
+        set_=dict(values, found=found, fetched_at=fetched_at),
+    ))
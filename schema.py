@@ -0,0 +1,146 @@
+# schema.py
+# coding: utf-8
+#
+# Общая схема заявок для бота (async SQLAlchemy) и админки (Flask-Admin).
+# Модуль не создаёт движков: бот подключает Order к своему AsyncEngine
+# (database.py), админка — к движку Flask-SQLAlchemy. Таблица zayavki —
+# единственное место хранения заявок; idempotency_key защищает от дублей
+# при двойной записи (напрямую в базу и через API админки).
+
+from datetime import datetime
+
+from sqlalchemy import (MetaData, Column, Integer, BigInteger, Boolean, String, DateTime, Index,
+                        func, inspect, select, text)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import declarative_base
+
+metadata = MetaData()
+OrderBase = declarative_base(metadata=metadata)
+
+ORDER_FIELDS = ('inn', 'email', 'name', 'phone', 'contact_time', 'service', 'urgency')
+# необязательные сведения об организации по ИНН (inn_service.py)
+COMPANY_FIELDS = ('company_name', 'company_status', 'tax_regime')
+
+
+class Order(OrderBase):
+    __tablename__ = 'zayavki'
+    id           = Column(Integer, primary_key=True)
+    date         = Column(DateTime, default=datetime.now, nullable=False)
+    inn          = Column(String(12), nullable=False)
+    email        = Column(String(120), nullable=False)
+    name         = Column(String(50), nullable=False)
+    phone        = Column(String(25), nullable=False)
+    contact_time = Column(String(40), nullable=False)
+    service      = Column(String(80), nullable=False)
+    urgency      = Column(String(30), nullable=False)
+    status       = Column(String(20), default='new', server_default='new')
+    # организация по ИНН — если провайдер ответил (см. inn_service.py)
+    company_name   = Column(String(255))
+    company_status = Column(String(30))
+    tax_regime     = Column(String(60))
+    # Telegram id автора — для заявок из бота
+    telegram_id  = Column(BigInteger)
+    # ключ идемпотентности от клиента API (повторная отправка не создаёт дубль)
+    idempotency_key = Column(String(64), unique=True, index=True)
+
+    # Индексы под список админки: сортировка по дате/№, фильтры по услуге и
+    # системе налогообложения (с id — для порядка «новые сверху» без сортировки)
+    # и префиксный поиск по ИНН/email/телефону. В PostgreSQL префиксный LIKE
+    # использует индекс только с varchar_pattern_ops. Выборки бота идут
+    # keyset-пагинацией по id: заявки пользователя и новые по статусу.
+    __table_args__ = (
+        Index('ix_zayavki_date', 'date', 'id'),
+        Index('ix_zayavki_service', 'service', 'id'),
+        Index('ix_zayavki_urgency', 'urgency', 'id'),
+        Index('ix_zayavki_inn', 'inn', postgresql_ops={'inn': 'varchar_pattern_ops'}),
+        Index('ix_zayavki_email', 'email', postgresql_ops={'email': 'varchar_pattern_ops'}),
+        Index('ix_zayavki_phone', 'phone', postgresql_ops={'phone': 'varchar_pattern_ops'}),
+        Index('ix_zayavki_telegram', 'telegram_id', 'id'),
+        Index('ix_zayavki_status', 'status', 'id'),
+        Index('ix_zayavki_status_urgency', 'status', 'urgency', 'id'),
+    )
+
+
+class Service(OrderBase):
+    # Справочник услуг для клавиатуры бота; правится в админке. id уходит
+    # в callback_data («svc:<id>»), в заявку пишется title.
+    __tablename__ = 'services'
+    id         = Column(Integer, primary_key=True)
+    title      = Column(String(80), nullable=False)
+    title_en   = Column(String(80))
+    position   = Column(Integer, default=0, server_default='0', nullable=False)
+    is_active  = Column(Boolean, default=True, server_default='1', nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+DEFAULT_SERVICES = [
+    ("Бухгалтерское обслуживание", "Accounting services"),
+    ("Регистрация ИП/ООО", "Company registration"),
+    ("Сдача отчетности", "Tax reporting"),
+    ("Консультация", "Consultation"),
+    ("Другое", "Other"),
+]
+
+
+def dialect_insert(name):
+    # insert() с on_conflict_do_* для диалекта базы (по имени диалекта)
+    return postgresql.insert if name == 'postgresql' else sqlite.insert
+
+
+def seed_services(conn):
+    # Пустой справочник заполняется прежним списком услуг бота;
+    # ON CONFLICT — на случай одновременного старта бота и админки
+    if conn.execute(select(func.count()).select_from(Service.__table__)).scalar():
+        return
+    conn.execute(dialect_insert(conn.dialect.name)(Service.__table__).on_conflict_do_nothing(), [
+        {'id': i, 'title': title, 'title_en': title_en, 'position': i,
+         'is_active': True, 'updated_at': datetime.now()}
+        for i, (title, title_en) in enumerate(DEFAULT_SERVICES, 1)
+    ])
+    if conn.dialect.name == 'postgresql':
+        # id заданы явно — сдвигаем последовательность, иначе первая
+        # услуга из админки получит занятый id
+        conn.execute(text("SELECT setval(pg_get_serial_sequence('services', 'id'), "
+                          "(SELECT max(id) FROM services))"))
+
+
+def order_row(order, **extra):
+    # Заявка из FSM бота / JSON API -> значения колонок zayavki
+    row = {f: str(order.get(f) or '').strip() for f in ORDER_FIELDS}
+    row.update({f: order[f] for f in COMPANY_FIELDS if order.get(f)})
+    row.update(extra)
+    return row
+
+
+def upgrade_schema(conn, metadata):
+    # create_all не меняет существующие таблицы: добавляем недостающие
+    # колонки (nullable или с серверным значением по умолчанию) и индексы
+    insp = inspect(conn)
+    for table in metadata.sorted_tables:
+        existing = {c['name'] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in existing or not (col.nullable or col.server_default is not None):
+                continue
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(dialect=conn.dialect)}'
+            if col.server_default is not None:
+                ddl += f" DEFAULT '{col.server_default.arg}'"
+            conn.execute(text(ddl))
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+# Один адрес базы заявок для обеих сторон: админка подключается
+# синхронным драйвером, бот — асинхронным
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+SYNC_DRIVERS  = {'sqlite': 'sqlite', 'postgresql': 'postgresql'}
+
+
+def async_url(url):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+def sync_url(url):
+    url = make_url(url)
+    return url.set(drivername=SYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
@@ -0,0 +1,90 @@
+# service_catalog.py
+# coding: utf-8
+#
+# Справочник услуг (schema.Service) для клавиатуры бота. Услуги правятся в
+# админке и читаются из её базы (database.OrderSession); бот держит снимок
+# в памяти и раз в ttl секунд одним лёгким запросом (число строк и
+# последний updated_at) проверяет, не поменялся ли справочник. Снимок даёт поиск услуги по id за O(1) и готовую клавиатуру
+# на каждый язык; callback_data — «svc:<id>», всегда короче 64 байт.
+
+import asyncio
+import time
+from collections import namedtuple
+
+from sqlalchemy import func, select
+
+from schema import Service
+from texts import DEFAULT_LOCALE, build_keyboard
+
+CALLBACK_PREFIX = 'svc:'
+
+ServiceItem = namedtuple('ServiceItem', 'id title titles')
+
+
+class Services:
+    def __init__(self, items, version):
+        self.version    = version
+        self.items      = items
+        self.by_id      = {item.id: item for item in items}
+        self.by_title   = {item.title: item for item in items}
+        self._keyboards = {}
+
+    def title(self, service_id, locale=DEFAULT_LOCALE):
+        # None — услуги нет или она выключена
+        item = self.by_id.get(service_id)
+        if item is None:
+            return None
+        return item.titles.get(locale) or item.title
+
+    def keyboard(self, locale=DEFAULT_LOCALE):
+        markup = self._keyboards.get(locale)
+        if markup is None:
+            markup = self._keyboards[locale] = build_keyboard(
+                1, [(self.title(item.id, locale), f'{CALLBACK_PREFIX}{item.id}') for item in self.items])
+        return markup
+
+
+def parse_callback(data):
+    # «svc:12» -> 12; чужие и испорченные данные -> None
+    if not data.startswith(CALLBACK_PREFIX):
+        return None
+    try:
+        return int(data[len(CALLBACK_PREFIX):])
+    except ValueError:
+        return None
+
+
+class ServiceCatalog:
+    def __init__(self, session_factory, *, ttl=30):
+        self.session_factory = session_factory
+        self.ttl       = ttl
+        self._snapshot = None
+        self._checked  = 0.0
+        self._lock     = asyncio.Lock()
+
+    async def get(self):
+        if self._snapshot is not None and time.monotonic() - self._checked < self.ttl:
+            return self._snapshot
+        async with self._lock:
+            if self._snapshot is None or time.monotonic() - self._checked >= self.ttl:
+                await self._refresh()
+        return self._snapshot
+
+    def invalidate(self):
+        # Следующий get() сверится с базой (устаревшая кнопка у пользователя)
+        self._checked = 0.0
+
+    async def _refresh(self):
+        async with self.session_factory() as session:
+            version = tuple((await session.execute(
+                select(func.count(), func.max(Service.updated_at))
+            )).one())
+            if self._snapshot is None or version != self._snapshot.version:
+                rows = (await session.execute(
+                    select(Service).where(Service.is_active.is_(True))
+                    .order_by(Service.position, Service.id)
+                )).scalars().all()
+                items = [ServiceItem(r.id, r.title, {'en': r.title_en} if r.title_en else {})
+                         for r in rows]
+                self._snapshot = Services(items, version)
+        self._checked = time.monotonic()
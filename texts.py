@@ -0,0 +1,83 @@
+# texts.py
+# coding: utf-8
+#
+# Тексты и клавиатуры ботов по языкам. Шаблон разбирается один раз при
+# загрузке каталога; при отправке остаётся склеить готовые куски с
+# подстановками, экранированными для parse_mode=HTML (разметка — только в
+# самом шаблоне). Клавиатура собирается при первом запросе и дальше
+# отдаётся из кэша по (имя, язык).
+#
+#   texts = Texts({'ru': {...}, 'en': {...}})
+#   texts.render('order_summary', 'en', inn=..., ...)
+#   keyboards = Keyboards(texts, {'confirm': (2, [('btn_confirm', 'confirm'), ...])})
+#   keyboards.get('confirm', 'en')
+
+import html
+import string
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+DEFAULT_LOCALE = 'ru'
+
+
+class Template:
+    # Поддерживаются только подстановки {имя}; {{ и }} — литеральные скобки
+    __slots__ = ('parts',)
+
+    def __init__(self, source):
+        self.parts = tuple((literal, field)
+                           for literal, field, _, _ in string.Formatter().parse(source))
+
+    def render(self, values):
+        out = []
+        for literal, field in self.parts:
+            out.append(literal)
+            if field is not None:
+                out.append(html.escape(str(values[field]), quote=False))
+        return ''.join(out)
+
+
+class Texts:
+    def __init__(self, catalog, default=DEFAULT_LOCALE):
+        self.default    = default
+        self._raw       = catalog
+        self._templates = {loc: {key: Template(src) for key, src in messages.items()}
+                           for loc, messages in catalog.items()}
+
+    def locale(self, language_code):
+        # 'en-US' -> 'en'; незнакомый язык — язык по умолчанию
+        code = (language_code or '').split('-')[0].lower()
+        return code if code in self._templates else self.default
+
+    def text(self, key, locale=DEFAULT_LOCALE):
+        # Строка как есть, без подстановок (надписи кнопок)
+        messages = self._raw.get(locale, {})
+        return messages[key] if key in messages else self._raw[self.default][key]
+
+    def render(self, key, locale=DEFAULT_LOCALE, **values):
+        templates = self._templates.get(locale, {})
+        template = templates.get(key) or self._templates[self.default][key]
+        return template.render(values)
+
+
+def build_keyboard(row_width, buttons):
+    # buttons: [(надпись, callback_data), ...]
+    return InlineKeyboardMarkup(row_width=row_width).add(
+        *(InlineKeyboardButton(text, callback_data=data) for text, data in buttons)
+    )
+
+
+class Keyboards:
+    # specs: имя -> (ширина ряда, [(ключ надписи в Texts, callback_data), ...])
+    def __init__(self, texts, specs):
+        self.texts  = texts
+        self.specs  = specs
+        self._cache = {}
+
+    def get(self, name, locale=DEFAULT_LOCALE):
+        markup = self._cache.get((name, locale))
+        if markup is None:
+            row_width, buttons = self.specs[name]
+            markup = self._cache[name, locale] = build_keyboard(
+                row_width, [(self.texts.text(key, locale), data) for key, data in buttons])
+        return markup
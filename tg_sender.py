@@ -0,0 +1,203 @@
+# tg_sender.py
+# coding: utf-8
+#
+# Планировщик исходящих сообщений Telegram для обоих ботов.
+# Ограничения скорости — корзины токенов: общая на бота (~30 сообщений/с)
+# и своя на каждый чат (1/с в личке, 20/мин в группе). У каждого чата своя
+# очередь, поэтому медленный чат не задерживает остальные. RetryAfter от
+# Telegram выдерживается и сообщение отправляется повторно. Частые
+# уведомления в один чат (notify) за короткое окно склеиваются в дайджест.
+
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from html import escape, unescape
+
+from aiogram.utils.exceptions import RetryAfter, NetworkError
+
+log = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096
+TAG_RE = re.compile(r'<[^>]*>')
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate     = rate
+        self.capacity = capacity
+        self.tokens   = capacity
+        self.updated  = time.monotonic()
+
+    def reserve(self):
+        # Забирает токен и возвращает, сколько секунд ждать до отправки
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+def split_plain(text, limit, html=False):
+    # Текст длиннее limit: разрез внутри тега или сущности HTML Telegram
+    # отвергнет вместе со всем сообщением, поэтому разметку убираем и режем
+    # голый текст (для HTML — заново экранированный) на куски до limit
+    if html:
+        text = unescape(TAG_RE.sub('', text))
+    parts, current = [], ''
+    for char in text:
+        piece = escape(char, quote=False) if html else char
+        if len(current) + len(piece) > limit:
+            parts.append(current)
+            current = ''
+        current += piece
+    if current:
+        parts.append(current)
+    return parts
+
+
+def pack_messages(texts, header=None, limit=MESSAGE_LIMIT, html=False):
+    # Склеивает тексты в как можно меньшее число сообщений не длиннее limit;
+    # режутся только по границам текстов, слишком длинный — split_plain
+    chunks, current = [], header or ''
+    for text in texts:
+        candidate = f"{current}\n\n{text}" if current else text
+        if len(candidate) <= limit:
+            current = candidate
+            continue
+        if current:
+            chunks.append(current)
+        current = text
+        if len(text) > limit:
+            *parts, current = split_plain(text, limit, html)
+            chunks.extend(parts)
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class MessageScheduler:
+    def __init__(self, bot, *, global_rate=30, private_rate=1.0, group_rate=20 / 60,
+                 digest_window=3.0, digest_header="📬 Новых сообщений: {count}",
+                 max_retries=3):
+        self.bot           = bot
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.private_rate  = private_rate
+        self.group_rate    = group_rate
+        self.digest_window = digest_window
+        self.digest_header = digest_header
+        self.max_retries   = max_retries
+        self._buckets = {}
+        self._paused  = {}
+        self._digests = {}
+        self._queues  = {}
+        self._tasks   = {}
+        self.sent    = 0
+        self.failed  = 0
+        self.retried = 0
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            # у групп и каналов id отрицательные (или @username канала)
+            is_group = str(chat_id).startswith(('-', '@'))
+            rate = self.group_rate if is_group else self.private_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, max(1, rate * 3))
+        return bucket
+
+    # -- отправка --
+
+    def send(self, chat_id, text, **kwargs):
+        # Ставит сообщение в очередь; возвращает future с результатом send_message
+        future = asyncio.get_event_loop().create_future()
+        self._queues.setdefault(chat_id, deque()).append((text, kwargs, future))
+        if chat_id not in self._tasks:
+            self._tasks[chat_id] = asyncio.ensure_future(self._drain(chat_id))
+        return future
+
+    def notify(self, chat_id, text, **kwargs):
+        # Уведомление: всё, что пришло в чат за digest_window, уходит одним сообщением
+        digest = self._digests.get(chat_id)
+        if digest is None:
+            digest = self._digests[chat_id] = ([], kwargs)
+            asyncio.get_event_loop().call_later(self.digest_window, self._flush_digest, chat_id)
+        digest[0].append(text)
+
+    def _flush_digest(self, chat_id):
+        texts, kwargs = self._digests.pop(chat_id, ([], {}))
+        if not texts:
+            return
+        header = self.digest_header.format(count=len(texts)) if len(texts) > 1 else None
+        html = str(kwargs.get('parse_mode', '')).lower() == 'html'
+        for chunk in pack_messages(texts, header, html=html):
+            self.send(chat_id, chunk, **kwargs)
+
+    async def _deliver(self, chat_id, text, kwargs):
+        attempt = 0
+        while True:
+            delay = max(self.global_bucket.reserve(), self._bucket(chat_id).reserve(),
+                        self._paused.get(chat_id, 0) - time.monotonic())
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await self.bot.send_message(chat_id, text, **kwargs)
+            except RetryAfter as e:
+                # Telegram сам говорит, сколько ждать — попытку не тратим
+                self.retried += 1
+                self._paused[chat_id] = time.monotonic() + e.timeout
+                log.warning("RetryAfter %s s for chat %s", e.timeout, chat_id)
+            except NetworkError as e:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.retried += 1
+                log.warning("Network error for chat %s: %s", chat_id, e)
+                await asyncio.sleep(2 ** attempt)
+
+    async def _drain(self, chat_id):
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                text, kwargs, future = queue.popleft()
+                try:
+                    result = await self._deliver(chat_id, text, kwargs)
+                    self.sent += 1
+                    if not future.done():
+                        future.set_result(result)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.failed += 1
+                    log.error("Message to %s failed: %s", chat_id, e)
+                    if not future.done():
+                        future.set_exception(e)
+                        future.exception()  # не ругаться, если результат никто не ждёт
+        finally:
+            del self._queues[chat_id]
+            del self._tasks[chat_id]
+
+    # -- жизненный цикл --
+    # Очереди и задачи создаются по требованию, запускать нечего
+
+    async def stop(self, timeout=10.0):
+        for chat_id in list(self._digests):
+            self._flush_digest(chat_id)
+        tasks = list(self._tasks.values())
+        if not tasks:
+            return
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            log.warning("MessageScheduler: undelivered messages dropped on shutdown")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def stats(self):
+        return {
+            'queued':  sum(len(q) for q in self._queues.values()),
+            'chats':   len(self._queues),
+            'sent':    self.sent,
+            'failed':  self.failed,
+            'retried': self.retried,
+        }
@@ -0,0 +1,285 @@
+# webhook_pipeline.py
+# coding: utf-8
+#
+# Приём апдейтов вебхука через очередь: HTTP-ответ Telegram уходит сразу,
+# апдейт кладётся в очередь своего чата. Апдейты одного чата обрабатываются
+# по порядку, разные чаты — параллельно, но не больше workers хэндлеров
+# одновременно. Ожидающих апдейтов не больше queue_size: сверх этого
+# вебхук отвечает 503 — Telegram повторит позже.
+#
+# Режим задаётся переменной WEBHOOK_MODE:
+#   queue    (по умолчанию) — этот конвейер;
+#   executor — штатный aiogram.utils.executor.start_webhook.
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
+from aiohttp import web
+
+import metrics
+from bot_metrics import instrument_pipeline
+
+log = logging.getLogger(__name__)
+
+
+def chat_key(update):
+    # Ключ очереди, в которой апдейты обрабатываются по порядку
+    for kind in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if kind in update:
+            return update[kind]['chat']['id']
+    cq = update.get('callback_query')
+    if cq:
+        msg = cq.get('message')
+        return msg['chat']['id'] if msg else cq['from']['id']
+    for kind in ('inline_query', 'chosen_inline_result', 'my_chat_member', 'chat_member',
+                 'chat_join_request', 'shipping_query', 'pre_checkout_query'):
+        if kind in update:
+            obj = update[kind]
+            return obj.get('chat', obj.get('from', {})).get('id', 0)
+    return update.get('update_id', 0)
+
+
+class UpdatePipeline:
+    # workers — предел одновременно работающих хэндлеров, а не число
+    # закреплённых за чатами воркеров: свободный слот берёт любой чат
+    def __init__(self, dispatcher, *, workers=64, queue_size=1000,
+                 put_timeout=1.0, drain_timeout=10.0, dedup_size=10000):
+        self.dispatcher    = dispatcher
+        self.workers       = workers
+        self.queue_size    = queue_size
+        self.put_timeout   = put_timeout
+        self.drain_timeout = drain_timeout
+        self.dedup_size    = dedup_size
+        self._chats   = {}     # ключ чата -> deque((принят, апдейт))
+        self._runners = {}     # ключ чата -> задача, разбирающая его очередь
+        self._slots   = None   # Semaphore(workers) — обработка
+        self._space   = None   # Semaphore(queue_size) — ожидающие апдейты
+        self._queued  = 0
+        self._seen    = OrderedDict()
+        self._latencies = deque(maxlen=1000)
+        self.processed  = 0
+        self.failed     = 0
+        self.rejected   = 0
+        self.duplicates = 0
+
+    # -- очередь --
+
+    def _is_duplicate(self, update_id):
+        # Telegram повторяет апдейт, если не дождался ответа
+        if update_id is None:
+            return False
+        if update_id in self._seen:
+            return True
+        self._seen[update_id] = None
+        if len(self._seen) > self.dedup_size:
+            self._seen.popitem(last=False)
+        return False
+
+    async def submit(self, update):
+        # True — апдейт принят (или уже был принят), False — очередь полна
+        update_id = update.get('update_id')
+        if self._is_duplicate(update_id):
+            self.duplicates += 1
+            return True
+
+        if self._space.locked():
+            try:
+                await asyncio.wait_for(self._space.acquire(), self.put_timeout)
+            except asyncio.TimeoutError:
+                self._seen.pop(update_id, None)
+                self.rejected += 1
+                return False
+        else:
+            await self._space.acquire()   # место есть — без ожидания
+
+        key = chat_key(update)
+        self._chats.setdefault(key, deque()).append((time.monotonic(), update))
+        self._queued += 1
+        if key not in self._runners:
+            self._runners[key] = asyncio.ensure_future(self._run_chat(key))
+        return True
+
+    async def _run_chat(self, key):
+        # Одна задача на чат с ожидающими апдейтами; заканчивается, когда
+        # очередь чата опустела
+        pending = self._chats[key]
+        try:
+            Dispatcher.set_current(self.dispatcher)
+            Bot.set_current(self.dispatcher.bot)
+            while pending:
+                async with self._slots:
+                    received, data = pending.popleft()
+                    self._queued -= 1
+                    self._space.release()
+                    await self._process(received, data)
+        finally:
+            del self._chats[key]
+            del self._runners[key]
+
+    async def _process(self, received, data):
+        try:
+            # отдельная задача — отдельный контекст, как у обычного
+            # запроса вебхука (aiogram хранит текущий апдейт в contextvars);
+            # process_updates, а не process_update — иначе не сработают
+            # middleware уровня апдейта (bot_metrics.HandlerMetrics)
+            await asyncio.ensure_future(self.dispatcher.process_updates([types.Update(**data)]))
+            self.processed += 1
+        except Exception:
+            self.failed += 1
+            log.exception("Update %s failed", data.get('update_id'))
+        finally:
+            self._latencies.append(time.monotonic() - received)
+
+    async def start(self, app=None):
+        self._slots = asyncio.Semaphore(self.workers)
+        self._space = asyncio.Semaphore(self.queue_size)
+
+    async def stop(self, app=None):
+        # Дорабатываем то, что уже принято, но не дольше drain_timeout
+        deadline = time.monotonic() + self.drain_timeout
+        while self._runners:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                log.warning("Webhook pipeline: %s updates dropped on shutdown", self.depth())
+                break
+            await asyncio.wait(list(self._runners.values()), timeout=timeout)
+        runners = list(self._runners.values())
+        for task in runners:
+            task.cancel()
+        await asyncio.gather(*runners, return_exceptions=True)
+
+    # -- метрики --
+
+    def depth(self):
+        # принятые, но ещё не начатые апдейты
+        return self._queued
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+
+        def pct(p):
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))]
+
+        return {
+            'queue_depth': self.depth(),
+            'queue_size':  self.queue_size,
+            'workers':     self.workers,
+            'processed':   self.processed,
+            'failed':      self.failed,
+            'rejected':    self.rejected,
+            'duplicates':  self.duplicates,
+            'latency_p50': round(pct(50), 4),
+            'latency_p95': round(pct(95), 4),
+            'latency_max': round(latencies[-1], 4) if latencies else 0.0,
+        }
+
+    # -- aiohttp --
+
+    async def handle(self, request):
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if await self.submit(update):
+            return web.Response(text='ok')
+        return web.Response(status=503, headers={'Retry-After': '1'})
+
+    async def handle_stats(self, request):
+        return web.json_response(self.stats())
+
+    def routes(self, app, path, stats_token=None):
+        # <path>/stats открыт наружу вместе с вебхуком — только с токеном
+        app.router.add_post(path, self.handle)
+        if stats_token:
+            app.router.add_get(f"{path.rstrip('/')}/stats",
+                               metrics.token_handler(stats_token, self.handle_stats))
+
+    def setup(self, app, path, stats_token=None):
+        self.routes(app, path, stats_token)
+        app.on_startup.append(self.start)
+        app.on_shutdown.append(self.stop)
+
+
+def api_server():
+    # TELEGRAM_API_SERVER — свой Bot API сервер (или заглушка в нагрузочных тестах)
+    url = os.getenv('TELEGRAM_API_SERVER')
+    return TelegramAPIServer.from_base(url) if url else TELEGRAM_PRODUCTION
+
+
+async def ensure_webhook(bot, url, **kwargs):
+    # set_webhook только если Telegram ещё не шлёт апдейты на этот адрес:
+    # при обычном перезапуске регистрация не трогается, а накопившиеся за
+    # время рестарта апдейты доставляются. Возвращает True, если вебхук ставился.
+    info = await bot.get_webhook_info()
+    allowed = kwargs.get('allowed_updates')
+    if info.url == url and (allowed is None or set(info.allowed_updates or ()) == set(allowed)):
+        return False
+    await bot.set_webhook(url, **kwargs)
+    return True
+
+
+def attach_webhook(app, dispatcher, webhook_path, *, on_startup=None, on_shutdown=None):
+    # Подключает бота к aiohttp-приложению: маршруты вебхука, статистики и /metrics.
+    # Возвращает (startup, shutdown) — их вызывает владелец приложения
+    # (run_webhook или launcher.py, где на одном приложении несколько ботов).
+    pipeline = UpdatePipeline(
+        dispatcher,
+        workers=int(os.getenv('WEBHOOK_WORKERS', 64)),
+        queue_size=int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000)),
+    )
+    # Порт вебхука открыт наружу, поэтому /metrics и <path>/stats отдаются
+    # только с METRICS_TOKEN; без него эти маршруты не регистрируются
+    metrics_token = os.getenv('METRICS_TOKEN')
+    pipeline.routes(app, webhook_path, metrics_token)
+    instrument_pipeline(pipeline, webhook_path)
+    # /metrics один на приложение, сколько бы ботов на нём ни было
+    metrics_path  = os.getenv('METRICS_PATH', '/metrics')
+    if metrics_token and not any(r.canonical == metrics_path for r in app.router.resources()):
+        app.router.add_get(metrics_path, metrics.token_handler(metrics_token))
+
+    async def startup():
+        await pipeline.start()
+        if on_startup is not None:
+            await on_startup(dispatcher)
+
+    async def shutdown():
+        # сначала дорабатываем принятые апдейты, потом закрываем ресурсы бота
+        # хранилище FSM закрывается только здесь, не в on_shutdown бота
+        await pipeline.stop()
+        if on_shutdown is not None:
+            await on_shutdown(dispatcher)
+        await dispatcher.storage.close()
+        await dispatcher.storage.wait_closed()
+        await dispatcher.bot.close()
+
+    return startup, shutdown
+
+
+def run_webhook(dispatcher, webhook_path, *, on_startup=None, on_shutdown=None,
+                skip_updates=False, host='0.0.0.0', port=8080):
+    # skip_updates действует только в режиме executor; в режиме очереди
+    # вебхук не удаляется при старте (см. ensure_webhook)
+    if os.getenv('WEBHOOK_MODE', 'queue') == 'executor':
+        from aiogram.utils.executor import start_webhook
+        return start_webhook(
+            dispatcher=dispatcher,
+            webhook_path=webhook_path,
+            on_startup=on_startup,
+            on_shutdown=on_shutdown,
+            skip_updates=skip_updates,
+            host=host, port=port
+        )
+
+    app = web.Application()
+    startup, shutdown = attach_webhook(app, dispatcher, webhook_path,
+                                       on_startup=on_startup, on_shutdown=on_shutdown)
+    app.on_startup.append(lambda app: startup())
+    app.on_shutdown.append(lambda app: shutdown())
+    web.run_app(app, host=host, port=port)